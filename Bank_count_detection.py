@@ -3,29 +3,68 @@ import base64
 import os
 import uuid
 import redis
-import shutil
+import redis.asyncio
 import sqlite3
-from fastapi import FastAPI, Request, Query
-from fastapi.responses import RedirectResponse
+from urllib.parse import urlsplit
+from fastapi import BackgroundTasks, FastAPI, Header, Request, Query
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, RedirectResponse, PlainTextResponse, StreamingResponse
 from google_auth_oauthlib.flow import Flow
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 
+from bank_pdf import batch, memory, metrics, ratelimit, search, statements, store, users
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except Exception:
+    pass
+
 app = FastAPI(title="Email Statement Parser")
 
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
-# Redis
-r = redis.StrictRedis(host="localhost", port=6379, db=0)
+# Redis (BANK_PDF_REDIS_URL, default redis://localhost:6379/0)
+r = redis.StrictRedis.from_url(ratelimit.REDIS_URL)
+# Event streams block in XREAD; they wait on the event loop instead of a threadpool thread each
+ar = redis.asyncio.StrictRedis.from_url(ratelimit.REDIS_URL)
+# Gmail and LLM rate limits are shared through the same instance
+ratelimit.use_redis(r)
 
 # Temp folder for PDFs
 TEMP_DIR = "temp_pdfs"
 
-# SQLite path (absolute)
-DB_PATH = os.path.join(os.path.dirname(__file__), "users.db")
+# SQLite path (absolute): users.db next to this file, or BANK_PDF_DB
+DB_PATH = users.DEFAULT_DB_PATH
 
 SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
 
+# OAuth client and Gmail API; the load-test harness points these at local stubs
+CLIENT_SECRETS = os.environ.get("GOOGLE_CLIENT_SECRETS", "credentials.json")
+REDIRECT_URI = os.environ.get("INGEST_REDIRECT_URI", "http://localhost:8000/oauth/callback")
+GMAIL_API_URL = os.environ.get("INGEST_GMAIL_API_URL")
+
+# Page the browser lands on after OAuth; it follows the job's progress from there
+UI_URL = os.environ.get("INGEST_UI_URL", "http://localhost:5173/connect-gmail")
+
+# Unlock and extract each statement as soon as it is downloaded. Set to 0 when
+# `python main.py watch` processes temp_pdfs instead.
+PROCESS_INLINE = os.environ.get("INGEST_PROCESS", "1") != "0"
+
+# Job events live in a Redis stream for this long, so a page that reconnects
+# (or is reloaded) replays what it missed
+JOB_TTL = 3600
+JOB_MAX_EVENTS = 50000
+
+_ui = urlsplit(UI_URL)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=[f"{_ui.scheme}://{_ui.netloc}"],
+    allow_methods=["GET"],
+    allow_headers=["Last-Event-ID"],
+)
+
 
 # ----------------------------------------------------------
 # DB SETUP
@@ -44,6 +83,23 @@ def init_db():
         )
     """)
 
+    # Attachments downloaded per user, so batch runs can map PDFs back to users/banks
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS user_attachments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT NOT NULL,
+            bank_name TEXT NOT NULL,
+            message_id TEXT,
+            filename TEXT,
+            path TEXT NOT NULL,
+            saved_at TEXT DEFAULT (datetime('now'))
+        )
+    """)
+
+    # Batch and watch look attachments up by user/bank and by path
+    c.execute("CREATE INDEX IF NOT EXISTS idx_user_attachments_user_bank ON user_attachments (user_id, bank_name)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_user_attachments_path ON user_attachments (path)")
+
     # Ensure password column exists for older DBs that may not have it
     try:
         c.execute("PRAGMA table_info('user_banks')")
@@ -59,36 +115,121 @@ def init_db():
         pass
 
     conn.commit()
+
+    # Results and the search index written by inline processing
+    store.ensure_schema(conn)
+    search.ensure_schema(conn)
     conn.close()
 
 
 # ----------------------------------------------------------
 # STARTUP CLEAN + DB INIT
 # ----------------------------------------------------------
-@app.on_event("startup")
-def startup_tasks():
-    # Clean temp folder
-    if os.path.exists(TEMP_DIR):
-        shutil.rmtree(TEMP_DIR)
+def clean_temp_dir():
+    """Remove downloads that no user_attachments row refers to and forget rows whose file is gone.
+
+    Recorded attachments are what `python main.py batch` and `watch` process, so
+    they are kept across restarts; only leftovers of interrupted downloads go.
+    """
     os.makedirs(TEMP_DIR, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        recorded = {path for (path,) in conn.execute("SELECT DISTINCT path FROM user_attachments")}
+        removed = 0
+        for name in os.listdir(TEMP_DIR):
+            path = os.path.abspath(os.path.join(TEMP_DIR, name))
+            if path not in recorded and os.path.isfile(path):
+                os.remove(path)
+                removed += 1
+        gone = [p for p in recorded if os.path.commonpath([p, os.path.abspath(TEMP_DIR)]) == os.path.abspath(TEMP_DIR)
+                and not os.path.isfile(p)]
+        conn.executemany("DELETE FROM user_attachments WHERE path = ?", [(p,) for p in gone])
+        conn.commit()
+    finally:
+        conn.close()
+    if removed or gone:
+        print(f"{TEMP_DIR}: removed {removed} unrecorded files, forgot {len(gone)} attachments whose file is missing")
+
 
+@app.on_event("startup")
+def startup_tasks():
     # Initialize SQLite
     init_db()
 
+    # Keep recorded attachments; drop stray files and rows that point nowhere
+    clean_temp_dir()
+
+
+# ----------------------------------------------------------
+# METRICS (Prometheus text format)
+# ----------------------------------------------------------
+@app.get("/metrics")
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+# ----------------------------------------------------------
+# JOB EVENTS (one Redis stream per ingestion job, served as SSE)
+# ----------------------------------------------------------
+def emit(job_id, event, **data):
+    key = f"job:{job_id}:events"
+    r.xadd(key, {"event": event, "data": json.dumps(data, default=str)}, maxlen=JOB_MAX_EVENTS, approximate=True)
+    r.expire(key, JOB_TTL)
+    metrics.incr("ingest_events", event=event)
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    state = r.hgetall(f"job:{job_id}")
+    if not state:
+        return JSONResponse({"error": "Unknown or expired job"}, status_code=404)
+    return {k.decode(): v.decode() for k, v in state.items()}
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, last_event_id: str = Header(None)):
+    """Server-Sent Events: every event of the job since `Last-Event-ID`, then live ones."""
+    key = f"job:{job_id}:events"
+    if not await ar.exists(f"job:{job_id}"):
+        return JSONResponse({"error": "Unknown or expired job"}, status_code=404)
+
+    async def stream():
+        last = last_event_id or "0"
+        yield "retry: 3000\n\n"
+        while True:
+            entries = await ar.xread({key: last}, count=100, block=15000)
+            if not entries:
+                if (await ar.hget(f"job:{job_id}", "status") or b"running") != b"running":
+                    return
+                # Comment line keeps proxies from closing an idle connection
+                yield ": keepalive\n\n"
+                continue
+            for entry_id, fields in entries[0][1]:
+                last = entry_id.decode()
+                event = fields[b"event"].decode()
+                yield f"id: {last}\nevent: {event}\ndata: {fields[b'data'].decode()}\n\n"
+                if event in ("done", "failed"):
+                    return
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 
 # ----------------------------------------------------------
 # STEP 1: Frontend calls /auth?user_id=<uuid>
 # ----------------------------------------------------------
 @app.get("/auth")
 def auth(user_id: str):
-    r.setex("current_user_id", 600, user_id)
-
     flow = Flow.from_client_secrets_file(
-        "credentials.json",
+        CLIENT_SECRETS,
         scopes=SCOPES,
-        redirect_uri="http://localhost:8000/oauth/callback"
+        redirect_uri=REDIRECT_URI
     )
-    auth_url, _ = flow.authorization_url(prompt="consent")
+    auth_url, state = flow.authorization_url(prompt="consent")
+
+    # Keyed by the OAuth state, so users onboarding at the same time don't
+    # pick up each other's id; the PKCE verifier is needed for the token exchange
+    r.setex(f"oauth_state:{state}", 600, json.dumps({"user_id": user_id, "code_verifier": flow.code_verifier}))
     return RedirectResponse(auth_url)
 
 
@@ -96,18 +237,23 @@ def auth(user_id: str):
 # STEP 2: OAuth callback → process Gmail
 # ----------------------------------------------------------
 @app.get("/oauth/callback")
-def oauth_callback(request: Request):
-    user_id_bytes = r.get("current_user_id")
-    if not user_id_bytes:
+def oauth_callback(request: Request, background: BackgroundTasks):
+    state = request.query_params.get("state", "")
+    # Read and delete in one transaction, so a replayed callback finds nothing
+    pending, _ = r.pipeline().get(f"oauth_state:{state}").delete(f"oauth_state:{state}").execute()
+    if not pending:
         return {"error": "User ID expired or missing"}
 
-    user_id = user_id_bytes.decode()
+    pending = json.loads(pending)
+    user_id = pending["user_id"]
 
     flow = Flow.from_client_secrets_file(
-        "credentials.json",
+        CLIENT_SECRETS,
         scopes=SCOPES,
-        redirect_uri="http://localhost:8000/oauth/callback"
+        redirect_uri=REDIRECT_URI,
+        state=state
     )
+    flow.code_verifier = pending["code_verifier"]
 
     flow.fetch_token(authorization_response=str(request.url))
     creds = flow.credentials
@@ -120,13 +266,34 @@ def oauth_callback(request: Request):
     }
     r.set("gmail_tokens", json.dumps(token_data))
 
-    results = auto_process_statements(creds, user_id)
+    # Ingest in the background; the UI follows along on /jobs/<id>/events
+    job_id = uuid.uuid4().hex
+    r.hset(f"job:{job_id}", mapping={"user_id": user_id, "status": "running"})
+    r.expire(f"job:{job_id}", JOB_TTL)
+    emit(job_id, "started", user_id=user_id)
+    background.add_task(run_ingestion_job, job_id, creds, user_id)
 
-    return {
-        "status": "success",
-        "processed": len(results),
-        "data": results
-    }
+    return RedirectResponse(f"{UI_URL}?job={job_id}")
+
+
+def run_ingestion_job(job_id, creds, user_id):
+    try:
+        with metrics.timer("ingestion_run"):
+            counts = auto_process_statements(creds, user_id, job_id)
+    except Exception as e:
+        r.hset(f"job:{job_id}", "status", "failed")
+        emit(job_id, "failed", error=str(e))
+        return
+
+    paths = counts.pop("paths")
+    if paths:
+        try:
+            analyze_job(job_id, user_id, paths)
+        except Exception as e:
+            emit(job_id, "analyzed", error=str(e))
+
+    r.hset(f"job:{job_id}", mapping={"status": "done", **{k: str(v) for k, v in counts.items()}})
+    emit(job_id, "done", **counts)
 
 
 # ----------------------------------------------------------
@@ -196,15 +363,28 @@ def get_bank_from_subject(msg):
     return "UNKNOWN"
 
 
+# ----------------------------------------------------------
+# GMAIL CALLS (within the shared per-user and project quota)
+# ----------------------------------------------------------
+def gmail_execute(request, method, user_id):
+    def call():
+        with metrics.timer("gmail_call", method=method):
+            return request.execute()
+    return ratelimit.gmail().run(call, cost=ratelimit.GMAIL_COSTS[method], user=user_id)
+
+
 # ----------------------------------------------------------
 # SAVE PDFs + INSERT BANK NAME
 # ----------------------------------------------------------
-def save_pdf_and_cache(service, msg, user_id):
+def save_pdf_and_cache(service, msg, user_id, job_id=None):
     info = []
     bank = get_bank_from_subject(msg)
+    metrics.incr("gmail_messages", bank=bank.lower())
 
     if bank == "UNKNOWN":
         return info
+    if job_id:
+        emit(job_id, "found", message_id=msg["id"], bank=bank)
 
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
@@ -223,11 +403,11 @@ def save_pdf_and_cache(service, msg, user_id):
 
             attachment_id = part["body"].get("attachmentId")
             if attachment_id:
-                attach = service.users().messages().attachments().get(
+                attach = gmail_execute(service.users().messages().attachments().get(
                     userId="me",
                     messageId=msg["id"],
                     id=attachment_id
-                ).execute()
+                ), "messages.attachments.get", user_id)
 
                 pdf_data = base64.urlsafe_b64decode(attach["data"])
 
@@ -236,40 +416,132 @@ def save_pdf_and_cache(service, msg, user_id):
 
                 with open(local_path, "wb") as f:
                     f.write(pdf_data)
+                metrics.incr("attachments_saved", bank=bank)
+                metrics.incr("attachment_bytes", len(pdf_data))
 
                 r.setex(f"pdf:{unique_id}", 3600, local_path)
 
-                info.append({
+                conn = sqlite3.connect(DB_PATH)
+                conn.execute(
+                    "INSERT INTO user_attachments (user_id, bank_name, message_id, filename, path) VALUES (?, ?, ?, ?, ?)",
+                    (user_id, bank.lower(), msg["id"], filename, os.path.abspath(local_path))
+                )
+                conn.commit()
+                conn.close()
+
+                item = {
                     "uuid": unique_id,
                     "filename": filename,
                     "bank": bank,
                     "path": local_path
-                })
+                }
+                info.append(item)
+                if job_id:
+                    emit(job_id, "downloaded", size=len(pdf_data), **item)
+                    if PROCESS_INLINE:
+                        item["ok"] = process_statement(job_id, user_id, item)
 
     return info
 
 
 # ----------------------------------------------------------
-# PROCESS GMAIL FOR USER
+# UNLOCK + EXTRACT ONE STATEMENT, ANALYZE THE JOB
 # ----------------------------------------------------------
-def auto_process_statements(creds, user_id):
-    service = build("gmail", "v1", credentials=creds)
-
-    messages_result = service.users().messages().list(
-        userId='me',
-        q='has:attachment "statement" newer_than:180d'
-    ).execute()
+def process_statement(job_id, user_id, item):
+    path = os.path.abspath(item["path"])
+    jobs = batch.load_jobs(DB_PATH, user_ids=[user_id], paths=[path])
+    if not jobs:
+        emit(job_id, "document_failed", uuid=item["uuid"], filename=item["filename"], error="user not registered")
+        return False
+    job = jobs[0]
+
+    def on_unlocked(password):
+        emit(job_id, "unlocked", uuid=item["uuid"], filename=item["filename"], encrypted=bool(password))
+
+    # Extracted inline next to the service's own state, so the budget counts only what this document adds
+    result = batch.process_job(job, on_unlocked=on_unlocked,
+                               budget=memory.budget_for(memory.MEMORY_LIMIT_MB, relative=True))
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        batch.record_result(conn, DB_PATH, job, result)
+    finally:
+        conn.close()
+    if result.get("error"):
+        emit(job_id, "document_failed", uuid=item["uuid"], filename=item["filename"], error=result["error"])
+        return False
+
+    # Partial result: what this statement contributes, before the whole job is analyzed
+    info = statements.describe(result)
+    emit(job_id, "extracted", uuid=item["uuid"], filename=item["filename"], bank=item["bank"],
+         pages=result.get("num_pages", 0), account=info["account"], period_from=info["period_from"],
+         period_to=info["period_to"], transactions=[
+             {k: t[k] for k in ("date", "description", "amount", "balance", "direction")}
+             for t in info["transactions"]
+         ])
+    return True
+
+
+def analyze_job(job_id, user_id, paths):
+    from bank_pdf.analysis import DEFAULT_ENDPOINT
+    from bank_pdf.incremental import analyze_incremental
+    from bank_pdf.merchants import annotate_payload, llm_client
+
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if not api_key:
+        emit(job_id, "analyzed", skipped="GEMINI_API_KEY not set")
+        return
+    # Read the job's results back from the store rather than holding them all along
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        docs = store.load_documents(conn, user_id, paths=paths)
+    finally:
+        conn.close()
+    # Only transactions not analyzed in earlier syncs go to the LLM
+    payload = statements.consolidate(docs)
+    endpoint = os.environ.get("GEMINI_ENDPOINT") or DEFAULT_ENDPOINT
+    annotate_payload(payload, DB_PATH, llm_client(endpoint, api_key))
+    result, info = analyze_incremental(DB_PATH, user_id, payload, endpoint, api_key)
+    emit(job_id, "analyzed", summary=statements.summary_line(docs, payload), result=result, **info)
 
-    messages = messages_result.get("messages", [])
-    results = []
 
-    for msg_info in messages:
-        msg = service.users().messages().get(
+# ----------------------------------------------------------
+# PROCESS GMAIL FOR USER
+# ----------------------------------------------------------
+def auto_process_statements(creds, user_id, job_id=None):
+    """Download every statement attachment, page by page through the mailbox.
+
+    Returns counts only (plus the processed paths when processing inline);
+    per-document details go out as job events as they happen.
+    """
+    options = {"api_endpoint": GMAIL_API_URL} if GMAIL_API_URL else None
+    service = build("gmail", "v1", credentials=creds, client_options=options)
+    counts = {"messages": 0, "downloaded": 0, "processed": 0, "paths": set()}
+    page_token = None
+
+    while True:
+        messages_result = gmail_execute(service.users().messages().list(
             userId='me',
-            id=msg_info["id"]
-        ).execute()
-
-        pdfs = save_pdf_and_cache(service, msg, user_id)
-        results.extend(pdfs)
-
-    return results
+            q='has:attachment "statement" newer_than:180d',
+            pageToken=page_token
+        ), "messages.list", user_id)
+
+        for msg_info in messages_result.get("messages", []):
+            msg = gmail_execute(service.users().messages().get(
+                userId='me',
+                id=msg_info["id"]
+            ), "messages.get", user_id)
+
+            counts["messages"] += 1
+            for pdf in save_pdf_and_cache(service, msg, user_id, job_id):
+                counts["downloaded"] += 1
+                if pdf.get("ok"):
+                    counts["processed"] += 1
+                    counts["paths"].add(os.path.abspath(pdf["path"]))
+
+        if job_id:
+            emit(job_id, "progress", messages=counts["messages"], downloaded=counts["downloaded"])
+        page_token = messages_result.get("nextPageToken")
+        if not page_token:
+            break
+
+    return counts
@@ -7,4 +7,17 @@ __all__ = [
     'unlocker',
     'detector',
     'cli',
+    'users',
+    'store',
+    'batch',
+    'transactions',
+    'search',
+    'watch',
+    'journal',
+    'statements',
+    'incremental',
+    'docfile',
+    'merchants',
+    'memory',
+    'ratelimit',
 ]
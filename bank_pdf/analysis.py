@@ -1,8 +1,13 @@
 import json
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Sequence
 
 import requests
 
+from . import metrics, ratelimit
+
+# Google's Generative Language v1 generateContent for gemini-2.0-flash
+DEFAULT_ENDPOINT = 'https://generativelanguage.googleapis.com/v1/models/gemini-2.0-flash:generateContent'
+
 
 def format_analysis_prompt(extracted: Dict[str, Any]) -> str:
     """Create a concise prompt to ask Gemini to analyze expenditure patterns.
@@ -19,6 +24,8 @@ def format_analysis_prompt(extracted: Dict[str, Any]) -> str:
         "- `recurring_payments`: list of likely recurring payments with cadence and average amount\n"
         "- `anomalies`: list of suspicious or one-off transactions worth reviewing\n"
         "- `suggestions`: actionable tips to improve savings / reduce spending\n"
+        "Transactions that carry `merchant` and `category` were classified locally; use those values "
+        "rather than re-deriving merchants from the narration.\n"
         "Keep numeric values as numbers and dates in ISO format if present. Use brief explanations.\n\n"
         "Give structured clean json which is pretty printed and easy to read."
     )
@@ -33,6 +40,58 @@ def format_analysis_prompt(extracted: Dict[str, Any]) -> str:
     return prompt
 
 
+def format_delta_prompt(prior: Optional[Dict[str, Any]], delta: Dict[str, Any]) -> str:
+    """Prompt for an incremental analysis: a summary of earlier periods plus the new transactions.
+
+    Asks for the same keys as `format_analysis_prompt`, covering the whole history.
+    """
+    header = (
+        "You are a financial-data analyst updating an existing analysis of a customer's bank statements. "
+        "PRIOR is a compact summary of periods you have already analyzed (monthly totals, category totals, "
+        "top merchants, recurring-payment candidates and your previous summary); it is null on the first run. "
+        "NEW contains the transactions not analyzed before, grouped by account and month. "
+        "Return a JSON object for the whole history (PRIOR and NEW together) with these keys: \n"
+        "- `summary`: short text summary (1-3 sentences)\n"
+        "- `monthly_spend_by_category`: map of category -> monthly average and total\n"
+        "- `top_merchants`: list of top 5 merchants by spend with counts\n"
+        "- `recurring_payments`: list of likely recurring payments with cadence and average amount\n"
+        "- `anomalies`: list of suspicious or one-off transactions in NEW worth reviewing\n"
+        "- `suggestions`: actionable tips to improve savings / reduce spending\n"
+        "Transactions that carry `merchant` and `category` were classified locally; use those values "
+        "rather than re-deriving merchants from the narration.\n"
+        "Keep numeric values as numbers and dates in ISO format if present. Use brief explanations.\n\n"
+    )
+    try:
+        prior_str = json.dumps(prior, ensure_ascii=False)
+        delta_str = json.dumps(delta, ensure_ascii=False)
+    except Exception:
+        prior_str, delta_str = str(prior), str(delta)
+    return header + "PRIOR:\n" + prior_str + "\n\nNEW:\n" + delta_str + "\n\nRespond only with the requested JSON object."
+
+
+def format_merchant_prompt(narrations: List[str], categories: Sequence[str]) -> str:
+    """Prompt asking for the merchant and category of narrations the local rules do not know."""
+    header = (
+        "Each line below is a normalized bank-statement narration (payment rail and reference numbers removed). "
+        "For each one, name the merchant or counterparty and pick one category from: "
+        + ", ".join(categories) + ". "
+        "Return a JSON object mapping every narration, exactly as given, to "
+        "{\"merchant\": <short display name>, \"category\": <category>}.\n\n"
+    )
+    return header + "NARRATIONS:\n" + "\n".join(narrations) + "\n\nRespond only with the requested JSON object."
+
+
+def _post(endpoint: str, timeout: int, **kwargs) -> requests.Response:
+    """POST within the shared LLM rate limit (see `bank_pdf.ratelimit`); 429s are retried."""
+    def call():
+        with metrics.timer('llm_call'):
+            resp = requests.post(endpoint, timeout=timeout, **kwargs)
+        metrics.incr('llm_calls', status=resp.status_code)
+        resp.raise_for_status()
+        return resp
+    return ratelimit.llm().run(call)
+
+
 def analyze_with_gemini(prompt: str, endpoint: str, api_key: str, timeout: int = 60) -> Dict[str, Any]:
     """Send the prompt to a Gemini-compatible REST endpoint.
 
@@ -56,8 +115,8 @@ def analyze_with_gemini(prompt: str, endpoint: str, api_key: str, timeout: int =
                 }
             ]
         }
-        resp = requests.post(endpoint, params=params, json=body, timeout=timeout)
-        resp.raise_for_status()
+        metrics.incr('llm_prompt_chars', len(prompt))
+        resp = _post(endpoint, timeout, params=params, json=body)
         try:
             return resp.json()
         except Exception:
@@ -70,8 +129,8 @@ def analyze_with_gemini(prompt: str, endpoint: str, api_key: str, timeout: int =
     }
     data = {'prompt': prompt, 'max_tokens': 1000}
 
-    resp = requests.post(endpoint, headers=headers, json=data, timeout=timeout)
-    resp.raise_for_status()
+    metrics.incr('llm_prompt_chars', len(prompt))
+    resp = _post(endpoint, timeout, headers=headers, json=data)
 
     try:
         return resp.json()
@@ -102,11 +161,15 @@ def parse_model_response(resp: Dict[str, Any]) -> Dict[str, Any]:
     # Google Generative Language: candidates -> [ { output: '...' } ]
     if 'candidates' in resp and isinstance(resp['candidates'], list) and resp['candidates']:
         first = resp['candidates'][0]
-        # Google generateContent may return `content` as a list of parts; join any text parts.
+        # Google generateContent returns `content` as {'role', 'parts': [...]}, older shapes a bare
+        # list of parts; join any text parts.
         text = None
-        if isinstance(first.get('content'), list):
+        content = first.get('content')
+        if isinstance(content, dict):
+            content = content.get('parts')
+        if isinstance(content, list):
             parts = []
-            for part in first.get('content'):
+            for part in content:
                 if isinstance(part, dict):
                     # common key names are 'text' or 'type'/'text'
                     if 'text' in part:
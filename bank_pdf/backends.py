@@ -0,0 +1,471 @@
+"""Pluggable text-extraction backends.
+
+Each backend opens a PDF and hands out per-page text:
+
+  - `pypdf2`   PyPDF2's extract_text() (the historical default)
+  - `pdfminer` pdfminer.six with layout analysis; slowest, best reading order
+  - `pikepdf`  reads text operators straight from the page content streams;
+               fast, but only decodes simple (single-byte) fonts
+
+`select_backend(bank)` picks the backend recorded for a bank in the profile
+file written by `python main.py backends --save`, falling back to pypdf2.
+"""
+import argparse
+import importlib
+import io
+import json
+import mmap
+import os
+import re
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+
+DEFAULT_BACKEND = 'pypdf2'
+PROFILES_PATH = os.environ.get(
+    'BANK_PDF_BACKEND_PROFILES',
+    os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')), 'backend_profiles.json'),
+)
+# A backend is only picked for a bank if its text is at least this good
+MIN_QUALITY = 0.9
+MIN_AGREEMENT = 0.9
+
+
+# Page kinds reported by BackendDocument.page_kind()
+PAGE_TEXT, PAGE_IMAGE, PAGE_MIXED, PAGE_EMPTY = 'text', 'image', 'mixed', 'empty'
+# Begin-text and inline-image operators as standalone content-stream tokens
+_BT_OP = re.compile(rb'(?:^|\s)BT(?:\s|$)')
+_BI_OP = re.compile(rb'(?:^|\s)BI(?:\s|$)')
+
+# PyPDF2, pdfminer and pikepdf each take tens of milliseconds to import, so they
+# are loaded when a backend is first used rather than when this module is.
+_modules: Dict[str, Any] = {}
+
+
+def _optional(module: str):
+    """Import an optional dependency on first use; None if it is not installed."""
+    if module not in _modules:
+        try:
+            _modules[module] = importlib.import_module(module)
+        except Exception:
+            _modules[module] = None
+    return _modules[module]
+
+
+def _scan_resources(res, resolve, depth: int = 0):
+    """Return (has_font, has_image, form_has_font) for a /Resources dictionary."""
+    if res is None:
+        return False, False, False
+    res = resolve(res)
+    has_font = bool(res.get('/Font'))
+    has_image = form_font = False
+    xobjects = res.get('/XObject')
+    if xobjects is not None:
+        for xo in resolve(xobjects).values():
+            xo = resolve(xo)
+            subtype = xo.get('/Subtype')
+            if subtype == '/Image':
+                has_image = True
+            elif subtype == '/Form' and depth < 3:
+                f, i, ff = _scan_resources(xo.get('/Resources'), resolve, depth + 1)
+                form_font = form_font or f or ff
+                has_image = has_image or i
+    return has_font, has_image, form_font
+
+
+def _classify(res, content: bytes, resolve) -> str:
+    has_font, has_image, form_font = _scan_resources(res, resolve)
+    # Fonts only matter if the page actually draws text (BT ... ET) or uses a form that has fonts
+    has_text = (has_font and _BT_OP.search(content) is not None) or form_font
+    if has_text and has_image:
+        return PAGE_MIXED
+    if has_text:
+        return PAGE_TEXT
+    if has_image or _BI_OP.search(content):
+        return PAGE_IMAGE
+    return PAGE_EMPTY
+
+
+class BackendDocument:
+    """An open PDF. Pages are indexed from 0."""
+
+    num_pages = 0
+
+    def metadata(self) -> Dict[str, Any]:
+        """Document info dict; keys may keep PyPDF2's leading '/'."""
+        return {}
+
+    def page_text(self, index: int) -> str:
+        raise NotImplementedError
+
+    def page_kind(self, index: int) -> Optional[str]:
+        """Classify a page as text/image/mixed/empty from its resources and content
+        stream, without extracting text. None if the backend cannot tell."""
+        return None
+
+    def release(self) -> None:
+        """Drop whatever the parser cached for pages read so far."""
+
+    def close(self) -> None:
+        pass
+
+
+class ExtractionBackend:
+    name = ''
+
+    def available(self) -> bool:
+        raise NotImplementedError
+
+    def decrypts(self) -> bool:
+        """True if `open(path, password)` can read encrypted files itself."""
+        return True
+
+    def open(self, pdf_path: str, password: Optional[str] = None) -> BackendDocument:
+        """Open `pdf_path`, decrypting it with `password` if it is encrypted."""
+        raise NotImplementedError
+
+
+# ---------------------------------------------------------------------------
+# PyPDF2
+# ---------------------------------------------------------------------------
+
+class _PyPDF2Document(BackendDocument):
+    def __init__(self, pdf_path, password=None):
+        # Given a path, PdfReader reads the whole file into memory; a map of it is paged in on demand
+        with open(pdf_path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.reader = _optional('PyPDF2').PdfReader(self._mm)
+            if password and self.reader.is_encrypted:
+                self.reader.decrypt(password)
+            self.num_pages = len(self.reader.pages)
+        except Exception:
+            self._mm.close()
+            raise
+
+    def metadata(self):
+        return dict(self.reader.metadata or {})
+
+    def page_text(self, index):
+        return self.reader.pages[index].extract_text() or ''
+
+    def page_kind(self, index):
+        page = self.reader.pages[index]
+        contents = page.get_contents()
+        return _classify(page.get('/Resources'), contents.get_data() if contents is not None else b'',
+                         lambda o: o.get_object())
+
+    def release(self):
+        # Parsed objects, with their decoded content streams; re-read from the map on demand
+        self.reader.resolved_objects.clear()
+        if hasattr(mmap, 'MADV_DONTNEED'):
+            # Unmap the file pages read so far; they fault back in from the page cache if needed
+            self._mm.madvise(mmap.MADV_DONTNEED)
+
+    def close(self):
+        self.reader = None
+        self._mm.close()
+
+
+class PyPDF2Backend(ExtractionBackend):
+    name = 'pypdf2'
+
+    def available(self):
+        return _optional('PyPDF2') is not None
+
+    def decrypts(self):
+        # PyPDF2 needs pycryptodome for the AES encryption banks use
+        return _optional('Crypto.Cipher.AES') is not None
+
+    def open(self, pdf_path, password=None):
+        return _PyPDF2Document(pdf_path, password)
+
+
+# ---------------------------------------------------------------------------
+# pdfminer.six
+# ---------------------------------------------------------------------------
+
+class _PdfminerDocument(BackendDocument):
+    def __init__(self, pdf_path, password=None):
+        from pdfminer.layout import LAParams
+        from pdfminer.pdfdocument import PDFDocument
+        from pdfminer.pdfinterp import PDFResourceManager
+        from pdfminer.pdfpage import PDFPage
+        from pdfminer.pdfparser import PDFParser
+
+        self._fp = open(pdf_path, 'rb')
+        self._doc = PDFDocument(PDFParser(self._fp), password=password or '')
+        self._pages = list(PDFPage.create_pages(self._doc))
+        self.num_pages = len(self._pages)
+        self._rsrc = PDFResourceManager(caching=True)
+        self._laparams = LAParams()
+
+    def metadata(self):
+        out = {}
+        for info in self._doc.info:
+            for k, v in info.items():
+                if isinstance(v, bytes):
+                    v = v.decode('utf-16') if v.startswith(b'\xfe\xff') else v.decode('latin-1')
+                out[str(k)] = v
+        return out
+
+    def page_text(self, index):
+        from pdfminer.converter import TextConverter
+        from pdfminer.pdfinterp import PDFPageInterpreter
+
+        buf = io.StringIO()
+        device = TextConverter(self._rsrc, buf, laparams=self._laparams)
+        try:
+            PDFPageInterpreter(self._rsrc, device).process_page(self._pages[index])
+        finally:
+            device.close()
+        return buf.getvalue()
+
+    def close(self):
+        self._fp.close()
+
+
+class PdfminerBackend(ExtractionBackend):
+    name = 'pdfminer'
+
+    def available(self):
+        return _optional('pdfminer.pdfpage') is not None and _optional('pdfminer.converter') is not None
+
+    def open(self, pdf_path, password=None):
+        return _PdfminerDocument(pdf_path, password)
+
+
+# ---------------------------------------------------------------------------
+# pikepdf content streams
+# ---------------------------------------------------------------------------
+
+# Text-positioning operators that start a new line
+_NEWLINE_OPS = {'Td', 'TD', 'T*', 'Tm', "'", '"'}
+# In a TJ array, a kerning adjustment beyond this (thousandths of an em) is a word gap
+_TJ_SPACE = -200
+
+
+class _PikepdfDocument(BackendDocument):
+    def __init__(self, pdf_path, password=None):
+        self._pdf = _optional('pikepdf').open(pdf_path, password=password or '')
+        self.num_pages = len(self._pdf.pages)
+
+    def metadata(self):
+        return {str(k).lstrip('/'): str(v) for k, v in self._pdf.docinfo.items()}
+
+    def page_text(self, index):
+        pikepdf = _optional('pikepdf')
+        parts: List[str] = []
+        for operands, operator in pikepdf.parse_content_stream(self._pdf.pages[index]):
+            op = str(operator)
+            if op in _NEWLINE_OPS and parts and parts[-1] != '\n':
+                parts.append('\n')
+            if op in ('Tj', "'"):
+                parts.append(bytes(operands[0]).decode('latin-1'))
+            elif op == '"':
+                parts.append(bytes(operands[2]).decode('latin-1'))
+            elif op == 'TJ':
+                for item in operands[0]:
+                    if isinstance(item, pikepdf.String):
+                        parts.append(bytes(item).decode('latin-1'))
+                    elif float(item) < _TJ_SPACE:
+                        parts.append(' ')
+        return ''.join(parts).strip('\n')
+
+    def page_kind(self, index):
+        pikepdf = _optional('pikepdf')
+        page = self._pdf.pages[index].obj
+        contents = page.get('/Contents')
+        if contents is None:
+            data = b''
+        elif isinstance(contents, pikepdf.Array):
+            data = b''.join(c.read_bytes() for c in contents)
+        else:
+            data = contents.read_bytes()
+        return _classify(page.get('/Resources'), data, lambda o: o)
+
+    def close(self):
+        self._pdf.close()
+
+
+class PikepdfBackend(ExtractionBackend):
+    name = 'pikepdf'
+
+    def available(self):
+        return _optional('pikepdf') is not None
+
+    def open(self, pdf_path, password=None):
+        return _PikepdfDocument(pdf_path, password)
+
+
+BACKENDS: Dict[str, ExtractionBackend] = {b.name: b for b in (PyPDF2Backend(), PdfminerBackend(), PikepdfBackend())}
+
+
+def get_backend(name=None) -> ExtractionBackend:
+    """Return the named backend, or the default one if `name` is empty or unavailable.
+
+    An ExtractionBackend instance is returned unchanged.
+    """
+    if isinstance(name, ExtractionBackend):
+        return name
+    backend = BACKENDS.get(name or DEFAULT_BACKEND)
+    if backend is None or not backend.available():
+        backend = BACKENDS[DEFAULT_BACKEND]
+    return backend
+
+
+_profiles: Optional[Dict[str, Any]] = None
+
+
+def load_profiles(path: str = PROFILES_PATH) -> Dict[str, Any]:
+    global _profiles
+    if _profiles is None:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                _profiles = json.load(f)
+        except (OSError, ValueError):
+            _profiles = {}
+    return _profiles
+
+
+def select_backend(bank: Optional[str] = None) -> ExtractionBackend:
+    """Backend recorded for `bank` in the profile file (or its 'default' entry)."""
+    profiles = load_profiles()
+    key = (bank or '').strip().lower()
+    entry = profiles.get(key) or profiles.get('default') or {}
+    return get_backend(entry.get('backend'))
+
+
+# ---------------------------------------------------------------------------
+# Comparison / profile selection
+# ---------------------------------------------------------------------------
+
+_WORD = re.compile(r'[A-Za-z0-9][A-Za-z0-9.,/-]*')
+
+
+def text_quality(text: str) -> float:
+    """Share of non-whitespace characters that are printable ASCII (1.0 = clean text)."""
+    chars = [c for c in text if not c.isspace()]
+    if not chars:
+        return 0.0
+    return sum(1 for c in chars if ' ' < c <= '~') / len(chars)
+
+
+def agreement(text: str, reference: str) -> float:
+    """Fraction of the reference's words that the text also contains."""
+    ref = set(_WORD.findall(reference))
+    if not ref:
+        return 1.0 if not text.strip() else 0.0
+    return len(ref & set(_WORD.findall(text))) / len(ref)
+
+
+def compare_backends(pdf_paths: List[str], max_pages: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Time every available backend on each PDF and score it against pdfminer's text."""
+    rows = []
+    names = [n for n, b in BACKENDS.items() if b.available()]
+    for path in pdf_paths:
+        texts, timings = {}, {}
+        for name in names:
+            start = time.perf_counter()
+            try:
+                doc = BACKENDS[name].open(path)
+                try:
+                    n = doc.num_pages if max_pages is None else min(doc.num_pages, max_pages)
+                    texts[name] = '\n'.join(doc.page_text(i) for i in range(n))
+                finally:
+                    doc.close()
+            except Exception as e:
+                texts[name] = ''
+                timings[name + '_error'] = str(e)
+            timings[name] = time.perf_counter() - start
+        reference = texts.get('pdfminer') or texts.get(DEFAULT_BACKEND, '')
+        for name in names:
+            rows.append({
+                'path': path, 'backend': name, 'seconds': round(timings[name], 4),
+                'chars': len(texts[name]), 'quality': round(text_quality(texts[name]), 3),
+                'agreement': round(agreement(texts[name], reference), 3),
+                'error': timings.get(name + '_error'),
+            })
+    return rows
+
+
+def choose_profiles(rows: List[Dict[str, Any]], bank_of: Dict[str, str]) -> Dict[str, Any]:
+    """Per bank, the fastest backend whose worst document still meets the quality bars."""
+    per_bank: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+    for row in rows:
+        bank = bank_of.get(row['path'], 'default')
+        per_bank.setdefault(bank, {}).setdefault(row['backend'], []).append(row)
+
+    profiles = {}
+    for bank, by_backend in per_bank.items():
+        ok = []
+        for name, items in by_backend.items():
+            if all(not r['error'] and r['quality'] >= MIN_QUALITY and r['agreement'] >= MIN_AGREEMENT for r in items):
+                ok.append((sum(r['seconds'] for r in items), name))
+        if ok:
+            seconds, name = min(ok)
+            profiles[bank] = {'backend': name, 'seconds_per_doc': round(seconds / len(by_backend[name]), 4)}
+    return profiles
+
+
+def iter_corpus(path: str) -> Iterator[Dict[str, Any]]:
+    """Documents from a benchmarks/corpus manifest, decrypted with their recorded password.
+
+    `source` is the manifest's file; `path` is a decrypted copy only when the
+    two differ (an unencrypted PDF comes back as itself).
+    """
+    from .unlocker import try_unlock_pdf
+
+    with open(os.path.join(path, 'manifest.json'), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    for doc in manifest['documents']:
+        ok, _, decrypted = try_unlock_pdf(doc['path'], [doc['password']])
+        if ok:
+            yield {'path': decrypted, 'source': doc['path'], 'bank': doc['bank'], 'kind': doc['kind']}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='backends', description='Compare extraction backends and record the best one per bank')
+    parser.add_argument('--pdf', nargs='*', default=[], help='Decrypted PDF(s) to compare on (bank taken from --bank)')
+    parser.add_argument('--bank', default='default', help='Bank the --pdf files belong to')
+    parser.add_argument('--corpus', default='', help='benchmarks corpus directory (uses its manifest for banks/passwords)')
+    parser.add_argument('--limit-pages', type=int, default=None, help='Only compare the first N pages of each PDF')
+    parser.add_argument('--save', action='store_true', help=f'Write the chosen backends to {PROFILES_PATH}')
+    args = parser.parse_args(argv)
+
+    docs = [{'path': p, 'bank': args.bank.strip().lower()} for p in args.pdf]
+    corpus_docs = list(iter_corpus(args.corpus)) if args.corpus else []
+    # Scanned documents have no text layer, so they say nothing about backends
+    docs += [d for d in corpus_docs if d['kind'] == 'text']
+    if not docs:
+        print('Nothing to compare: pass --pdf or --corpus.')
+        return
+
+    try:
+        rows = compare_backends([d['path'] for d in docs], args.limit_pages)
+    finally:
+        # Only the decrypted copies: an unencrypted corpus PDF is its own source file
+        for d in corpus_docs:
+            if os.path.abspath(d['path']) != os.path.abspath(d['source']):
+                os.remove(d['path'])
+    print(f"{'backend':<10} {'docs':>5} {'s/doc':>8} {'quality':>8} {'agreement':>10}")
+    for name in BACKENDS:
+        items = [r for r in rows if r['backend'] == name]
+        if items:
+            print(f"{name:<10} {len(items):>5} {sum(r['seconds'] for r in items) / len(items):>8.4f} "
+                  f"{min(r['quality'] for r in items):>8} {min(r['agreement'] for r in items):>10}")
+
+    profiles = choose_profiles(rows, {d['path']: d['bank'] for d in docs})
+    for bank, entry in sorted(profiles.items()):
+        print(f"  {bank}: {entry['backend']} ({entry['seconds_per_doc']}s/doc)")
+    if args.save:
+        merged = dict(load_profiles())
+        merged.update(profiles)
+        with open(PROFILES_PATH, 'w', encoding='utf-8') as f:
+            json.dump(merged, f, indent=2)
+        print('Saved backend profiles to', PROFILES_PATH)
+    return profiles
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+"""Batch mode: process statements for many users in one long-lived worker pool.
+
+Attachments are mapped to users through the `user_attachments` table written by
+the Gmail ingestion service, and to banks through `user_banks`. Each worker
+process keeps its imports and candidate cache warm across documents; the
+parent process is the only writer to users.db.
+"""
+import argparse
+import itertools
+import os
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence
+
+from . import memory, metrics, search, store, users
+from .backends import select_backend
+from .cli import persist_password, process_pdf
+from .generator import candidates_from_features, generate_password_candidates
+
+# Jobs submitted per worker ahead of the results being stored
+INFLIGHT_PER_WORKER = 2
+# `paths` filters per query, as in `store.load_documents`
+_PATHS_PER_QUERY = 500
+
+
+def _columns(cur, table: str) -> List[str]:
+    cur.execute(f"PRAGMA table_info('{table}')")
+    return [r[1] for r in cur.fetchall()]
+
+
+def load_jobs(db_path: str, user_ids: Optional[Sequence[str]] = None, banks: Optional[Sequence[str]] = None,
+              paths: Optional[Sequence[str]] = None, missing: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Return one job per downloaded attachment, joined with its user and bank.
+
+    Attachments whose file no longer exists are skipped, and their paths are
+    appended to `missing` if given. `paths` (absolute) restricts the jobs to
+    those files.
+    """
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    if 'path' not in _columns(cur, 'user_attachments'):
+        conn.close()
+        return []
+    features_col = 'u.pw_features' if 'pw_features' in _columns(cur, 'users') else 'NULL'
+    password_col = 'b.password' if 'password' in _columns(cur, 'user_banks') else 'NULL'
+
+    where, params = [], []
+    if user_ids:
+        where.append('a.user_id IN (%s)' % ','.join('?' * len(user_ids)))
+        params.extend(user_ids)
+    if banks:
+        where.append('a.bank_name IN (%s)' % ','.join('?' * len(banks)))
+        params.extend(b.strip().lower() for b in banks)
+    # Chunked to stay under SQLite's bound-parameter limit
+    paths = list(dict.fromkeys(paths)) if paths else None
+    chunks = [paths[i:i + _PATHS_PER_QUERY] for i in range(0, len(paths), _PATHS_PER_QUERY)] if paths else [None]
+
+    rows = []
+    for chunk in chunks:
+        clauses = where + (['a.path IN (%s)' % ','.join('?' * len(chunk))] if chunk else [])
+        cur.execute(
+            f'SELECT a.user_id, a.id, a.bank_name, a.path, u.full_name, u.dob, u.mobile, {features_col}, {password_col} '
+            'FROM user_attachments a '
+            'JOIN users u ON u.user_id = a.user_id '
+            'LEFT JOIN user_banks b ON b.user_id = a.user_id AND b.bank_name = a.bank_name '
+            + ('WHERE ' + ' AND '.join(clauses) + ' ' if clauses else ''),
+            params + (chunk or [])
+        )
+        rows += cur.fetchall()
+    conn.close()
+    rows.sort(key=lambda r: (r[0], r[1]))
+
+    jobs, seen = [], set()
+    for user_id, _, bank, path, full_name, dob, mobile, features, password in rows:
+        if (user_id, path) in seen:
+            continue
+        if not os.path.isfile(path):
+            if missing is not None:
+                missing.append(path)
+            continue
+        seen.add((user_id, path))
+        jobs.append({
+            'user_id': user_id, 'bank': bank, 'path': path,
+            'full_name': full_name or '', 'dob': dob or '', 'mobile': mobile or '',
+            'pw_features': features, 'known_password': password,
+        })
+    return jobs
+
+
+@lru_cache(maxsize=4096)
+def _candidates(pw_features: Optional[str], full_name: str, mobile: str, dob: str, bank: str,
+                max_candidates: int, known_password: Optional[str]) -> tuple:
+    # Cached per worker process: every statement of a (user, bank) shares one list
+    features = users.load_features(pw_features)
+    if features:
+        cands = candidates_from_features(features, bank, max_candidates)
+    else:
+        cands = generate_password_candidates(full_name, mobile, users.normalize_dob(dob) or dob, bank, max_candidates)
+    if known_password:
+        # A password that opened an earlier statement is by far the likeliest
+        cands = [known_password] + [c for c in cands if c != known_password]
+    return tuple(cands)
+
+
+def process_job(job: Dict[str, Any], max_candidates: int = 200, ocr: bool = False, limit_pages: Optional[int] = None,
+                on_unlocked=None, budget: Optional[memory.Budget] = None) -> Dict[str, Any]:
+    """Unlock and extract one job's PDF with its owner's password candidates, under `budget` if given."""
+    candidates = _candidates(job['pw_features'], job['full_name'], job['mobile'], job['dob'], job['bank'],
+                             max_candidates, job['known_password'])
+    try:
+        result = process_pdf(job['path'], list(candidates), ocr=ocr, limit_pages=limit_pages, verbose=False,
+                             keep_decrypted=False, backend=select_backend(job['bank']), on_unlocked=on_unlocked,
+                             budget=budget)
+    except Exception as e:
+        result = {'path': job['path'], 'error': f'processing failed: {e}'}
+    result['bank'] = job['bank']
+    return result
+
+
+def _process_job(job: Dict[str, Any], max_candidates: int, ocr: bool, limit_pages: Optional[int],
+                 memory_limit: int = 0) -> Dict[str, Any]:
+    # Each job ships only its own numbers back; the parent aggregates them
+    metrics.reset()
+    start = time.perf_counter()
+    result = process_job(job, max_candidates, ocr, limit_pages, budget=memory.budget_for(memory_limit))
+    return {'job': job, 'result': result, 'elapsed': time.perf_counter() - start, 'metrics': metrics.snapshot()}
+
+
+def record_result(conn: sqlite3.Connection, db_path: str, job: Dict[str, Any], result: Dict[str, Any]) -> None:
+    """Store, index and commit one job's result, and remember a newly found password."""
+    store.save_document(conn, job['user_id'], job['bank'], job['path'], result)
+    search.index_document(conn, job['user_id'], job['bank'], job['path'], result)
+    conn.commit()
+    password = result.get('unlocked_with')
+    if password and password != job['known_password']:
+        persist_password(db_path, job['user_id'], job['bank'], password, verbose=False)
+
+
+def _record(conn: sqlite3.Connection, db_path: str, out: Dict[str, Any], summary: Dict[str, Any]) -> None:
+    job, result = out['job'], out['result']
+    metrics.merge(out['metrics'])
+    record_result(conn, db_path, job, result)
+
+    summary['documents'] += 1
+    if result.get('error'):
+        summary['failed'] += 1
+        print(f"  [{job['user_id']}] {os.path.basename(job['path'])}: {result['error']}")
+        return
+    summary['unlocked'] += 1
+    summary['pages'] += result.get('num_pages', 0) or 0
+    print(f"  [{job['user_id']}] {os.path.basename(job['path'])}: "
+          f"{result.get('num_pages', 0)} pages in {out['elapsed']:.2f}s")
+
+
+def run_batch(db_path: str, jobs: List[Dict[str, Any]], workers: int = 0, max_candidates: int = 200,
+              ocr: bool = False, limit_pages: Optional[int] = None, memory_limit: int = 0) -> Dict[str, Any]:
+    """Process `jobs` in a process pool, writing each result to the store as it lands.
+
+    With a `memory_limit` (MB) every document gets that budget and the pool's
+    workers get the rlimit backstop (see `bank_pdf.memory`).
+    """
+    workers = workers or os.cpu_count() or 1
+    conn = sqlite3.connect(db_path)
+    store.ensure_schema(conn)
+    search.ensure_schema(conn)
+
+    summary = {'documents': 0, 'unlocked': 0, 'failed': 0, 'pages': 0, 'users': len({j['user_id'] for j in jobs})}
+    start = time.perf_counter()
+    pending = iter(jobs)
+    with ProcessPoolExecutor(max_workers=workers, initializer=memory.apply_ceiling, initargs=(memory_limit,)) as pool:
+        # Keep only a couple of jobs queued per worker, so finished results are
+        # stored before more are extracted rather than piling up in this process
+        inflight = {pool.submit(_process_job, job, max_candidates, ocr, limit_pages, memory_limit)
+                    for job in itertools.islice(pending, workers * INFLIGHT_PER_WORKER)}
+        while inflight:
+            done, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+            inflight |= {pool.submit(_process_job, job, max_candidates, ocr, limit_pages, memory_limit)
+                         for job in itertools.islice(pending, len(done))}
+            for fut in done:
+                _record(conn, db_path, fut.result(), summary)
+    conn.close()
+
+    elapsed = time.perf_counter() - start
+    summary['elapsed_s'] = round(elapsed, 3)
+    summary['docs_per_s'] = round(summary['documents'] / elapsed, 2) if elapsed else 0.0
+    summary['pages_per_s'] = round(summary['pages'] / elapsed, 2) if elapsed else 0.0
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='batch', description='Process downloaded statements for all users (or a subset) in one worker pool')
+    parser.add_argument('--user', action='append', default=[], help='Only process this user_id (repeatable)')
+    parser.add_argument('--bank', action='append', default=[], help='Only process this bank (repeatable)')
+    parser.add_argument('--workers', type=int, default=0, help='Worker processes (default: CPU count)')
+    parser.add_argument('--max-candidates', type=int, default=200, help='Max password candidates to try')
+    parser.add_argument('--ocr', action='store_true', help='Force OCR pass when no extractable text is found')
+    parser.add_argument('--limit-pages', type=int, default=None, help='Limit pages to inspect/ocr (default: all)')
+    parser.add_argument('--db', default=users.DEFAULT_DB_PATH, help='Path to users.db (default: repo root users.db)')
+    parser.add_argument('--metrics-out', default='', help='Write a JSON report of per-stage timings and counters to this path')
+    parser.add_argument('--resume', action='store_true', help='Skip documents already stored successfully by an earlier (possibly interrupted) run')
+    parser.add_argument('--memory-limit', type=int, default=None, help='Per-worker memory budget in MB: large PDFs are processed in page chunks under it (default: BANK_PDF_MEMORY_LIMIT_MB, else none)')
+    args = parser.parse_args(argv)
+    if args.memory_limit is None:
+        args.memory_limit = memory.MEMORY_LIMIT_MB
+
+    if not os.path.isfile(args.db):
+        print('Error: users.db not found at', args.db)
+        return
+    missing: List[str] = []
+    jobs = load_jobs(args.db, args.user, args.bank, missing=missing)
+    if missing:
+        print(f'{len(missing)} recorded attachments no longer exist on disk and were skipped')
+    if not jobs:
+        print('No downloaded attachments found for the selected users. Nothing to do.')
+        return
+    if args.resume:
+        # Results are committed one document at a time, so the store is the checkpoint
+        conn = sqlite3.connect(args.db)
+        store.ensure_schema(conn)
+        done = store.processed_paths(conn)
+        conn.close()
+        skipped = len(jobs)
+        jobs = [j for j in jobs if (j['user_id'], j['path']) not in done]
+        skipped -= len(jobs)
+        if skipped:
+            print(f'Resuming: {skipped} documents already processed')
+        if not jobs:
+            print('Every selected document was already processed. Nothing to do.')
+            return
+
+    print(f"Processing {len(jobs)} documents for {len({j['user_id'] for j in jobs})} users")
+    summary = run_batch(args.db, jobs, args.workers, args.max_candidates, args.ocr, args.limit_pages, args.memory_limit)
+
+    print('\nBatch summary:')
+    print(f"  users: {summary['users']}  documents: {summary['documents']} "
+          f"(unlocked {summary['unlocked']}, failed {summary['failed']})")
+    print(f"  pages: {summary['pages']}  elapsed: {summary['elapsed_s']}s")
+    print(f"  throughput: {summary['docs_per_s']} docs/s, {summary['pages_per_s']} pages/s")
+    if args.metrics_out:
+        metrics.write_report(args.metrics_out, {'batch': summary})
+        print('Metrics report written to', args.metrics_out)
+    return summary
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,178 @@
 import argparse
+import importlib
 import os
 import shutil
+import sys
 import json
 import sqlite3
-try:
-    from dotenv import load_dotenv
-except Exception:
-    load_dotenv = None
-
-# If a .env file is present in the repo root, load it so environment variables
-# like GEMINI_API_KEY and GEMINI_ENDPOINT become available.
-if load_dotenv is not None:
-    load_dotenv()
-from .generator import generate_password_candidates
-from .unlocker import try_unlock_pdf
-from .detector import contains_text
-from .extractor import extract_pdf_all
-from .analysis import format_analysis_prompt, analyze_with_gemini, parse_model_response
+from contextlib import nullcontext, redirect_stdout
+from .generator import generate_password_candidates, candidates_from_features
+from . import memory, metrics, users
+
+# The unlock/extract/analysis modules (pikepdf, PyPDF2, pdfminer, requests) are
+# imported inside the functions that use them, so `--help`, the subcommands and
+# hand-offs to a warm worker (see `bank_pdf.worker`) do not pay for them.
+
+
+# Subcommands handled before the default unlock/extract flow. Each maps to a
+# (module, function) taking `argv`, imported only when that subcommand is used.
+COMMANDS = {
+    'import-users': ('bank_pdf.users', 'main'),
+    'backfill-users': ('bank_pdf.users', 'backfill_main'),
+    'batch': ('bank_pdf.batch', 'main'),
+    'backends': ('bank_pdf.backends', 'main'),
+    'worker': ('bank_pdf.worker', 'main'),
+    'search': ('bank_pdf.search', 'main'),
+    'watch': ('bank_pdf.watch', 'main'),
+}
+
+
+def persist_password(db_path, user_id, bank, password, verbose=True):
+    """Store a discovered PDF password in user_banks for (user_id, bank)."""
+    log = print if verbose else (lambda *a, **k: None)
+    # Normalize bank name to match storage (we store lower-case bank names elsewhere)
+    bank_for_update = (bank or '').strip().lower()
+    log(f"[debug] Persisting password for user_id={user_id} bank={bank_for_update} db={db_path}")
+    conn_up = None
+    try:
+        conn_up = sqlite3.connect(db_path)
+        cur_up = conn_up.cursor()
+        # ensure password column exists
+        cur_up.execute("PRAGMA table_info('user_banks')")
+        cols = [r[1] for r in cur_up.fetchall()]
+        log(f"[debug] user_banks columns: {cols}")
+        if 'password' not in cols:
+            try:
+                cur_up.execute('ALTER TABLE user_banks ADD COLUMN password TEXT')
+                conn_up.commit()
+            except Exception:
+                # ignore migration failure
+                pass
+
+        # Upsert password for (user_id, bank_name).
+        # user_banks has UNIQUE(user_id, bank_name) so use ON CONFLICT to update.
+        try:
+            # Prefer standard UPSERT if available
+            cur_up.execute(
+                'INSERT INTO user_banks (user_id, bank_name, password) VALUES (?, ?, ?) '
+                'ON CONFLICT(user_id, bank_name) DO UPDATE SET password=excluded.password',
+                (user_id, bank_for_update, password)
+            )
+            log('[debug] Executed UPSERT with ON CONFLICT')
+        except Exception as e_upsert:
+            log(f"[debug] UPSERT failed: {e_upsert}; falling back to update/insert")
+            try:
+                cur_up.execute('UPDATE user_banks SET password = ? WHERE user_id = ? AND bank_name = ?', (password, user_id, bank_for_update))
+                if cur_up.rowcount == 0:
+                    cur_up.execute('INSERT OR IGNORE INTO user_banks (user_id, bank_name, password) VALUES (?, ?, ?)', (user_id, bank_for_update, password))
+                    log('[debug] Performed INSERT OR IGNORE fallback')
+                else:
+                    log('[debug] Performed UPDATE fallback (rows affected: ' + str(cur_up.rowcount) + ')')
+            except Exception as e_fallback:
+                log(f"[debug] Fallback update/insert failed: {e_fallback}")
+
+        conn_up.commit()
+        log('[debug] Committed password to user_banks')
+    except Exception:
+        pass
+    finally:
+        if conn_up is not None:
+            conn_up.close()
+
+
+def _tap(records, callback):
+    for rec in records:
+        callback(rec)
+        yield rec
+
+
+def process_pdf(pdf_path, candidates, ocr=False, limit_pages=None, output='', verbose=True, keep_decrypted=True, backend=None,
+                on_record=None, on_unlocked=None, budget=None):
+    """Unlock, classify and extract a single PDF.
+
+    Returns the `extract_pdf_all` dict with `path` and `unlocked_with` set, or
+    {'path': ..., 'error': ...} when no candidate opens the file. With
+    `keep_decrypted=False` the temporary decrypted copy is removed afterwards.
+    `backend` selects the text-extraction backend (see `bank_pdf.backends`).
+    `on_record` is called with every `iter_pdf_pages` record as it is extracted,
+    and `on_unlocked` with the working password as soon as the PDF opens.
+    Under a memory `budget` (a `bank_pdf.memory.Budget` for this document) no
+    decrypted copy is written unless `output` asks for one, and pages are
+    extracted in chunks.
+    """
+    from .unlocker import try_unlock_pdf
+    from .detector import probe_text
+    from .extractor import iter_pdf_pages, collect_pages
+    from .backends import get_backend
+
+    log = print if verbose else (lambda *a, **k: None)
+    # The backend decrypts as it reads, so the full decrypted copy is never written
+    in_place = budget is not None and not output and get_backend(backend).decrypts()
+    success, password, decrypted_path = try_unlock_pdf(pdf_path, candidates, save=not in_place)
+    if not success:
+        log('  Unable to unlock this PDF with generated candidates. Skipping.')
+        return {'path': pdf_path, 'error': 'unable to unlock'}
+
+    if password:
+        log('  Successfully unlocked PDF with password:', password)
+    else:
+        log('  PDF was not encrypted (opened without password).')
+    if on_unlocked is not None:
+        on_unlocked(password)
+
+    out_path = decrypted_path
+    read_password = password if in_place else None
+    if output:
+        if decrypted_path and decrypted_path != output:
+            shutil.copyfile(decrypted_path, output)
+        out_path = output
+
+    # Classify pages once; the text found here is handed to the extractor, not re-parsed
+    with metrics.timer('text_detection'):
+        # Under a budget only the first chunk is classified up front; the extractor does the rest as it goes
+        probe_pages = limit_pages if budget is None else min(limit_pages or budget.chunk_pages, budget.chunk_pages)
+        probe = probe_text(out_path, max_pages=probe_pages, backend=backend, password=read_password)
+    is_text = probe.has_text
+    ocr_pages = probe.ocr_pages
+    if is_text and not ocr_pages:
+        log('  PDF contains extractable text (no OCR needed).')
+    elif is_text:
+        log(f'  PDF contains extractable text; {len(ocr_pages)} scanned page(s) may need OCR.')
+    else:
+        log('  PDF appears to be scanned images (OCR may be required).')
+
+    do_ocr = ocr or (not is_text)
+    records = iter_pdf_pages(out_path, ocr=do_ocr, max_pages=limit_pages, backend=backend, probe=probe,
+                             password=read_password, budget=budget)
+    if on_record is not None:
+        records = _tap(records, on_record)
+    with metrics.timer('extraction'):
+        extracted = collect_pages(records, out_path)
+    if not keep_decrypted and password and decrypted_path not in (pdf_path, output):
+        try:
+            os.remove(decrypted_path)
+        except OSError:
+            pass
+    extracted['path'] = pdf_path
+    extracted['unlocked_with'] = password
+    return extracted
 
 
 def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] in COMMANDS:
+        module_name, func_name = COMMANDS[argv[0]]
+        return getattr(importlib.import_module(module_name), func_name)(argv[1:])
+    if os.environ.get('BANK_PDF_WORKER'):
+        # Hand the run to a warm worker if one is listening; otherwise run here
+        from . import worker
+        code = worker.submit(argv)
+        if code is not None:
+            if code:
+                raise SystemExit(code)
+            return
+
     parser = argparse.ArgumentParser(description='Attempt to unlock a password-protected bank-statement PDF')
     parser.add_argument('--pdf', nargs='*', default=[], help='Path(s) to encrypted PDF(s). Provide one or more files')
     parser.add_argument('--pdfs-dir', default='temp_pdfs', help='Directory containing PDFs to process (default: temp_pdfs)')
@@ -37,25 +190,70 @@ def main(argv=None):
     parser.add_argument('--analyze', action='store_true', default=True, help='Send extracted JSON to an LLM (Gemini) for analysis (default: enabled)')
     parser.add_argument('--gemini-endpoint', default='', help='LLM endpoint URL (can also be set via GEMINI_ENDPOINT env var)')
     parser.add_argument('--gemini-key', default='', help='API key for Gemini (can also be set via GEMINI_API_KEY env var)')
+    parser.add_argument('--backend', default='', choices=['', 'pypdf2', 'pdfminer', 'pikepdf'], help='Text extraction backend (default: per-bank choice from `backends --save`, else pypdf2)')
+    parser.add_argument('--ndjson', default='', help="Stream page records as NDJSON to this path while extracting ('-' for stdout; other output then goes to stderr)")
+    parser.add_argument('--metrics-out', default='', help='Write a JSON report of per-stage timings and counters to this path')
+    parser.add_argument('--profile', default='', help='Run this one PDF (path or file name) under cProfile; stats go to <name>.prof')
+    parser.add_argument('--resume', nargs='?', const='latest', default='', help='Continue an interrupted run from its journal (default: the newest unfinished one under runs/)')
+    parser.add_argument('--no-journal', action='store_true', help='Do not journal progress (the run cannot be resumed)')
+    parser.add_argument('--keep-journal', action='store_true', help='Keep the run journal and its extraction results after the run completes')
+    parser.add_argument('--full-analysis', action='store_true', help='Re-analyze the whole history instead of only transactions not analyzed before (rebuilds the stored analysis state)')
+    parser.add_argument('--no-dedupe', action='store_true', help='Send every extracted document to the LLM as-is instead of one deduplicated transaction list per account')
+    parser.add_argument('--memory-limit', type=int, default=None, help='Per-worker memory budget in MB: large PDFs are processed in page chunks under it (default: BANK_PDF_MEMORY_LIMIT_MB, else none)')
     args = parser.parse_args(argv)
+    if args.resume and not _resolve_resume(args, parser):
+        return
+    # The options as given, before credentials and defaults are filled in, for the run journal
+    args._given = dict(vars(args))
+    if args.memory_limit is None:
+        args.memory_limit = memory.MEMORY_LIMIT_MB
+
+    if args.metrics_out:
+        metrics.reset()
+    args._ndjson_out = None
+    redirect = nullcontext()
+    if args.ndjson == '-':
+        # Keep stdout clean for the records; progress messages go to stderr
+        args._ndjson_out = sys.stdout
+        redirect = redirect_stdout(sys.stderr)
+    elif args.ndjson:
+        args._ndjson_out = open(args.ndjson, 'w', encoding='utf-8')
+    try:
+        with redirect:
+            return run(args)
+    finally:
+        if args._ndjson_out is not None and args._ndjson_out is not sys.stdout:
+            args._ndjson_out.close()
+        if args.metrics_out:
+            metrics.write_report(args.metrics_out)
+            print('Metrics report written to', args.metrics_out)
+
+
+def run(args):
+    """Unlock, extract and optionally analyze the PDFs selected by parsed CLI `args`."""
+    # If a .env file is present in the repo root, load it so environment variables
+    # like GEMINI_API_KEY and GEMINI_ENDPOINT become available.
+    try:
+        from dotenv import load_dotenv
+    except Exception:
+        load_dotenv = None
+    if load_dotenv is not None:
+        load_dotenv()
 
     # Try to fill missing credentials from root users.db (latest user)
     def _fill_from_users_db(args_obj):
-        try:
-            import sqlite3
-        except Exception:
-            return args_obj  # sqlite3 should be stdlib, but be safe
-        # Determine repo root relative to this file and expect DB at repo_root/users.db
-        repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
-        db_path = os.path.join(repo_root, 'users.db')
+        db_path = users.DEFAULT_DB_PATH
         if not os.path.isfile(db_path):
             return args_obj
 
         try:
             conn = sqlite3.connect(db_path)
             cur = conn.cursor()
+            # pw_features only exists once the DB has been touched by the current schema
+            cur.execute("PRAGMA table_info('users')")
+            features_col = 'pw_features' if 'pw_features' in [r[1] for r in cur.fetchall()] else 'NULL'
             # Order by rowid to get latest inserted user
-            cur.execute('SELECT user_id, full_name, dob, mobile FROM users ORDER BY rowid DESC LIMIT 1')
+            cur.execute(f'SELECT user_id, full_name, dob, mobile, {features_col} FROM users ORDER BY rowid DESC LIMIT 1')
             row = cur.fetchone()
         except Exception:
             try:
@@ -71,7 +269,7 @@ def main(argv=None):
                 pass
             return args_obj
 
-        user_id_db, full_name_db, dob_db, mobile_db = row
+        user_id_db, full_name_db, dob_db, mobile_db, features_db = row
 
         # Try to fetch a bank for this user_id from user_banks table (latest entry)
         bank_db = None
@@ -83,48 +281,17 @@ def main(argv=None):
         except Exception:
             # ignore and leave bank_db as None
             bank_db = None
-        # Helper: normalize many common DOB formats into dd-mm-yyyy
-        from datetime import datetime
-
-        def _normalize_dob(dob_value):
-            if not dob_value:
-                return None
-            dob_value = str(dob_value).strip()
-            # If already in expected format, return as-is
-            try:
-                dt = datetime.strptime(dob_value, '%d-%m-%Y')
-                return dt.strftime('%d-%m-%Y')
-            except Exception:
-                pass
 
-            # Try common patterns
-            candidates = [
-                '%d/%m/%Y', '%Y-%m-%d', '%Y/%m/%d', '%d %b %Y', '%d %B %Y', '%d.%m.%Y', '%d %m %Y'
-            ]
-            for fmt in candidates:
-                try:
-                    dt = datetime.strptime(dob_value, fmt)
-                    return dt.strftime('%d-%m-%Y')
-                except Exception:
-                    continue
-
-            # As a last resort, try to parse YYYYMMDD or DDMMYYYY numeric strings
-            cleaned = ''.join(ch for ch in dob_value if ch.isdigit())
-            if len(cleaned) == 8:
-                # try YYYYMMDD
-                try:
-                    dt = datetime.strptime(cleaned, '%Y%m%d')
-                    return dt.strftime('%d-%m-%Y')
-                except Exception:
-                    pass
-                # try DDMMYYYY
-                try:
-                    dt = datetime.strptime(cleaned, '%d%m%Y')
-                    return dt.strftime('%d-%m-%Y')
-                except Exception:
-                    pass
+        try:
+            conn.close()
+        except Exception:
+            pass
 
-            return None
+        # Stored features were derived from the stored credentials, so they are only
+        # usable when none of those credentials is overridden on the command line.
+        features = users.load_features(features_db)
+        if features and not (args_obj.full_name or args_obj.phone or args_obj.dob):
+            args_obj._pw_features = features
 
         # Only fill fields that are currently empty or defaults
         if not args_obj.full_name:
@@ -132,50 +299,22 @@ def main(argv=None):
         if not args_obj.phone:
             args_obj.phone = mobile_db or args_obj.phone
 
-        # Normalize DOB to dd-mm-yyyy. If normalization succeeds, write back to DB.
-        norm_dob = None
-        if dob_db:
-            norm_dob = _normalize_dob(dob_db)
-        # If CLI provided a dob, prefer that (but normalize it if possible)
+        # DOB is normalized to dd-mm-yyyy at registration (or by `backfill-users`);
+        # CLI input and legacy rows are normalized here without touching the DB.
         if args_obj.dob:
-            cli_norm = _normalize_dob(args_obj.dob)
-            if cli_norm:
-                args_obj.dob = cli_norm
-            # else leave as-is (validation will catch missing/invalid)
+            args_obj.dob = users.normalize_dob(args_obj.dob) or args_obj.dob
+        elif features:
+            args_obj.dob = dob_db or args_obj.dob
         else:
-            if norm_dob:
-                args_obj.dob = norm_dob
-            else:
-                # If DB had a value but we couldn't normalize, still use raw DB value
-                args_obj.dob = dob_db or args_obj.dob
-
-        # If DB DOB was normalized and differs from stored value, update DB to store dd-mm-yyyy
-        try:
-            if dob_db and norm_dob and norm_dob != str(dob_db).strip():
-                try:
-                    cur.execute('UPDATE users SET dob = ? WHERE user_id = ?', (norm_dob, user_id_db))
-                    conn.commit()
-                except Exception:
-                    # not critical; continue without failing
-                    pass
-        except Exception:
-            pass
+            args_obj.dob = users.normalize_dob(dob_db) or dob_db or args_obj.dob
 
         # If user provided no bank (or left default SBI) but db has a bank, prefer db value
         if (args_obj.bank in ('', 'SBI')) and bank_db:
             args_obj.bank = bank_db
 
         # expose the selected user_id and db_path on the args object for later use
-        try:
-            args_obj._user_id = user_id_db
-            args_obj._db_path = db_path
-        except Exception:
-            pass
-
-        try:
-            conn.close()
-        except Exception:
-            pass
+        args_obj._user_id = user_id_db
+        args_obj._db_path = db_path
 
         return args_obj
 
@@ -214,122 +353,212 @@ def main(argv=None):
             print('  -', m)
         return
 
-    # Generate password candidates once (same credentials used for all attachments)
-    candidates = generate_password_candidates(args.full_name, args.phone, args.dob, args.bank, args.max_candidates)
+    # Generate password candidates once (same credentials used for all attachments).
+    # Users registered through the UI carry precomputed features, so this is a lookup.
+    pw_features = getattr(args, '_pw_features', None)
+    if pw_features:
+        candidates = candidates_from_features(pw_features, args.bank, args.max_candidates)
+    else:
+        candidates = generate_password_candidates(args.full_name, args.phone, args.dob, args.bank, args.max_candidates)
+    stored = _stored_password(args)
+    if stored:
+        # The password that opened this user's last statement from the bank is the likeliest
+        candidates = [stored] + [c for c in candidates if c != stored]
     print(f'Generated {len(candidates)} password candidates (showing up to 10):')
     for c in candidates[:10]:
         print('  -', c)
 
+    from .backends import select_backend
+    backend = args.backend or select_backend(args.bank)
     consolidated = {'documents': []}
 
-    for pdf_path in pdf_paths:
-        print('\nProcessing:', pdf_path)
-        success, password, decrypted_path = try_unlock_pdf(pdf_path, candidates)
-        if not success:
-            print('  Unable to unlock this PDF with generated candidates. Skipping.')
-            consolidated['documents'].append({'path': pdf_path, 'error': 'unable to unlock'})
+    journal = _open_journal(args)
+    if journal is None and args.resume:
+        return
+    try:
+        return _process_all(args, pdf_paths, candidates, backend, consolidated, journal)
+    finally:
+        if journal is not None:
+            journal.close()
+
+
+# Never written to a run journal, which can stay on disk after the run
+JOURNAL_SECRET_ARGS = ('gemini_key',)
+# Options of the resuming command itself, never taken from the journal
+_RESUME_OWN_ARGS = ('resume', 'no_journal')
+
+
+def _resolve_resume(args, parser) -> bool:
+    """Point `args.resume` at the journal to resume and fill in the interrupted run's options.
+
+    Every option left at its default on this command line takes the value
+    recorded in the journal's run_start, so `--resume` alone repeats the run.
+    False (after reporting it) if there is no such journal.
+    """
+    from . import journal as run_journal
+
+    directory = run_journal.latest_unfinished() if args.resume == 'latest' else args.resume
+    if not directory or not os.path.isfile(os.path.join(directory, run_journal.JOURNAL_NAME)):
+        print('Error: no unfinished run journal to resume' + ('' if args.resume == 'latest' else f' at {args.resume}'))
+        return False
+    args.resume = directory
+    for key, value in (run_journal.Journal(directory, readonly=True).args or {}).items():
+        if key in _RESUME_OWN_ARGS or key in JOURNAL_SECRET_ARGS or not hasattr(args, key):
             continue
+        if getattr(args, key) == parser.get_default(key):
+            setattr(args, key, value)
+    return True
+
+
+def _stored_password(args):
+    """The password `persist_password` stored for the users.db user and --bank, if any."""
+    user_id, db_path = getattr(args, '_user_id', None), getattr(args, '_db_path', None)
+    if not user_id or not db_path:
+        return None
+    try:
+        conn = sqlite3.connect(db_path)
+        try:
+            row = conn.execute('SELECT password FROM user_banks WHERE user_id = ? AND bank_name = ?',
+                               (user_id, (args.bank or '').strip().lower())).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    return row[0] if row and row[0] else None
 
-        if password:
-            print('  Successfully unlocked PDF with password:', password)
 
-            # If we have a user_id from the DB and a discovered password, persist it
-            try:
-                user_id_to_update = getattr(args, '_user_id', None)
-                db_path_to_use = getattr(args, '_db_path', None)
-                # Normalize bank name to match storage (we store lower-case bank names elsewhere)
-                bank_for_update = (args.bank or '').strip().lower()
-                if password and user_id_to_update and db_path_to_use:
-                    print(f"[debug] Persisting password for user_id={user_id_to_update} bank={bank_for_update} db={db_path_to_use}")
-                    # ensure password column exists
-                    try:
-                        conn_up = sqlite3.connect(db_path_to_use)
-                        cur_up = conn_up.cursor()
-                        cur_up.execute("PRAGMA table_info('user_banks')")
-                        cols = [r[1] for r in cur_up.fetchall()]
-                        print(f"[debug] user_banks columns: {cols}")
-                        if 'password' not in cols:
-                            try:
-                                cur_up.execute('ALTER TABLE user_banks ADD COLUMN password TEXT')
-                                conn_up.commit()
-                            except Exception:
-                                # ignore migration failure
-                                pass
-
-                        # Upsert password for (user_id, bank_name).
-                        # user_banks has UNIQUE(user_id, bank_name) so use ON CONFLICT to update.
-                        try:
-                            # Prefer standard UPSERT if available
-                            cur_up.execute(
-                                'INSERT INTO user_banks (user_id, bank_name, password) VALUES (?, ?, ?) '
-                                'ON CONFLICT(user_id, bank_name) DO UPDATE SET password=excluded.password',
-                                (user_id_to_update, bank_for_update, password)
-                            )
-                            print('[debug] Executed UPSERT with ON CONFLICT')
-                        except Exception as e_upsert:
-                            print(f"[debug] UPSERT failed: {e_upsert}; falling back to update/insert")
-                            try:
-                                cur_up.execute('UPDATE user_banks SET password = ? WHERE user_id = ? AND bank_name = ?', (password, user_id_to_update, bank_for_update))
-                                if cur_up.rowcount == 0:
-                                    cur_up.execute('INSERT OR IGNORE INTO user_banks (user_id, bank_name, password) VALUES (?, ?, ?)', (user_id_to_update, bank_for_update, password))
-                                    print('[debug] Performed INSERT OR IGNORE fallback')
-                                else:
-                                    print('[debug] Performed UPDATE fallback (rows affected: ' + str(cur_up.rowcount) + ')')
-                            except Exception as e_fallback:
-                                print(f"[debug] Fallback update/insert failed: {e_fallback}")
-
-                        conn_up.commit()
-                        print('[debug] Committed password to user_banks')
-                    except Exception:
-                        pass
-                    finally:
-                        try:
-                            conn_up.close()
-                        except Exception:
-                            pass
-            except Exception:
-                pass
-        else:
-            print('  PDF was not encrypted (opened without password).')
+def _open_journal(args):
+    """The run journal for this invocation: a resumed one, a new one, or None."""
+    from . import journal as run_journal
 
-        out_path = decrypted_path
+    if args.resume:
+        directory = run_journal.latest_unfinished() if args.resume == 'latest' else args.resume
+        if not directory or not os.path.isfile(os.path.join(directory, run_journal.JOURNAL_NAME)):
+            print('Error: no unfinished run journal to resume' + ('' if args.resume == 'latest' else f' at {args.resume}'))
+            return None
+        journal = run_journal.Journal(directory)
+        print(f'Resuming run journal {directory} ({len(journal.documents)} documents recorded)')
+        return journal
+    if args.no_journal:
+        return None
+    journal = run_journal.Journal.create()
+    recorded = {k: v for k, v in args._given.items() if not k.startswith('_') and k not in JOURNAL_SECRET_ARGS}
+    # --pdf is relative to the working directory, which a resumed run may not share
+    recorded['pdf'] = [os.path.abspath(p) for p in args.pdf or []]
+    journal.append('run_start', args=recorded)
+    print('Run journal:', journal.dir, '(continue an interrupted run with --resume)')
+    return journal
+
+
+def _process_all(args, pdf_paths, candidates, backend, consolidated, journal):
+    from .watch import file_hash
+
+    seen_files = {}
+    for pdf_path in pdf_paths:
+        print('\nProcessing:', pdf_path)
+        if not args.no_dedupe:
+            # The same attachment downloaded twice is only processed once
+            first = seen_files.setdefault(file_hash(pdf_path), pdf_path)
+            if first != pdf_path:
+                print('  Same file as', first, '- skipping.')
+                continue
+        if journal is not None:
+            cached = journal.load_result(pdf_path)
+            if cached is not None:
+                print('  Already extracted in this run (loaded from the journal).')
+                consolidated['documents'].append(cached)
+                continue
         # If user provided --output and only one input file, use that; otherwise keep decrypted temp file.
-        if args.output and len(pdf_paths) == 1:
-            if decrypted_path and decrypted_path != args.output:
-                shutil.copyfile(decrypted_path, args.output)
-            out_path = args.output
-
-        is_text = contains_text(out_path)
-        if is_text:
-            print('  PDF contains extractable text (no OCR needed).')
-        else:
-            print('  PDF appears to be scanned images (OCR may be required).')
-
-        do_ocr = args.ocr or (not is_text)
-        extracted = extract_pdf_all(out_path, ocr=do_ocr, max_pages=args.limit_pages)
-        extracted['path'] = pdf_path
-        extracted['unlocked_with'] = password
+        output = args.output if len(pdf_paths) == 1 else ''
+        on_record = None
+        if args._ndjson_out is not None:
+            def on_record(rec, pdf_path=pdf_path):
+                args._ndjson_out.write(json.dumps({**rec, 'path': pdf_path}, ensure_ascii=False, default=str) + '\n')
+                args._ndjson_out.flush()
+        on_unlocked = None
+        if journal is not None:
+            def on_unlocked(password, pdf_path=pdf_path):
+                journal.record_unlocked(pdf_path, bool(password))
+        profiling = bool(args.profile) and args.profile in (pdf_path, os.path.basename(pdf_path))
+        with metrics.profiled(os.path.basename(pdf_path) + '.prof') if profiling else nullcontext():
+            extracted = process_pdf(pdf_path, candidates, ocr=args.ocr, limit_pages=args.limit_pages, output=output,
+                                    backend=backend, on_record=on_record, on_unlocked=on_unlocked,
+                                    budget=memory.budget_for(args.memory_limit))
         consolidated['documents'].append(extracted)
 
+        # If we have a user_id from the DB and a discovered password, persist it
+        user_id_to_update = getattr(args, '_user_id', None)
+        db_path_to_use = getattr(args, '_db_path', None)
+        if extracted.get('unlocked_with') and user_id_to_update and db_path_to_use:
+            persist_password(db_path_to_use, user_id_to_update, args.bank, extracted['unlocked_with'])
+        if user_id_to_update and db_path_to_use and not extracted.get('error'):
+            # Keep the search index current so later queries need not reprocess this PDF
+            from .search import update_index
+            try:
+                update_index(db_path_to_use, user_id_to_update, args.bank, pdf_path, extracted)
+            except sqlite3.Error as e:
+                print('  Could not update the search index:', e)
+        if journal is not None:
+            # Last, so a crash before this point redoes the document rather than losing it
+            journal.save_result(pdf_path, extracted)
+
     # If analysis requested, send the consolidated data to the LLM and print ONLY the LLM output.
     if args.analyze:
         gemini_key = args.gemini_key or os.environ.get('GEMINI_API_KEY')
         gemini_endpoint = args.gemini_endpoint or os.environ.get('GEMINI_ENDPOINT')
         if not gemini_key:
             print('Analysis requested but GEMINI_API_KEY not provided (set GEMINI_API_KEY env or --gemini-key).')
+            if journal is not None:
+                print('Extraction is saved; set the key and rerun with --resume to analyze without reprocessing.')
             return
         # If no endpoint provided, default to Google's Generative Language v1 generateContent for gemini-2.0-flash
         if not gemini_endpoint:
-            gemini_endpoint = 'https://generativelanguage.googleapis.com/v1/models/gemini-2.0-flash:generateContent'
-
-        prompt = format_analysis_prompt(consolidated)
-        try:
-            resp = analyze_with_gemini(prompt, gemini_endpoint, gemini_key)
-            parsed = parse_model_response(resp)
-            # Print only the model's analysis output
-            print(json.dumps(parsed, ensure_ascii=False, indent=2))
-        except Exception as e:
-            print('Analysis failed:', e)
+            from .analysis import DEFAULT_ENDPOINT
+            gemini_endpoint = DEFAULT_ENDPOINT
+
+        parsed = journal.load_analysis() if journal is not None else None
+        if parsed is None:
+            from .analysis import format_analysis_prompt, analyze_with_gemini, parse_model_response
+            payload = consolidated
+            if not args.no_dedupe:
+                from .statements import consolidate, summary_line
+                payload = consolidate(consolidated['documents'], bank=args.bank)
+                print('Deduplicated:', summary_line(consolidated['documents'], payload))
+            user_id, db_path = getattr(args, '_user_id', None), getattr(args, '_db_path', None)
+            try:
+                if not args.no_dedupe:
+                    # Merchants and categories come from local rules and the narration cache;
+                    # only narrations never seen before are sent to the LLM
+                    from .merchants import annotate_payload, llm_client
+                    counts = annotate_payload(payload, db_path, llm_client(gemini_endpoint, gemini_key))
+                    print(f"Classified {counts['transactions']} transactions locally "
+                          f"({counts['llm_narrations']} new narrations sent to the LLM)")
+                if user_id and db_path and not args.no_dedupe:
+                    # Only transactions not analyzed in earlier runs go to the LLM
+                    from .incremental import analyze_incremental
+                    parsed, info = analyze_incremental(db_path, user_id, payload, gemini_endpoint, gemini_key,
+                                                       full=args.full_analysis)
+                    if info['reused']:
+                        print('No new transactions since the last analysis; showing the stored result.')
+                    else:
+                        print(f"Incremental analysis: {info['new_transactions']} new transactions in "
+                              f"{len(info['delta_periods'])} periods, {info['new_documents']} new documents, "
+                              f"{info['prior_periods']} earlier periods summarized")
+                else:
+                    prompt = format_analysis_prompt(payload)
+                    resp = analyze_with_gemini(prompt, gemini_endpoint, gemini_key)
+                    parsed = parse_model_response(resp)
+            except Exception as e:
+                print('Analysis failed:', e)
+                if journal is not None:
+                    print('Extraction is saved; rerun with --resume to retry only the analysis.')
+                return
+            if journal is not None:
+                journal.save_analysis(parsed)
+        # Print only the model's analysis output
+        print(json.dumps(parsed, ensure_ascii=False, indent=2))
+        if journal is not None:
+            journal.finish(keep=args.keep_journal)
         return
 
     # Not analyzing: print a short summary but do not print the full extracted JSON to console
@@ -337,8 +566,13 @@ def main(argv=None):
     print('  documents:', len(consolidated['documents']))
     totals = [d.get('num_pages', 0) for d in consolidated['documents'] if not d.get('error')]
     print('  total pages processed (sum of readable docs):', sum(totals))
+    if not args.no_dedupe:
+        from .statements import consolidate, summary_line
+        print('  deduplicated:', summary_line(consolidated['documents'], consolidate(consolidated['documents'], bank=args.bank)))
     if args.json:
         print('Extraction collected; use --analyze to send consolidated data to Gemini or --json-out to save to a file.')
+    if journal is not None:
+        journal.finish(keep=args.keep_journal)
 
 
 if __name__ == '__main__':
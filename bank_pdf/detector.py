@@ -1,30 +1,95 @@
-from typing import Optional
+from typing import Dict, List, Optional
 
-try:
-    from PyPDF2 import PdfReader
-except Exception:
-    PdfReader = None
+from . import metrics
+from .backends import PAGE_EMPTY, PAGE_IMAGE, PAGE_TEXT, get_backend
 
 
-def contains_text(pdf_path: str, page_limit: int = 5) -> bool:
-    """Return True if the PDF contains extractable text.
+def page_needs_ocr(kind: Optional[str], text: Optional[str]) -> bool:
+    """True if a page of this kind/extracted text has no usable text layer."""
+    if kind == PAGE_IMAGE:
+        return True
+    if kind in (PAGE_TEXT, PAGE_EMPTY):
+        return False
+    # mixed or unknown: only if extraction came back empty
+    return text is not None and not text.strip()
+
 
-    Uses `PyPDF2`'s `extract_text()` on the first few pages; conservative default.
+class TextProbe:
+    """Result of `probe_text`: per-page kinds plus any text already extracted.
+
+    `kinds[i]` is 'text', 'image', 'mixed', 'empty' or None (backend cannot
+    classify). `texts` maps page index -> text for the pages that were
+    extracted while looking for the threshold; `iter_pdf_pages(probe=...)`
+    reuses them instead of parsing those pages again.
     """
-    if PdfReader is None:
-        return False
+
+    def __init__(self, num_pages: int = 0):
+        self.num_pages = num_pages
+        self.kinds: List[Optional[str]] = []
+        self.texts: Dict[int, str] = {}
+        self.has_text = False
+
+    def needs_ocr(self, index: int, text: Optional[str] = None) -> bool:
+        """True if page `index` has no usable text layer and should be OCR'd."""
+        kind = self.kinds[index] if index < len(self.kinds) else None
+        return page_needs_ocr(kind, self.texts.get(index) if text is None else text)
+
+    @property
+    def ocr_pages(self) -> List[int]:
+        return [i for i in range(len(self.kinds)) if self.needs_ocr(i)]
+
+
+def probe_text(pdf_path: str, page_limit: int = 5, threshold: int = 50, max_pages: Optional[int] = None,
+               backend=None, password: Optional[str] = None) -> TextProbe:
+    """Classify pages and decide whether the PDF has extractable text.
+
+    Every page (up to `max_pages`) is classified from its resources and content
+    stream, which is cheap. Text is extracted only from text/mixed pages among
+    the first `page_limit`, and only until more than `threshold` characters
+    have been seen.
+    """
+    engine = get_backend(backend)
+    if not engine.available():
+        return TextProbe()
 
     try:
-        reader = PdfReader(pdf_path)
-        text = []
-        pages_to_check = min(page_limit, len(reader.pages))
-        for i in range(pages_to_check):
+        doc = engine.open(pdf_path, password)
+    except Exception:
+        return TextProbe()
+
+    try:
+        probe = TextProbe(doc.num_pages)
+        pages = doc.num_pages if max_pages is None else min(doc.num_pages, max_pages)
+        collected: List[str] = []
+        for i in range(pages):
             try:
-                ptext = reader.pages[i].extract_text() or ''
+                kind = doc.page_kind(i)
+            except Exception:
+                kind = None
+            probe.kinds.append(kind)
+            if probe.has_text or i >= page_limit or kind in (PAGE_IMAGE, PAGE_EMPTY):
+                continue
+            try:
+                ptext = doc.page_text(i) or ''
             except Exception:
                 ptext = ''
-            text.append(ptext)
-        joined = '\n'.join(text).strip()
-        return len(joined) > 50
+            probe.texts[i] = ptext
+            collected.append(ptext)
+            probe.has_text = len('\n'.join(collected).strip()) > threshold
+        metrics.incr('pages_probed', pages)
+        return probe
     except Exception:
-        return False
+        return TextProbe()
+    finally:
+        doc.close()
+
+
+@metrics.timed('text_detection')
+def contains_text(pdf_path: str, page_limit: int = 5, backend=None) -> bool:
+    """Return True if the PDF contains extractable text.
+
+    Conservative default: looks at the first few pages and stops as soon as
+    enough text is found. Use `probe_text` to also keep the per-page
+    classification and the extracted text.
+    """
+    return probe_text(pdf_path, page_limit=page_limit, max_pages=page_limit, backend=backend).has_text
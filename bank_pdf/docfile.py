@@ -0,0 +1,172 @@
+"""Compact binary storage for extraction results (`.bpd` files).
+
+An `extract_pdf_all` result repeats every page's text in `pages[].text`,
+`extracted_text` and `ocr_text`. A docfile stores it once, compressed page by
+page, behind a small index so one page or just the metadata can be read from
+a memory map without decompressing anything else:
+
+    header   32 bytes  magic b'BPDOC\\0', version, codec, page count,
+                       metadata length, index offset, data offset
+    meta     JSON      the result without page text (path, metadata,
+                       backend, per-page kind, ...)
+    index    36 bytes per page: page number, then (offset, compressed length,
+                       raw length) of its text block and of its OCR block
+    data     one compressed block per page text / OCR text
+
+Blocks are zstd-compressed when the `zstandard` package is installed and
+zlib-compressed otherwise; the codec is recorded in the header. An empty text
+has a zero-length block. Files are written to a temporary name and renamed.
+"""
+import json
+import mmap
+import os
+import struct
+import zlib
+from typing import Any, Dict, Iterator, Optional
+
+try:
+    import zstandard
+except Exception:
+    zstandard = None
+
+MAGIC = b'BPDOC\0'
+VERSION = 1
+CODEC_ZLIB = 0
+CODEC_ZSTD = 1
+ZSTD_LEVEL = 9
+ZLIB_LEVEL = 9
+
+_HEADER = struct.Struct('<6sBBIIQQ')
+_ENTRY = struct.Struct('<IQIIQII')
+
+
+def _compressor(codec: int):
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress
+    return lambda data: zlib.compress(data, ZLIB_LEVEL)
+
+
+def _decompressor(codec: int):
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError('this docfile is zstd-compressed; install zstandard to read it')
+        dctx = zstandard.ZstdDecompressor()
+        return lambda data, size: dctx.decompress(data, max_output_size=size)
+    return lambda data, size: zlib.decompress(data)
+
+
+def to_bytes(result: Dict[str, Any], codec: Optional[int] = None) -> bytes:
+    """Encode an `extract_pdf_all` result as a docfile."""
+    if codec is None:
+        codec = CODEC_ZSTD if zstandard is not None else CODEC_ZLIB
+    compress = _compressor(codec)
+    pages = result.get('pages') or []
+    meta = {k: v for k, v in result.items() if k not in ('pages', 'extracted_text', 'ocr_text')}
+    meta['page_kinds'] = [p.get('kind') for p in pages]
+    meta['has_ocr'] = [('ocr_text' in p) for p in pages]
+    meta_bytes = json.dumps(meta, ensure_ascii=False, default=str).encode('utf-8')
+
+    index_offset = _HEADER.size + len(meta_bytes)
+    data_offset = index_offset + _ENTRY.size * len(pages)
+    entries, blocks, pos = [], [], data_offset
+    for i, page in enumerate(pages):
+        spans = []
+        for text in (page.get('text') or '', page.get('ocr_text') or ''):
+            raw = text.encode('utf-8')
+            block = compress(raw) if raw else b''
+            spans.extend((pos, len(block), len(raw)))
+            blocks.append(block)
+            pos += len(block)
+        entries.append(_ENTRY.pack(page.get('page_number') or i + 1, *spans))
+
+    header = _HEADER.pack(MAGIC, VERSION, codec, len(pages), len(meta_bytes), index_offset, data_offset)
+    return b''.join([header, meta_bytes, *entries, *blocks])
+
+
+def write(path: str, result: Dict[str, Any], codec: Optional[int] = None) -> int:
+    """Write `result` to `path` atomically; returns the file size."""
+    data = to_bytes(result, codec)
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return len(data)
+
+
+class DocFile:
+    """Read-only view of a docfile through a memory map.
+
+    `meta` and `num_pages` read only the header and metadata; `page(n)`
+    decompresses just that page's blocks.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, self.codec, self.num_pages, meta_len, self._index, self._data = _HEADER.unpack_from(self._mm, 0)
+        except struct.error:
+            self._mm.close()
+            raise ValueError(f'{path}: not a docfile')
+        if magic != MAGIC or version != VERSION:
+            self._mm.close()
+            raise ValueError(f'{path}: not a docfile (or an unsupported version)')
+        self._meta_len = meta_len
+        self._meta: Optional[Dict[str, Any]] = None
+        self._decompress = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        self._mm.close()
+
+    @property
+    def meta(self) -> Dict[str, Any]:
+        if self._meta is None:
+            self._meta = json.loads(self._mm[_HEADER.size:_HEADER.size + self._meta_len].decode('utf-8'))
+        return self._meta
+
+    def _block(self, offset: int, length: int, raw_length: int) -> str:
+        if not length:
+            return ''
+        if self._decompress is None:
+            self._decompress = _decompressor(self.codec)
+        return self._decompress(self._mm[offset:offset + length], raw_length).decode('utf-8')
+
+    def page(self, index: int) -> Dict[str, Any]:
+        """Page `index` (0-based) as an `extract_pdf_all` page dict."""
+        if not 0 <= index < self.num_pages:
+            raise IndexError(index)
+        number, t_off, t_len, t_raw, o_off, o_len, o_raw = _ENTRY.unpack_from(self._mm, self._index + index * _ENTRY.size)
+        page = {'page_number': number, 'text': self._block(t_off, t_len, t_raw)}
+        kinds = self.meta.get('page_kinds') or []
+        if index < len(kinds) and kinds[index] is not None:
+            page['kind'] = kinds[index]
+        if (self.meta.get('has_ocr') or [False] * self.num_pages)[index]:
+            page['ocr_text'] = self._block(o_off, o_len, o_raw)
+        return page
+
+    def pages(self) -> Iterator[Dict[str, Any]]:
+        for i in range(self.num_pages):
+            yield self.page(i)
+
+    def to_result(self) -> Dict[str, Any]:
+        """The full `extract_pdf_all` result, as it was written."""
+        result = {k: v for k, v in self.meta.items() if k not in ('page_kinds', 'has_ocr')}
+        result['pages'] = list(self.pages())
+        result['extracted_text'] = ''.join(p['text'] for p in result['pages'])
+        if result.get('ocr_performed'):
+            result['ocr_text'] = ''.join(p.get('ocr_text') or '' for p in result['pages'])
+        return result
+
+
+def read(path: str) -> Dict[str, Any]:
+    with DocFile(path) as doc:
+        return doc.to_result()
@@ -1,17 +1,24 @@
 import json
-from typing import Dict, Any, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
-try:
-    from PyPDF2 import PdfReader
-except Exception:
-    PdfReader = None
+from . import metrics
+from .backends import PAGE_EMPTY, PAGE_IMAGE, get_backend
+from .detector import TextProbe, page_needs_ocr
+from .memory import Budget, MemoryLimitExceeded
 
-try:
-    from pdf2image import convert_from_path
-    import pytesseract
-except Exception:
-    convert_from_path = None
-    pytesseract = None
+
+def _ocr_tools():
+    """(convert_from_path, OCR engine), loaded on first OCR; None for whichever is missing.
+
+    pdf2image and the OCR engine pull in PIL and start Tesseract, which most
+    text-only runs never need.
+    """
+    try:
+        from pdf2image import convert_from_path
+    except Exception:
+        convert_from_path = None
+    from .ocr import get_engine
+    return convert_from_path, get_engine()
 
 
 def _clean_metadata(md) -> Dict[str, Any]:
@@ -32,61 +39,178 @@ def _clean_metadata(md) -> Dict[str, Any]:
     return out
 
 
-def extract_pdf_all(pdf_path: str, ocr: bool = False, max_pages: Optional[int] = None) -> Dict[str, Any]:
-    """Extract metadata and per-page text from `pdf_path`.
+def _page_ranges(indexes: List[int]) -> List[Tuple[int, int]]:
+    """Group sorted 0-based page indexes into inclusive 1-based (first, last) runs."""
+    runs: List[Tuple[int, int]] = []
+    for i in indexes:
+        if runs and runs[-1][1] == i:
+            runs[-1] = (runs[-1][0], i + 1)
+        else:
+            runs.append((i + 1, i + 1))
+    return runs
+
 
-    If `ocr` is True (or pdf2image+pytesseract are available and text is missing), an OCR pass will be attempted.
-    Returns a dict suitable for JSON serialization.
+def iter_pdf_pages(pdf_path: str, ocr: bool = False, max_pages: Optional[int] = None, backend=None,
+                   probe: Optional[TextProbe] = None, password: Optional[str] = None,
+                   budget: Optional[Budget] = None) -> Iterator[Dict[str, Any]]:
+    """Yield extraction records for `pdf_path` as soon as each one is available.
+
+    Records, in order:
+      - {'type': 'document', 'path', 'metadata', 'num_pages', 'backend'}
+      - {'type': 'page', 'page_number', 'text', 'kind'} for every page inspected
+      - {'type': 'ocr_page', 'page_number', 'ocr_text'} for each page without a usable
+        text layer (image pages, or every page if none had text), when OCR was
+        requested or is available
+      - {'type': 'ocr_error', 'error'} if OCR was wanted but cannot run
+      - {'type': 'error', 'error'} if the PDF cannot be read, or the memory
+        budget is exceeded (always the last record)
+
+    Pass the `probe_text` result as `probe` to reuse its page classification and
+    the text it already extracted. Nothing is accumulated across pages, so
+    memory stays flat for long statements. `password` opens an encrypted PDF
+    directly. With a `budget` (see `bank_pdf.memory`) pages are read in chunks,
+    the parser's caches are dropped between chunks and RSS is checked after
+    each chunk and OCR batch.
     """
-    result: Dict[str, Any] = {'path': pdf_path, 'metadata': {}, 'num_pages': 0, 'pages': [], 'ocr_performed': False}
+    engine = get_backend(backend)
+    if not engine.available():
+        yield {'type': 'error', 'error': f'{engine.name} backend not available (is PyPDF2 installed?)'}
+        return
 
-    if PdfReader is None:
-        result['error'] = 'PyPDF2 not installed'
-        return result
+    try:
+        doc = engine.open(pdf_path, password)
+    except Exception as e:
+        yield {'type': 'error', 'error': f'failed to read PDF: {e}'}
+        return
 
+    ocr_needed: List[int] = []
     try:
-        reader = PdfReader(pdf_path)
-        md = _clean_metadata(reader.metadata)
-        result['metadata'] = md
-        num_pages = len(reader.pages)
-        result['num_pages'] = num_pages
+        num_pages = doc.num_pages
+        yield {'type': 'document', 'path': pdf_path, 'metadata': _clean_metadata(doc.metadata()),
+               'num_pages': num_pages, 'backend': engine.name}
         pages_to_check = num_pages if max_pages is None else min(num_pages, max_pages)
 
-        extracted_total = ''
+        has_text = False
+        next_check = budget.chunk_pages if budget is not None else None
         for i in range(pages_to_check):
-            try:
-                text = reader.pages[i].extract_text() or ''
-            except Exception:
+            if i == next_check:
+                doc.release()
+                budget.check('text')
+                metrics.incr('memory_chunks')
+                next_check = i + budget.chunk_pages
+            if probe is not None and i < len(probe.kinds):
+                kind = probe.kinds[i]
+            else:
+                try:
+                    kind = doc.page_kind(i)
+                except Exception:
+                    kind = None
+            if probe is not None and i in probe.texts:
+                text = probe.texts[i]
+                metrics.incr('pages_reused')
+            elif kind in (PAGE_IMAGE, PAGE_EMPTY):
                 text = ''
-            page_entry = {'page_number': i + 1, 'text': text}
-            result['pages'].append(page_entry)
-            extracted_total += text or ''
+            else:
+                try:
+                    text = doc.page_text(i) or ''
+                except Exception:
+                    text = ''
+                metrics.incr('pages_extracted')
+            has_text = has_text or bool(text.strip())
+            if page_needs_ocr(kind, text):
+                ocr_needed.append(i)
+            yield {'type': 'page', 'page_number': i + 1, 'text': text, 'kind': kind}
+    except MemoryLimitExceeded as e:
+        yield {'type': 'error', 'error': f'memory limit exceeded: {e}'}
+        return
+    except Exception as e:
+        yield {'type': 'error', 'error': f'failed to read PDF: {e}'}
+        return
+    finally:
+        doc.close()
 
-        result['extracted_text'] = extracted_total
+    if not has_text and not ocr_needed:
+        # Nothing classified as scanned but no text either: OCR everything, as before
+        ocr_needed = list(range(pages_to_check))
+    if not ocr_needed:
+        return
+    convert_from_path, engine = _ocr_tools()
+    if not (ocr or (convert_from_path and engine)):
+        return
+    if convert_from_path is None or engine is None:
+        yield {'type': 'ocr_error', 'error': 'pdf2image or tesseract not available'}
+        return
+    from .ocr import ocr_images
+    try:
+        with metrics.timer('ocr'):
+            for first, last in _page_ranges(ocr_needed):
+                # Render and recognize one engine batch at a time; a budget may shrink the batch
+                start = first
+                while start <= last:
+                    size = engine.batch_size if budget is None else min(engine.batch_size, budget.ocr_batch)
+                    end = min(last, start + size - 1)
+                    images = convert_from_path(pdf_path, dpi=200, first_page=start, last_page=end, userpw=password)
+                    texts = ocr_images(images, engine)
+                    # Free the rendered pages before the next batch is rendered
+                    del images
+                    for page_number, txt in enumerate(texts, start):
+                        metrics.incr('pages_ocr')
+                        yield {'type': 'ocr_page', 'page_number': page_number, 'ocr_text': txt}
+                    if budget is not None:
+                        budget.check('ocr')
+                    start = end + 1
+    except MemoryLimitExceeded as e:
+        yield {'type': 'error', 'error': f'memory limit exceeded: {e}'}
+    except Exception as e:
+        yield {'type': 'error', 'error': f'failed to read PDF: {e}'}
 
-        # if no extracted text and ocr requested or possible, run OCR
-        if (not extracted_total.strip()) and (ocr or (ocr is False and convert_from_path and pytesseract)):
-            # attempt OCR on the pages we collected (or all pages)
-            if convert_from_path is None or pytesseract is None:
-                result['ocr_error'] = 'pdf2image or pytesseract not available'
+
+def collect_pages(records: Iterable[Dict[str, Any]], pdf_path: str) -> Dict[str, Any]:
+    """Assemble `iter_pdf_pages` records into the `extract_pdf_all` result dict."""
+    result: Dict[str, Any] = {'path': pdf_path, 'metadata': {}, 'num_pages': 0, 'pages': [], 'ocr_performed': False}
+    ocr_texts: List[str] = []
+    for rec in records:
+        kind = rec['type']
+        if kind == 'document':
+            result['metadata'] = rec['metadata']
+            result['num_pages'] = rec['num_pages']
+            result['backend'] = rec['backend']
+        elif kind == 'page':
+            result['pages'].append({'page_number': rec['page_number'], 'text': rec['text'], 'kind': rec['kind']})
+        elif kind == 'ocr_page':
+            idx = rec['page_number'] - 1
+            # attach ocr_text per page
+            if idx < len(result['pages']):
+                result['pages'][idx]['ocr_text'] = rec['ocr_text']
             else:
-                ocr_text_total = ''
-                images = convert_from_path(pdf_path, dpi=200, first_page=1, last_page=pages_to_check)
-                for idx, img in enumerate(images):
-                    try:
-                        txt = pytesseract.image_to_string(img)
-                    except Exception as e:
-                        txt = ''
-                    ocr_text_total += txt or ''
-                    # attach ocr_text per page
-                    if idx < len(result['pages']):
-                        result['pages'][idx]['ocr_text'] = txt
-                    else:
-                        result['pages'].append({'page_number': idx + 1, 'text': '', 'ocr_text': txt})
-
-                result['ocr_performed'] = True
-                result['ocr_text'] = ocr_text_total
-
-        return result
-    except Exception as e:
-        return {'error': f'failed to read PDF: {e}'}
+                result['pages'].append({'page_number': rec['page_number'], 'text': '', 'ocr_text': rec['ocr_text']})
+            ocr_texts.append(rec['ocr_text'] or '')
+            result['ocr_performed'] = True
+        elif kind == 'ocr_error':
+            result['ocr_error'] = rec['error']
+        elif kind == 'error':
+            if rec['error'].startswith('failed to read PDF'):
+                return {'error': rec['error']}
+            result['error'] = rec['error']
+            return result
+
+    result['extracted_text'] = ''.join(p['text'] for p in result['pages'])
+    if result['ocr_performed']:
+        result['ocr_text'] = ''.join(ocr_texts)
+    return result
+
+
+@metrics.timed('extraction')
+def extract_pdf_all(pdf_path: str, ocr: bool = False, max_pages: Optional[int] = None, backend=None,
+                    probe: Optional[TextProbe] = None, password: Optional[str] = None,
+                    budget: Optional[Budget] = None) -> Dict[str, Any]:
+    """Extract metadata and per-page text from `pdf_path`.
+
+    If `ocr` is True (or pdf2image and Tesseract are available and text is missing), an OCR pass will be attempted.
+    `backend` is an extraction backend name or instance (see `bank_pdf.backends`; default: pypdf2).
+    `probe` is an optional `probe_text` result whose work is reused.
+    `password` and `budget` are passed to `iter_pdf_pages`.
+    Returns a dict suitable for JSON serialization; use `iter_pdf_pages` to stream instead.
+    """
+    return collect_pages(iter_pdf_pages(pdf_path, ocr=ocr, max_pages=max_pages, backend=backend, probe=probe,
+                                        password=password, budget=budget), pdf_path)
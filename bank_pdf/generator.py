@@ -1,16 +1,18 @@
 import re
-from typing import List
+from typing import Any, Dict, List
 
+from . import metrics
 
-def generate_password_candidates(full_name: str, phone: str, dob: str, bank: str, max_candidates: int = 200) -> List[str]:
-    """Generate likely password candidates from provided credentials.
 
-    See `bank_pdf.cli` README for supported template placeholders.
+def password_features(full_name: str, phone: str, dob: str) -> Dict[str, Any]:
+    """Derive the name/phone/DOB pieces that password templates are built from.
+
+    The result is plain JSON-serializable data so it can be computed once when a
+    user registers and stored alongside the user (see `bank_pdf.users`).
     """
     full_name = (full_name or "").strip()
     phone = re.sub(r"\D", "", (phone or ""))
     dob = re.sub(r"\D", "", (dob or ""))
-    bank = (bank or "").strip().lower()
 
     parts = full_name.split()
     first = parts[0] if parts else ""
@@ -19,8 +21,8 @@ def generate_password_candidates(full_name: str, phone: str, dob: str, bank: str
     last = parts[-1] if len(parts) > 1 else ""
     initials = ''.join([p[0] for p in parts]) if parts else ""
 
-
     dob_variants = set()
+    year = ''
     if dob:
         # dob is digits-only at this point (e.g. 'ddmmyyyy' if input was 'dd-mm-yyyy')
         # extract full year (yyyy) and short year (yy) safely
@@ -45,7 +47,6 @@ def generate_password_candidates(full_name: str, phone: str, dob: str, bank: str
             if year:
                 dob_variants.add(year)
 
-
     phone_suffixes = set()
     phone5 = ''
     if phone:
@@ -55,20 +56,6 @@ def generate_password_candidates(full_name: str, phone: str, dob: str, bank: str
         phone5 = phone[-5:]
         phone_suffixes.add(phone5)
 
-    bank_templates = {
-        'default': [
-            '{first4}{dob_ddmm}','{first4upper}{year}','{first4upper}{dob_ddmm}','{first}{dob}', '{first}{dob_short}', '{first}{last}', '{first}{phone4}',
-            '{last}{dob}', '{initials}{dob}', '{bank}{phone4}', '{bank}{dob_short}',
-        ],
-        'hdfc': ['{first}{dob}', '{first}{dob_short}', '{first}{phone4}'],
-        'state bank of india': ['{phone5}{dob_ddmmyy}'],
-        'icici': ['{first4}{dob_ddmm}', '{first}{dob}', '{initials}{phone4}', '{bank}{dob_short}'],
-        'bank of baroda': ['{first4}{dob_ddmm}'],
-    }
-
-    templates = bank_templates.get(bank, bank_templates['default'])
-
-    candidates = []
     dob_ddmmyy = ''
     if dob:
         if len(dob) == 8:
@@ -86,13 +73,47 @@ def generate_password_candidates(full_name: str, phone: str, dob: str, bank: str
         else:
             dob_ddmm = dob
 
+    return {
+        'first': first, 'first4': first4, 'first4upper': first4upper, 'last': last, 'initials': initials,
+        'dob': dob, 'dob_variants': sorted(dob_variants), 'year': year,
+        'dob_ddmmyy': dob_ddmmyy, 'dob_ddmm': dob_ddmm,
+        'phone': phone, 'phone_suffixes': sorted(phone_suffixes), 'phone5': phone5,
+    }
+
+
+@metrics.timed('candidate_generation')
+def candidates_from_features(features: Dict[str, Any], bank: str, max_candidates: int = 200) -> List[str]:
+    """Expand bank templates over precomputed `password_features` output."""
+    bank = (bank or "").strip().lower()
+    first, last, phone, dob = features['first'], features['last'], features['phone'], features['dob']
+    dob_variants = features['dob_variants']
+    phone_suffixes = features['phone_suffixes']
+
+    bank_templates = {
+        'default': [
+            '{first4}{dob_ddmm}','{first4upper}{year}','{first4upper}{dob_ddmm}','{first}{dob}', '{first}{dob_short}', '{first}{last}', '{first}{phone4}',
+            '{last}{dob}', '{initials}{dob}', '{bank}{phone4}', '{bank}{dob_short}',
+        ],
+        'hdfc': ['{first}{dob}', '{first}{dob_short}', '{first}{phone4}'],
+        'state bank of india': ['{phone5}{dob_ddmmyy}'],
+        'icici': ['{first4}{dob_ddmm}', '{first}{dob}', '{initials}{phone4}', '{bank}{dob_short}'],
+        'bank of baroda': ['{first4}{dob_ddmm}'],
+    }
+
+    # The Gmail service records full names ("hdfc bank"); the templates use the short ones
+    if bank not in bank_templates and bank.endswith(' bank') and bank[:-5] in bank_templates:
+        bank = bank[:-5]
+    templates = bank_templates.get(bank, bank_templates['default'])
+
+    candidates = []
     for t in templates:
-        for d in (sorted(dob_variants) if dob_variants else [""]):
-            for p in (sorted(phone_suffixes) if phone_suffixes else [""]):
+        for d in (dob_variants or [""]):
+            for p in (phone_suffixes or [""]):
                 s = t.format(
-                    first=first, first4=first4, first4upper=first4upper, last=last, initials=initials,
-                    dob=d, dob_short=d[-4:] if d else '', phone4=p[-4:] if p else '', bank=bank.upper(),
-                    year = year,dob_ddmmyy=dob_ddmmyy, dob_ddmm=dob_ddmm, phone5=phone5)
+                    first=first, first4=features['first4'], first4upper=features['first4upper'], last=last,
+                    initials=features['initials'], dob=d, dob_short=d[-4:] if d else '', phone4=p[-4:] if p else '',
+                    bank=bank.upper(), year=features['year'], dob_ddmmyy=features['dob_ddmmyy'],
+                    dob_ddmm=features['dob_ddmm'], phone5=features['phone5'])
                 if s:
                     candidates.append(s)
                 if s:
@@ -114,3 +135,11 @@ def generate_password_candidates(full_name: str, phone: str, dob: str, bank: str
             seen.add(c)
             out.append(c)
     return out[:max_candidates]
+
+
+def generate_password_candidates(full_name: str, phone: str, dob: str, bank: str, max_candidates: int = 200) -> List[str]:
+    """Generate likely password candidates from provided credentials.
+
+    See `bank_pdf.cli` README for supported template placeholders.
+    """
+    return candidates_from_features(password_features(full_name, phone, dob), bank, max_candidates)
@@ -0,0 +1,244 @@
+"""Incremental analysis: only periods that changed since the last run go to the LLM.
+
+Analysis state is kept per (user, account, month) in users.db:
+
+  - `analysis_periods`  one row per month with its transactions, their
+                        fingerprint and local aggregates: debit/credit
+                        totals, spend per merchant and per category
+  - `analysis_documents` fingerprints of the passed-through page text
+                        (`documents` of the payload) already analyzed
+  - `analysis_results`  the latest LLM analysis per user
+
+A run groups the deduplicated transactions (`statements.consolidate`, with
+merchants and categories set by `merchants.annotate_payload`) by
+account and month and compares them with the stored months. Only rows not
+analyzed before, and passed-through documents whose text was not, go to the
+LLM together with a compact summary of
+everything stored before (recent monthly totals, category totals, top
+merchants, recurring-payment candidates and the previous summary). The
+summary is capped, so the prompt stays about the size of one sync's new data
+however long the history grows. When nothing changed the stored analysis is
+returned without calling the LLM.
+"""
+import hashlib
+import json
+import sqlite3
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import metrics
+from .analysis import analyze_with_gemini, format_delta_prompt, parse_model_response
+from .merchants import normalize
+from .statements import transaction_key
+
+# Caps on the prior-state summary sent with every delta
+SUMMARY_MONTHS = 24
+SUMMARY_MERCHANTS = 25
+SUMMARY_RECURRING = 20
+
+_ROW_KEYS = ('date', 'description', 'amount', 'balance', 'direction', 'merchant', 'category')
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    conn.executescript('''
+    CREATE TABLE IF NOT EXISTS analysis_periods (
+        user_id TEXT NOT NULL,
+        account TEXT NOT NULL,
+        period TEXT NOT NULL,
+        fingerprint TEXT NOT NULL,
+        state_json TEXT NOT NULL,
+        updated_at TEXT DEFAULT (datetime('now')),
+        PRIMARY KEY (user_id, account, period)
+    );
+    CREATE TABLE IF NOT EXISTS analysis_documents (
+        user_id TEXT NOT NULL,
+        fingerprint TEXT NOT NULL,
+        path TEXT,
+        updated_at TEXT DEFAULT (datetime('now')),
+        PRIMARY KEY (user_id, fingerprint)
+    );
+    CREATE TABLE IF NOT EXISTS analysis_results (
+        user_id TEXT PRIMARY KEY,
+        result_json TEXT,
+        updated_at TEXT DEFAULT (datetime('now'))
+    );
+    ''')
+
+
+def group_periods(payload: Dict[str, Any]) -> Dict[Tuple[str, str], List[Dict[str, Any]]]:
+    """(account, yyyy-mm) -> transactions, from a `statements.consolidate` payload."""
+    groups: Dict[Tuple[str, str], List[Dict[str, Any]]] = defaultdict(list)
+    for acc in payload.get('accounts') or []:
+        for txn in acc['transactions']:
+            groups[(acc['account'] or '', txn['date'][:7])].append(txn)
+    return groups
+
+
+def fingerprint(txns: List[Dict[str, Any]]) -> str:
+    h = hashlib.sha1()
+    for key in sorted(repr(transaction_key(t)) for t in txns):
+        h.update(key.encode('utf-8'))
+    return h.hexdigest()
+
+
+def document_fingerprint(doc: Dict[str, Any]) -> str:
+    """Hash of a passed-through document's page text, ignoring whitespace differences."""
+    h = hashlib.sha1()
+    for page in doc.get('pages') or []:
+        h.update(' '.join((page.get('text') or '').split()).encode('utf-8'))
+        h.update(b'\f')
+    return h.hexdigest()
+
+
+def period_state(txns: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Local aggregates for one month: totals, spend per merchant and per category.
+
+    The month's rows are kept too, so a later run that sees only part of the
+    month (a statement starting mid-month) adds to them instead of replacing them.
+    """
+    state = {'transactions': len(txns), 'debit': 0.0, 'credit': 0.0, 'merchants': {}, 'categories': {},
+             'rows': [{k: t[k] for k in _ROW_KEYS if k in t} for t in txns]}
+    for txn in txns:
+        if txn['direction'] == 'credit':
+            state['credit'] += txn['amount']
+            continue
+        # Rows of unknown direction are counted as spend, as the LLM would read them
+        state['debit'] += txn['amount']
+        merchant = txn.get('merchant') or normalize(txn['description'])
+        count, total = state['merchants'].get(merchant, (0, 0.0))
+        state['merchants'][merchant] = (count + 1, round(total + txn['amount'], 2))
+        category = txn.get('category') or 'other'
+        state['categories'][category] = round(state['categories'].get(category, 0.0) + txn['amount'], 2)
+    state['debit'], state['credit'] = round(state['debit'], 2), round(state['credit'], 2)
+    return state
+
+
+def summarize_prior(rows: List[Tuple[str, str, Dict[str, Any]]], previous: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Compact, size-capped summary of stored periods for the delta prompt."""
+    categories: Dict[str, float] = defaultdict(float)
+    merchants: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0])
+    months_seen: Dict[str, set] = defaultdict(set)
+    for account, period, state in rows:
+        for category, total in state['categories'].items():
+            categories[category] += total
+        for merchant, (count, total) in state['merchants'].items():
+            merchants[merchant][0] += count
+            merchants[merchant][1] += total
+            months_seen[merchant].add(period)
+    recent = sorted(rows, key=lambda r: r[1], reverse=True)[:SUMMARY_MONTHS]
+    top = sorted(merchants.items(), key=lambda kv: kv[1][1], reverse=True)[:SUMMARY_MERCHANTS]
+    recurring = sorted((m for m in months_seen if len(months_seen[m]) >= 2),
+                       key=lambda m: (len(months_seen[m]), merchants[m][1]), reverse=True)[:SUMMARY_RECURRING]
+    return {
+        'periods_analyzed': len(rows),
+        'first_period': min((r[1] for r in rows), default=None),
+        'monthly_totals': [{'account': a, 'period': p, 'debit': s['debit'], 'credit': s['credit'],
+                            'transactions': s['transactions']} for a, p, s in sorted(recent, key=lambda r: (r[0], r[1]))],
+        'category_totals': {k: round(v, 2) for k, v in sorted(categories.items(), key=lambda kv: -kv[1])},
+        'top_merchants': [{'merchant': m, 'count': c, 'total': round(t, 2)} for m, (c, t) in top],
+        'recurring_candidates': [{'merchant': m, 'months': len(months_seen[m]),
+                                  'average_amount': round(merchants[m][1] / merchants[m][0], 2)} for m in recurring],
+        'previous_summary': (previous or {}).get('summary'),
+    }
+
+
+def _load(conn: sqlite3.Connection, user_id: str):
+    stored = {}
+    for account, period, fp, state_json in conn.execute(
+            'SELECT account, period, fingerprint, state_json FROM analysis_periods WHERE user_id = ?', (user_id,)):
+        stored[(account, period)] = (fp, json.loads(state_json))
+    documents = {fp for (fp,) in conn.execute('SELECT fingerprint FROM analysis_documents WHERE user_id = ?', (user_id,))}
+    row = conn.execute('SELECT result_json FROM analysis_results WHERE user_id = ?', (user_id,)).fetchone()
+    return stored, documents, json.loads(row[0]) if row and row[0] else None
+
+
+def _merge_rows(stored: List[Dict[str, Any]], current: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Rows of `current` not already in `stored`, counting repeats like `statements.consolidate`."""
+    have = Counter(transaction_key(t) for t in stored)
+    seen: Counter = Counter()
+    added = []
+    for txn in current:
+        key = transaction_key(txn)
+        seen[key] += 1
+        if seen[key] > have[key]:
+            added.append(txn)
+    return added
+
+
+def analyze_incremental(db_path: str, user_id: str, payload: Dict[str, Any], endpoint: str, api_key: str,
+                        full: bool = False) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Analyze the transactions of `payload` that were not analyzed before.
+
+    Returns (parsed LLM analysis, info) where info lists the `delta_periods`,
+    the number of `prior_periods` summarized, the `new_transactions` and
+    `new_documents` sent and whether the stored analysis was `reused`. `full` drops the stored state
+    and analyzes everything again. State is only written after a successful
+    LLM call.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        ensure_schema(conn)
+        if full:
+            conn.execute('DELETE FROM analysis_periods WHERE user_id = ?', (user_id,))
+            conn.execute('DELETE FROM analysis_documents WHERE user_id = ?', (user_id,))
+        stored, analyzed_documents, previous = _load(conn, user_id)
+        if full:
+            previous = None
+
+        # A month counts as changed only if this run has rows it has not seen:
+        # a run over just the newest statement leaves earlier rows in place
+        added: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        for key, txns in group_periods(payload).items():
+            fp, state = stored.get(key, (None, {}))
+            if fp == fingerprint(txns):
+                continue
+            new_rows = _merge_rows(state.get('rows') or [], txns)
+            if new_rows:
+                added[key] = new_rows
+        delta = sorted(added)
+        # Passed-through text is sent once too; the same text in a later run is already in the analysis
+        documents = {}
+        for doc in payload.get('documents') or []:
+            fp = document_fingerprint(doc)
+            if fp not in analyzed_documents:
+                documents.setdefault(fp, doc)
+        info = {'delta_periods': [f'{a or "?"}:{p}' for a, p in delta], 'prior_periods': len(stored),
+                'new_transactions': sum(len(v) for v in added.values()), 'new_documents': len(documents),
+                'reused': False}
+        if not delta and not documents and previous is not None:
+            info['reused'] = True
+            metrics.incr('analysis_reused')
+            return previous, info
+
+        prior = [(a, p, state) for (a, p), (_, state) in stored.items()]
+        delta_data = {
+            'statements': payload.get('statements'),
+            'periods': [{'account': a or None, 'period': p, 'new_transactions': added[(a, p)]} for a, p in delta],
+            'documents': list(documents.values()),
+        }
+        prompt = format_delta_prompt(summarize_prior(prior, previous) if prior or previous else None, delta_data)
+        parsed = parse_model_response(analyze_with_gemini(prompt, endpoint, api_key))
+
+        for account, period in delta:
+            rows = (stored.get((account, period), (None, {}))[1].get('rows') or []) + added[(account, period)]
+            rows.sort(key=lambda t: t['date'])
+            conn.execute(
+                'INSERT INTO analysis_periods (user_id, account, period, fingerprint, state_json) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(user_id, account, period) DO UPDATE SET fingerprint=excluded.fingerprint, '
+                "state_json=excluded.state_json, updated_at=datetime('now')",
+                (user_id, account, period, fingerprint(rows), json.dumps(period_state(rows)))
+            )
+        conn.executemany(
+            'INSERT OR IGNORE INTO analysis_documents (user_id, fingerprint, path) VALUES (?, ?, ?)',
+            [(user_id, fp, doc.get('path')) for fp, doc in documents.items()]
+        )
+        conn.execute(
+            'INSERT INTO analysis_results (user_id, result_json) VALUES (?, ?) '
+            "ON CONFLICT(user_id) DO UPDATE SET result_json=excluded.result_json, updated_at=datetime('now')",
+            (user_id, json.dumps(parsed, ensure_ascii=False))
+        )
+        conn.commit()
+        metrics.incr('analysis_delta_periods', len(delta))
+        return parsed, info
+    finally:
+        conn.close()
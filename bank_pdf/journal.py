@@ -0,0 +1,182 @@
+"""Run journal: durable per-document progress so an interrupted CLI run can resume.
+
+Each run gets a directory under `runs/` holding `journal.jsonl` and the stage
+outputs it points to:
+
+    {"stage": "run_start", "args": {...}}
+    {"stage": "unlocked", "path": ..., "encrypted": true}
+    {"stage": "extracted", "path": ..., "size": ..., "mtime_ns": ..., "result_file": "3f2a....json"}
+    {"stage": "analysis", "result_file": "analysis.json"}
+    {"stage": "run_done"}
+
+Every line is flushed and fsync'd before the run moves on, and result files are
+written to a temp name, fsync'd and renamed, so a crash leaves at most one torn
+last line (ignored on load). `python main.py ... --resume` reuses the newest
+unfinished journal: options not given again are taken from its `run_start`
+record, and extracted documents are loaded from disk instead of being unlocked
+and parsed again. Passwords are not journaled (a found one is stored in
+`user_banks`). The directory holds decrypted statement text, so it is
+created 0700 with 0600 files, and removed when the run finishes unless
+`--keep-journal` is given.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, Optional
+
+from .users import REPO_ROOT
+
+RUNS_DIR = os.environ.get('BANK_PDF_RUNS_DIR', os.path.join(REPO_ROOT, 'runs'))
+JOURNAL_NAME = 'journal.jsonl'
+
+
+def _fsync_dir(path: str) -> None:
+    # Makes a rename durable on POSIX; directories cannot be opened on Windows
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _open_private(path: str, flags: int):
+    # Owner-only, also when the file already exists
+    fd = os.open(path, flags | os.O_CREAT, 0o600)
+    try:
+        os.chmod(path, 0o600)
+    except OSError:
+        pass
+    return os.fdopen(fd, 'a' if flags & os.O_APPEND else 'w', encoding='utf-8')
+
+
+def write_json_atomic(path: str, data: Any) -> None:
+    tmp = path + '.tmp'
+    with _open_private(tmp, os.O_WRONLY | os.O_TRUNC) as f:
+        json.dump(data, f, ensure_ascii=False, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(os.path.dirname(path))
+
+
+def latest_unfinished(runs_dir: str = RUNS_DIR) -> Optional[str]:
+    """Newest run directory whose journal has no run_done record, or None."""
+    if not os.path.isdir(runs_dir):
+        return None
+    for name in sorted(os.listdir(runs_dir), reverse=True):
+        directory = os.path.join(runs_dir, name)
+        path = os.path.join(directory, JOURNAL_NAME)
+        if os.path.isfile(path) and not Journal(directory, readonly=True).finished:
+            return directory
+    return None
+
+
+class Journal:
+    def __init__(self, directory: str, readonly: bool = False):
+        self.dir = directory
+        self.path = os.path.join(directory, JOURNAL_NAME)
+        self.documents: Dict[str, Dict[str, Any]] = {}  # abs path -> merged stage records
+        self.analysis_file: Optional[str] = None
+        self.args: Optional[Dict[str, Any]] = None  # the run_start arguments
+        self.finished = False
+        self._fp = None
+        self._load()
+        if not readonly:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            os.chmod(directory, 0o700)
+            self._fp = _open_private(self.path, os.O_WRONLY | os.O_APPEND)
+
+    @classmethod
+    def create(cls, runs_dir: str = RUNS_DIR) -> 'Journal':
+        name = time.strftime('%Y%m%d-%H%M%S') + f'-{os.getpid()}'
+        return cls(os.path.join(runs_dir, name))
+
+    def _load(self) -> None:
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue  # torn write from a crash
+                stage = rec.get('stage')
+                if stage == 'run_start':
+                    self.args = rec.get('args')
+                elif stage in ('unlocked', 'extracted'):
+                    self.documents.setdefault(rec['path'], {}).update(rec)
+                elif stage == 'analysis':
+                    self.analysis_file = rec.get('result_file')
+                elif stage == 'run_done':
+                    self.finished = True
+
+    def append(self, stage: str, **fields) -> None:
+        rec = {'stage': stage, 'at': time.strftime('%Y-%m-%dT%H:%M:%S'), **fields}
+        self._fp.write(json.dumps(rec, ensure_ascii=False, default=str) + '\n')
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        if stage in ('unlocked', 'extracted'):
+            self.documents.setdefault(rec['path'], {}).update(rec)
+
+    # -- documents -----------------------------------------------------------
+
+    def record_unlocked(self, pdf_path: str, encrypted: bool) -> None:
+        self.append('unlocked', path=os.path.abspath(pdf_path), encrypted=encrypted)
+
+    def save_result(self, pdf_path: str, result: Dict[str, Any]) -> None:
+        path = os.path.abspath(pdf_path)
+        name = hashlib.sha1(path.encode('utf-8')).hexdigest()[:16] + '.json'
+        write_json_atomic(os.path.join(self.dir, name), result)
+        st = os.stat(path)
+        self.append('extracted', path=path, size=st.st_size, mtime_ns=st.st_mtime_ns, result_file=name)
+
+    def load_result(self, pdf_path: str) -> Optional[Dict[str, Any]]:
+        """The recorded extraction result, if the PDF has not changed since."""
+        path = os.path.abspath(pdf_path)
+        rec = self.documents.get(path, {})
+        if not rec.get('result_file'):
+            return None
+        try:
+            st = os.stat(path)
+            if (st.st_size, st.st_mtime_ns) != (rec.get('size'), rec.get('mtime_ns')):
+                return None
+            with open(os.path.join(self.dir, rec['result_file']), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # -- analysis ------------------------------------------------------------
+
+    def save_analysis(self, analysis: Any) -> None:
+        write_json_atomic(os.path.join(self.dir, 'analysis.json'), analysis)
+        self.analysis_file = 'analysis.json'
+        self.append('analysis', result_file=self.analysis_file)
+
+    def load_analysis(self) -> Optional[Any]:
+        if not self.analysis_file:
+            return None
+        try:
+            with open(os.path.join(self.dir, self.analysis_file), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def close(self) -> None:
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def finish(self, keep: bool = False) -> None:
+        """Mark the run complete; remove its directory unless `keep`."""
+        self.append('run_done')
+        self.finished = True
+        self.close()
+        if not keep:
+            shutil.rmtree(self.dir, ignore_errors=True)
@@ -0,0 +1,144 @@
+"""Memory-budgeted processing of very large statements.
+
+Without a budget a document is processed in one go: PyPDF2 reads the whole
+file into memory and keeps every object it parses, the decrypted copy is
+written out in full, and OCR renders eight pages at 200 DPI per call. A
+500-page annual statement can take a worker past its container limit.
+
+With a budget (`BANK_PDF_MEMORY_LIMIT_MB`, or `--memory-limit` on the CLI,
+`batch` and `watch`) `process_pdf` instead:
+
+  - does not write a decrypted copy; the password is handed to the
+    extraction backend and to the OCR renderer
+  - reads the PDF through a memory map, so its bytes are page cache rather
+    than process memory (and are dropped from the mapping between chunks)
+  - extracts text `BANK_PDF_CHUNK_PAGES` pages at a time (default 25),
+    dropping the parser's object cache between chunks
+  - checks resident anonymous memory after every chunk and OCR batch. Above 80%
+    of the limit it collects garbage, returns freed memory to the OS and
+    halves the chunk and OCR batch sizes; still above the limit, it raises
+    `MemoryLimitExceeded` and the document fails with a partial result
+    instead of the worker being OOM-killed
+
+The budget belongs to the call: callers build one per document with
+`budget_for` and pass it to `process_pdf`, so nothing about it outlives the
+document (the warm CLI worker runs jobs with and without a limit back to
+back). In the Gmail service, which extracts documents inline next to its own
+state, the budget is `relative`: only memory added since the document started
+counts. Documents extracted concurrently in that process still share one
+heap, so there the budget is approximate.
+
+The `batch` and `watch` pool workers, which exist only to extract documents,
+also get a data-segment rlimit of twice the budget as a backstop (pass
+`apply_ceiling` as the pool initializer), so a runaway allocation inside a
+chunk raises MemoryError rather than taking down the container.
+"""
+import gc
+import os
+from typing import Optional
+
+from . import metrics
+
+try:
+    import resource
+except Exception:  # Windows
+    resource = None
+
+MEMORY_LIMIT_MB = int(os.environ.get('BANK_PDF_MEMORY_LIMIT_MB', '0') or 0)
+CHUNK_PAGES = max(1, int(os.environ.get('BANK_PDF_CHUNK_PAGES', '25')))
+# Share of the limit at which caches are dropped and chunks shrink
+SOFT_RATIO = 0.8
+# The data-segment rlimit, as a multiple of the budget
+HARD_FACTOR = 2
+
+
+class MemoryLimitExceeded(MemoryError):
+    pass
+
+
+def rss_bytes() -> int:
+    """Resident memory of this process that the kernel cannot reclaim, or 0 if unknown.
+
+    On Linux this is RssAnon: pages of a memory-mapped PDF are page cache the
+    kernel drops under pressure, so they do not count against the budget.
+    """
+    try:
+        with open('/proc/self/status', 'rb') as f:
+            for line in f:
+                if line.startswith(b'RssAnon:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception:
+        return 0
+
+
+def _trim() -> None:
+    """Hand memory freed by the garbage collector back to the OS (glibc only)."""
+    try:
+        import ctypes
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except Exception:
+        pass
+
+
+class Budget:
+    """Memory budget for one document; chunk sizes shrink as memory gets tight."""
+
+    def __init__(self, limit_mb: int = MEMORY_LIMIT_MB, chunk_pages: int = CHUNK_PAGES, ocr_batch: int = 8,
+                 relative: bool = False):
+        self.limit = limit_mb * 1024 * 1024
+        self.chunk_pages = max(1, chunk_pages)
+        self.ocr_batch = max(1, ocr_batch)
+        # A relative budget does not charge the document for what the process held before it
+        self.base = rss_bytes() if relative else 0
+        self.peak = self.used()
+
+    def used(self) -> int:
+        return max(0, rss_bytes() - self.base)
+
+    def check(self, stage: str) -> int:
+        """Measure RSS after a chunk of `stage`; relieve pressure or raise. Returns the RSS counted."""
+        rss = self.used()
+        self.peak = max(self.peak, rss)
+        if rss <= self.limit * SOFT_RATIO:
+            return rss
+        gc.collect()
+        _trim()
+        self.chunk_pages = max(1, self.chunk_pages // 2)
+        self.ocr_batch = max(1, self.ocr_batch // 2)
+        metrics.incr('memory_pressure', stage=stage)
+        rss = self.used()
+        if rss > self.limit:
+            metrics.incr('memory_limit_exceeded', stage=stage)
+            raise MemoryLimitExceeded(f'RSS {rss // 2 ** 20} MB is over the {self.limit // 2 ** 20} MB limit during {stage}')
+        return rss
+
+
+def apply_ceiling(limit_mb: int) -> None:
+    """Cap this process's data segment at HARD_FACTOR x the budget.
+
+    Only for processes that do nothing but extract documents under this budget:
+    the rlimit is never lifted again.
+    """
+    if not limit_mb or limit_mb <= 0 or resource is None or not hasattr(resource, 'RLIMIT_DATA'):
+        return
+    cap = limit_mb * HARD_FACTOR * 1024 * 1024
+    try:
+        soft, hard = resource.getrlimit(resource.RLIMIT_DATA)
+        if hard != resource.RLIM_INFINITY:
+            cap = min(cap, hard)
+        if soft == resource.RLIM_INFINITY or cap < soft:
+            resource.setrlimit(resource.RLIMIT_DATA, (cap, hard))
+    except (OSError, ValueError):
+        pass
+
+
+def budget_for(limit_mb: Optional[int], relative: bool = False) -> Optional[Budget]:
+    """A fresh Budget for one document, or None without a limit (None or 0)."""
+    if not limit_mb or limit_mb <= 0:
+        return None
+    return Budget(limit_mb, CHUNK_PAGES, relative=relative)
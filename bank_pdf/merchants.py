@@ -0,0 +1,256 @@
+"""Local merchant and category attribution for transaction narrations.
+
+    UPI/SWIGGY/418399561389/Payment      -> SWIGGY          (Swiggy, food)
+    NEFT-SALARY ACME CORP N123456789     -> SALARY ACME CORP (Salary, income)
+    POS 4521XXXX1234 DMART AVENUE        -> DMART AVENUE    (DMart, groceries)
+
+`normalize` strips payment-rail prefixes (UPI, NEFT, IMPS, POS, ...), reference
+numbers and filler words, leaving a key that is the same for every payment to
+one merchant. Keys are matched against a rule index compiled into a single
+regular expression (built-in rules, preceded by any from `merchant_rules.json`
+or BANK_PDF_MERCHANT_RULES). Keys no rule knows can be sent to the LLM in
+batches; its answers are stored in the `merchant_cache` table of users.db, so
+a narration the LLM has answered is never sent again (ones it skips are asked
+about on the next run). A `Classifier` memoizes
+every narration it has seen, so repeat lookups are a dict hit.
+"""
+import json
+import os
+import re
+import sqlite3
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from . import metrics
+from .users import REPO_ROOT
+
+RULES_PATH = os.environ.get('BANK_PDF_MERCHANT_RULES', os.path.join(REPO_ROOT, 'merchant_rules.json'))
+LLM_BATCH = 100
+_MEMO_LIMIT = 200000
+
+CATEGORIES = ('food', 'groceries', 'shopping', 'transport', 'fuel', 'travel', 'entertainment', 'subscriptions',
+              'utilities', 'rent', 'income', 'transfer', 'cash', 'loan', 'insurance', 'investment', 'credit card',
+              'fees', 'health', 'education', 'other')
+
+# (pattern over the normalized key, merchant, category); first match wins
+RULES: List[Tuple[str, str, str]] = [
+    (r'SALARY|SAL CREDIT|PAYROLL', 'Salary', 'income'),
+    (r'\bINT(?:EREST)?\.? ?(?:PD|PAID|CREDIT)\b|\bINTEREST\b', 'Interest', 'income'),
+    (r'\bATM\b|CASH WDL|CASH WITHDRAWAL', 'Cash withdrawal', 'cash'),
+    (r'\bRENT\b', 'Rent', 'rent'),
+    (r'SWIGGY', 'Swiggy', 'food'),
+    (r'ZOMATO', 'Zomato', 'food'),
+    (r'DOMINO', "Domino's", 'food'),
+    (r'MCDONALD', "McDonald's", 'food'),
+    (r'\bKFC\b', 'KFC', 'food'),
+    (r'STARBUCKS', 'Starbucks', 'food'),
+    (r'BIG ?BASKET', 'BigBasket', 'groceries'),
+    (r'BLINKIT|GROFERS', 'Blinkit', 'groceries'),
+    (r'ZEPTO', 'Zepto', 'groceries'),
+    (r'\bD ?MART\b|AVENUE SUPERMART', 'DMart', 'groceries'),
+    (r'JIOMART|JIO MART', 'JioMart', 'groceries'),
+    (r'AMAZON ?PRIME|PRIME ?VIDEO', 'Amazon Prime', 'subscriptions'),
+    (r'AMAZON|AMZN', 'Amazon', 'shopping'),
+    (r'FLIPKART', 'Flipkart', 'shopping'),
+    (r'MYNTRA', 'Myntra', 'shopping'),
+    (r'\bAJIO\b', 'Ajio', 'shopping'),
+    (r'NYKAA', 'Nykaa', 'shopping'),
+    (r'\bUBER\b', 'Uber', 'transport'),
+    (r'\bOLA ?(?:CABS?|MONEY)?\b|ANI TECHNOLOGIES', 'Ola', 'transport'),
+    (r'RAPIDO', 'Rapido', 'transport'),
+    (r'FASTAG', 'FASTag', 'transport'),
+    (r'IRCTC', 'IRCTC', 'travel'),
+    (r'INDIGO|AIR INDIA|VISTARA|SPICEJET|AKASA', 'Airline', 'travel'),
+    (r'MAKEMYTRIP|GOIBIBO|CLEARTRIP|YATRA', 'Travel booking', 'travel'),
+    (r'\bHPCL\b|\bBPCL\b|\bIOCL?\b|INDIAN OIL|PETROL|FUEL', 'Fuel', 'fuel'),
+    (r'NETFLIX', 'Netflix', 'subscriptions'),
+    (r'SPOTIFY', 'Spotify', 'subscriptions'),
+    (r'HOTSTAR|DISNEY', 'Disney+ Hotstar', 'subscriptions'),
+    (r'YOUTUBE|GOOGLE ?PLAY', 'Google', 'subscriptions'),
+    (r'BOOKMYSHOW|PVR|INOX', 'Movies', 'entertainment'),
+    (r'AIRTEL', 'Airtel', 'utilities'),
+    (r'\bJIO\b|RELIANCE JIO', 'Jio', 'utilities'),
+    (r'VODAFONE|\bVI\b', 'Vi', 'utilities'),
+    (r'ELECTRICITY|BESCOM|TATA POWER|ADANI ELEC|MSEDCL|BSES', 'Electricity', 'utilities'),
+    (r'\bGAS\b|INDANE|BHARATGAS|\bHP GAS\b', 'Gas', 'utilities'),
+    (r'\bEMI\b|\bLOAN\b', 'Loan EMI', 'loan'),
+    (r'\bLIC\b|INSURANCE|POLICY', 'Insurance', 'insurance'),
+    (r'ZERODHA|GROWW|UPSTOX|MUTUAL FUND|\bSIP\b|\bMF\b', 'Investments', 'investment'),
+    # `normalize` drops PAYMENT, so "CC PAYMENT 1234" is keyed as just CC
+    (r'CREDIT ?CARD|^CC$|\bCC ?(?:BILL|PMT)\b|\bCARD ?(?:BILL|DUES)\b', 'Credit card payment', 'credit card'),
+    (r'PHARM|APOLLO|HOSPITAL|CLINIC|\bMEDI', 'Health', 'health'),
+    (r'SCHOOL|COLLEGE|UNIVERSITY|TUITION|\bFEES?\b', 'Education', 'education'),
+    (r'CHARGES?\b|\bGST\b|\bCHRG', 'Bank charges', 'fees'),
+    (r'SELF TRANSFER|\bSELF\b|OWN ACCOUNT', 'Self transfer', 'transfer'),
+]
+
+# Payment rails and filler words around the merchant in a narration
+_FILLER = {'UPI', 'NEFT', 'IMPS', 'RTGS', 'POS', 'ACH', 'NACH', 'ECS', 'BIL', 'BILLPAY', 'ONL', 'INB', 'MB', 'IB',
+           'CMS', 'TRF', 'TFR', 'P2M', 'P2A', 'NFS', 'VPS', 'VIN', 'MMT', 'TO', 'FROM', 'BY', 'PAYMENT', 'PAY',
+           'DR', 'CR', 'REF', 'TXN', 'NO', 'UTR', 'OTHERS', 'NA'}
+_SEPARATORS = re.compile(r'[/|:*_,#-]+')
+# Masked card / account numbers: 4521XXXX1234, XXXXXX1234
+_MASKED = re.compile(r'^\d*X{2,}\d+$')
+
+
+def _is_reference(word: str) -> bool:
+    # Reference numbers and UTRs are mostly digits; merchant names rarely are (7ELEVEN is not)
+    digits = sum(ch.isdigit() for ch in word)
+    return digits == len(word) or (len(word) >= 5 and digits * 2 >= len(word)) or bool(_MASKED.match(word))
+
+
+def normalize(description: str) -> str:
+    """The merchant key of a narration: rails, references and filler removed, upper case."""
+    words = []
+    for part in _SEPARATORS.split(description.upper()):
+        for word in part.split():
+            if '@' in word:
+                # UPI handle: swiggy@axisbank -> SWIGGY
+                word = word.split('@', 1)[0]
+            word = word.strip('.()[]')
+            if word and word not in _FILLER and not _is_reference(word):
+                words.append(word)
+    return ' '.join(words) or ' '.join(description.upper().split())
+
+
+def load_rules(path: str = RULES_PATH) -> List[Tuple[str, str, str]]:
+    """Custom rules from `path` (a JSON list of {pattern, merchant, category}) before the built-in ones."""
+    custom = []
+    if os.path.isfile(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            custom = [(r['pattern'], r['merchant'], r['category']) for r in json.load(f)]
+    return custom + RULES
+
+
+def compile_rules(rules: List[Tuple[str, str, str]]):
+    # One alternation with a named group per rule, each a lookahead over the whole key and
+    # anchored at its start: alternatives are tried in rule order, so the match is the first
+    # rule that matches anywhere in the key rather than the rule matching earliest in it
+    if not rules:
+        return re.compile(r'(?!)')
+    return re.compile('|'.join(f'(?=.*?(?P<r{i}>{pattern}))' for i, (pattern, _, _) in enumerate(rules)))
+
+
+class Classifier:
+    """Merchant/category lookup with a rule index, a memo and the persistent LLM cache.
+
+    `db_path` holds the `merchant_cache` table; without it LLM answers are
+    kept for the life of the object only.
+    """
+
+    def __init__(self, db_path: Optional[str] = None, rules: Optional[List[Tuple[str, str, str]]] = None):
+        self.db_path = db_path
+        self.rules = rules if rules is not None else load_rules()
+        self._index = compile_rules(self.rules)
+        self._memo: Dict[str, Tuple[str, str]] = {}
+        self._cache: Dict[str, Tuple[str, str]] = {}   # key -> (merchant, category) learned from the LLM
+        self.unknown: Dict[str, str] = {}              # key -> one narration with that key
+        if db_path and os.path.isfile(db_path):
+            conn = sqlite3.connect(db_path)
+            try:
+                ensure_schema(conn)
+                for key, merchant, category in conn.execute('SELECT narration_key, merchant, category FROM merchant_cache'):
+                    self._cache[key] = (merchant, category)
+            finally:
+                conn.close()
+
+    def classify(self, description: str) -> Tuple[str, str]:
+        """(merchant, category) for a narration; 'other' when unknown so far."""
+        hit = self._memo.get(description)
+        if hit is not None:
+            return hit
+        key = normalize(description)
+        m = self._index.match(key)
+        if m:
+            _, merchant, category = self.rules[int(m.lastgroup[1:])]
+            out = (merchant, category)
+        elif key in self._cache:
+            out = self._cache[key]
+        else:
+            self.unknown.setdefault(key, description)
+            out = (key.title(), 'other')
+        if len(self._memo) >= _MEMO_LIMIT:
+            self._memo.clear()
+        self._memo[description] = out
+        return out
+
+    def resolve_unknown(self, llm: Callable[[str], Dict[str, Any]], batch_size: int = LLM_BATCH) -> int:
+        """Ask the LLM about keys no rule matched, `batch_size` per call; returns how many were learned."""
+        from .analysis import format_merchant_prompt
+
+        keys = list(self.unknown)
+        learned = {}
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:i + batch_size]
+            try:
+                answer = llm(format_merchant_prompt(batch, CATEGORIES))
+            except Exception:
+                metrics.incr('merchant_llm_errors')
+                continue
+            metrics.incr('merchant_llm_calls')
+            for key in batch:
+                entry = answer.get(key) if isinstance(answer, dict) else None
+                # Keys the answer leaves out stay unknown and are asked about again next time
+                if isinstance(entry, dict) and entry.get('merchant'):
+                    category = str(entry.get('category') or 'other').lower()
+                    learned[key] = (str(entry['merchant']), category if category in CATEGORIES else 'other')
+        for key in learned:
+            self.unknown.pop(key, None)
+        self._cache.update(learned)
+        self._memo.clear()
+        if learned and self.db_path:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                ensure_schema(conn)
+                conn.executemany(
+                    'INSERT INTO merchant_cache (narration_key, merchant, category) VALUES (?, ?, ?) '
+                    'ON CONFLICT(narration_key) DO UPDATE SET merchant=excluded.merchant, category=excluded.category, '
+                    "updated_at=datetime('now')",
+                    [(k, m, c) for k, (m, c) in learned.items()]
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        return len(learned)
+
+    def annotate(self, transactions: Iterable[Dict[str, Any]], llm: Optional[Callable[[str], Dict[str, Any]]] = None) -> int:
+        """Set `merchant` and `category` on every transaction, asking `llm` about unknown narrations first.
+
+        Returns how many narrations were sent to the LLM.
+        """
+        transactions = list(transactions)
+        for txn in transactions:
+            self.classify(txn['description'])
+        sent = len(self.unknown) if llm is not None else 0
+        if sent:
+            self.resolve_unknown(llm)
+        for txn in transactions:
+            txn['merchant'], txn['category'] = self.classify(txn['description'])
+        return sent
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS merchant_cache (
+        narration_key TEXT PRIMARY KEY,
+        merchant TEXT NOT NULL,
+        category TEXT NOT NULL,
+        updated_at TEXT DEFAULT (datetime('now'))
+    )
+    ''')
+
+
+def llm_client(endpoint: str, api_key: str) -> Callable[[str], Dict[str, Any]]:
+    """A prompt -> parsed JSON callable for `Classifier.resolve_unknown`."""
+    from .analysis import analyze_with_gemini, parse_model_response
+    return lambda prompt: parse_model_response(analyze_with_gemini(prompt, endpoint, api_key))
+
+
+def annotate_payload(payload: Dict[str, Any], db_path: Optional[str] = None,
+                     llm: Optional[Callable[[str], Dict[str, Any]]] = None) -> Dict[str, int]:
+    """Classify the transactions of a `statements.consolidate` payload in place.
+
+    Returns {'transactions': classified, 'llm_narrations': sent to the LLM}.
+    """
+    txns = [t for acc in payload.get('accounts') or [] for t in acc['transactions']]
+    sent = Classifier(db_path).annotate(txns, llm)
+    return {'transactions': len(txns), 'llm_narrations': sent}
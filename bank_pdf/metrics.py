@@ -0,0 +1,194 @@
+"""In-process timers and counters for the pipeline stages.
+
+Usage:
+    from . import metrics
+
+    with metrics.timer('unlock'):
+        ...
+    metrics.incr('unlock_attempts', len(tried))
+
+The registry is process-wide and thread-safe. It can be dumped as a JSON run
+report (`write_report`) or rendered in the Prometheus text format
+(`render_prometheus`) for a `/metrics` endpoint. Worker processes hand their
+numbers to the parent with `snapshot()` / `merge()`.
+"""
+import io
+import json
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Histogram bucket upper bounds in seconds (Prometheus `le` labels)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+PREFIX = 'bank_pdf_'
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Tuple], float] = {}
+_timers: Dict[Tuple[str, Tuple], List[Any]] = {}  # key -> [count, total, max, bucket_counts]
+_started_at = time.time()
+
+
+def _key(name: str, labels: Dict[str, Any]) -> Tuple[str, Tuple]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def incr(name: str, value: float = 1, **labels) -> None:
+    """Add `value` to the counter `name` with the given labels."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    """Record one duration for the timer `name`."""
+    key = _key(name, labels)
+    with _lock:
+        t = _timers.get(key)
+        if t is None:
+            t = _timers[key] = [0, 0.0, 0.0, [0] * len(BUCKETS)]
+        t[0] += 1
+        t[1] += seconds
+        t[2] = max(t[2], seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                t[3][i] += 1
+                break
+
+
+@contextmanager
+def timer(name: str, **labels) -> Iterator[None]:
+    """Time the enclosed block as one observation of `name`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timed(name: str, **labels):
+    """Decorator form of `timer`."""
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(name, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def reset() -> None:
+    global _started_at
+    with _lock:
+        _counters.clear()
+        _timers.clear()
+        _started_at = time.time()
+
+
+def snapshot() -> Dict[str, Any]:
+    """Picklable copy of the registry, for sending from a worker to its parent."""
+    with _lock:
+        return {
+            'counters': [[n, list(l), v] for (n, l), v in _counters.items()],
+            'timers': [[n, list(l), t[0], t[1], t[2], list(t[3])] for (n, l), t in _timers.items()],
+        }
+
+
+def merge(snap: Dict[str, Any]) -> None:
+    """Fold a `snapshot()` from another process into this registry."""
+    with _lock:
+        for name, labels, value in snap.get('counters', []):
+            key = (name, tuple(tuple(x) for x in labels))
+            _counters[key] = _counters.get(key, 0) + value
+        for name, labels, count, total, mx, buckets in snap.get('timers', []):
+            key = (name, tuple(tuple(x) for x in labels))
+            t = _timers.get(key)
+            if t is None:
+                t = _timers[key] = [0, 0.0, 0.0, [0] * len(BUCKETS)]
+            t[0] += count
+            t[1] += total
+            t[2] = max(t[2], mx)
+            t[3] = [a + b for a, b in zip(t[3], buckets)]
+
+
+def report() -> Dict[str, Any]:
+    """JSON-serializable summary of everything recorded so far."""
+    with _lock:
+        counters = [{'name': n, 'labels': dict(l), 'value': v} for (n, l), v in sorted(_counters.items())]
+        timers = [{
+            'name': n, 'labels': dict(l), 'count': t[0], 'total_s': round(t[1], 6),
+            'mean_s': round(t[1] / t[0], 6) if t[0] else 0.0, 'max_s': round(t[2], 6),
+        } for (n, l), t in sorted(_timers.items())]
+    return {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(_started_at)),
+        'elapsed_s': round(time.time() - _started_at, 3),
+        'counters': counters,
+        'timers': timers,
+    }
+
+
+def write_report(path: str, extra: Optional[Dict[str, Any]] = None) -> None:
+    data = report()
+    if extra:
+        data.update(extra)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+
+
+def _labels_str(labels: Tuple, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ''
+    escaped = ['%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in items]
+    return '{' + ','.join(escaped) + '}'
+
+
+def render_prometheus() -> str:
+    """Render counters and timers in the Prometheus text exposition format."""
+    lines: List[str] = []
+    with _lock:
+        counters = sorted(_counters.items())
+        timers = sorted((k, [t[0], t[1], t[2], list(t[3])]) for k, t in _timers.items())
+
+    seen = set()
+    for (name, labels), value in counters:
+        metric = PREFIX + name + '_total'
+        if metric not in seen:
+            lines.append(f'# TYPE {metric} counter')
+            seen.add(metric)
+        lines.append(f'{metric}{_labels_str(labels)} {value}')
+
+    for (name, labels), (count, total, _, buckets) in timers:
+        metric = PREFIX + name + '_seconds'
+        if metric not in seen:
+            lines.append(f'# TYPE {metric} histogram')
+            seen.add(metric)
+        cumulative = 0
+        for bound, n in zip(BUCKETS, buckets):
+            cumulative += n
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{metric}_bucket{_labels_str(labels, ("le", le))} {cumulative}')
+        lines.append(f'{metric}_sum{_labels_str(labels)} {total}')
+        lines.append(f'{metric}_count{_labels_str(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def profiled(path: str, top: int = 20) -> Iterator[None]:
+    """Run the enclosed block under cProfile, dump stats to `path` and print the top entries."""
+    # Imported here: pstats is slow to import and profiling is rare
+    import cProfile
+    import pstats
+
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+        prof.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(prof, stream=out).sort_stats('cumulative').print_stats(top)
+        print(out.getvalue())
+        print('Profile written to', path)
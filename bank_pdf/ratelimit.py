@@ -0,0 +1,362 @@
+"""Shared rate limits for Gmail and LLM calls across processes and servers.
+
+Every server instance, CLI run and batch worker draws from the same token
+buckets in Redis, so together they stay at the quota instead of each one
+finding it with errors:
+
+  - Gmail: a bucket per user (`BANK_PDF_GMAIL_USER_UNITS`, default 250 quota
+    units per second) and one for the project (`BANK_PDF_GMAIL_UNITS`,
+    default 20000/s). A call takes its quota-unit cost (`GMAIL_COSTS`) from both.
+  - LLM: one bucket for the project (`BANK_PDF_LLM_RPM`, default 60 requests
+    per minute).
+
+Each bucket refills at its rate and holds at most one second's worth
+(minimum one call). A token is taken atomically by a Lua script that reads
+the Redis clock, so hosts with skewed clocks still agree.
+
+Throttling (HTTP 429, or Gmail's 403 rate-limit reasons) adapts the limits:
+
+  - the shared rate factor is halved (at most once per second, however many
+    workers saw the error; floor 5%) and recovers additively, from 50% back
+    to 100% in 25 seconds, so all workers slow down together
+  - this process's window of concurrent calls is halved and grows back by one
+    call per window of successful calls
+  - the call is retried after its Retry-After, or an exponential backoff with
+    jitter, up to `retries` times
+
+Redis is `BANK_PDF_REDIS_URL` (default redis://localhost:6379/0), or the
+client handed to `use_redis`. When it is unreachable or the `redis` package
+is missing, the same buckets are kept in process memory. The limits then hold
+for this process only, and Redis is tried again after 30 seconds.
+"""
+import math
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from . import metrics
+
+try:
+    import redis
+except Exception:
+    redis = None
+
+REDIS_URL = os.environ.get('BANK_PDF_REDIS_URL', 'redis://localhost:6379/0')
+GMAIL_USER_UNITS = float(os.environ.get('BANK_PDF_GMAIL_USER_UNITS', '250'))
+GMAIL_UNITS = float(os.environ.get('BANK_PDF_GMAIL_UNITS', '20000'))
+LLM_RPM = float(os.environ.get('BANK_PDF_LLM_RPM', '60'))
+
+# Gmail API quota units per method
+GMAIL_COSTS = {
+    'messages.list': 5,
+    'messages.get': 5,
+    'messages.attachments.get': 5,
+    'history.list': 2,
+    'labels.list': 1,
+}
+
+MIN_FACTOR = 0.05
+DECREASE = 0.5
+RECOVERY_PER_S = 0.02
+CUT_COOLDOWN_MS = 1000
+REDIS_RETRY_S = 30
+MAX_BACKOFF_S = 30.0
+
+# KEYS: factor key, then one bucket key per scope
+# ARGV: cost, then (rate per second, burst) per bucket, then factor recovery per second
+# Returns 0 when the cost was taken, else milliseconds until it could be
+_TAKE = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local f = redis.call('HMGET', KEYS[1], 'factor', 'at')
+local factor = 1
+if f[1] then
+  factor = math.min(1, tonumber(f[1]) + tonumber(ARGV[#ARGV]) * (now - tonumber(f[2])) / 1000)
+end
+local cost = tonumber(ARGV[1])
+local wait = 0
+local tokens = {}
+for i = 2, #KEYS do
+  local rate = tonumber(ARGV[2 * i - 2]) * factor
+  local burst = math.max(cost, tonumber(ARGV[2 * i - 1]) * factor)
+  local b = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+  local have = tonumber(b[1]) or burst
+  local ts = tonumber(b[2]) or now
+  have = math.min(burst, have + math.max(0, now - ts) * rate / 1000)
+  tokens[i] = have
+  if have < cost then
+    wait = math.max(wait, math.ceil((cost - have) * 1000 / rate))
+  end
+end
+if wait > 0 then
+  return wait
+end
+for i = 2, #KEYS do
+  local rate = tonumber(ARGV[2 * i - 2]) * factor
+  local burst = math.max(cost, tonumber(ARGV[2 * i - 1]) * factor)
+  redis.call('HSET', KEYS[i], 'tokens', tokens[i] - cost, 'ts', now)
+  redis.call('PEXPIRE', KEYS[i], math.ceil(burst * 1000 / rate) + 1000)
+end
+return 0
+"""
+
+# KEYS: factor key; ARGV: min factor, cooldown ms, recovery per second, decrease
+# Returns the factor now in effect, as a string
+_CUT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local f = redis.call('HMGET', KEYS[1], 'factor', 'at')
+local recovery = tonumber(ARGV[3])
+local factor = 1
+if f[1] then
+  factor = math.min(1, tonumber(f[1]) + recovery * (now - tonumber(f[2])) / 1000)
+  if now - tonumber(f[2]) < tonumber(ARGV[2]) then
+    return tostring(factor)
+  end
+end
+factor = math.max(tonumber(ARGV[1]), factor * tonumber(ARGV[4]))
+redis.call('HSET', KEYS[1], 'factor', factor, 'at', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil((1 - factor) / recovery * 1000) + 1000)
+return tostring(factor)
+"""
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+class _LocalStore:
+    """In-process buckets with the same semantics as the Lua scripts."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._factors: Dict[str, Tuple[float, float]] = {}
+
+    def _factor(self, key: str, now: float) -> Tuple[float, Optional[float]]:
+        if key not in self._factors:
+            return 1.0, None
+        factor, at = self._factors[key]
+        return min(1.0, factor + RECOVERY_PER_S * (now - at)), at
+
+    def take(self, factor_key: str, buckets: List[Tuple[str, float, float]], cost: float) -> int:
+        with self._lock:
+            now = time.monotonic()
+            factor, _ = self._factor(factor_key, now)
+            wait, tokens = 0, []
+            for key, rate, burst in buckets:
+                burst = max(cost, burst * factor)
+                have, ts = self._buckets.get(key, (burst, now))
+                have = min(burst, have + max(0.0, now - ts) * rate * factor)
+                tokens.append(have)
+                if have < cost:
+                    wait = max(wait, math.ceil((cost - have) * 1000 / (rate * factor)))
+            if wait:
+                return wait
+            for (key, _, _), have in zip(buckets, tokens):
+                self._buckets[key] = (have - cost, now)
+            return 0
+
+    def cut(self, factor_key: str) -> float:
+        with self._lock:
+            now = time.monotonic()
+            factor, at = self._factor(factor_key, now)
+            if at is not None and (now - at) * 1000 < CUT_COOLDOWN_MS:
+                return factor
+            factor = max(MIN_FACTOR, factor * DECREASE)
+            self._factors[factor_key] = (factor, now)
+            return factor
+
+
+class _RedisStore:
+    def __init__(self, client):
+        self._take = client.register_script(_TAKE)
+        self._cut = client.register_script(_CUT)
+
+    def take(self, factor_key: str, buckets: List[Tuple[str, float, float]], cost: float) -> int:
+        args: List[Any] = [cost]
+        for _, rate, burst in buckets:
+            args.extend((rate, burst))
+        args.append(RECOVERY_PER_S)
+        return int(self._take(keys=[factor_key] + [b[0] for b in buckets], args=args))
+
+    def cut(self, factor_key: str) -> float:
+        return float(self._cut(keys=[factor_key], args=[MIN_FACTOR, CUT_COOLDOWN_MS, RECOVERY_PER_S, DECREASE]))
+
+
+_client = None
+_redis_store: Optional[_RedisStore] = None
+_redis_down_until = 0.0
+_local = _LocalStore()
+_store_lock = threading.Lock()
+
+
+def use_redis(client) -> None:
+    """Share buckets through `client` (a redis.Redis) instead of connecting to REDIS_URL."""
+    global _client, _redis_store, _redis_down_until
+    with _store_lock:
+        _client, _redis_store, _redis_down_until = client, None, 0.0
+
+
+def _with_store(op: Callable[[Any], Any]):
+    """Run `op` against the Redis store, or the local one while Redis is unavailable."""
+    global _client, _redis_store, _redis_down_until
+    if redis is not None and time.monotonic() >= _redis_down_until:
+        try:
+            with _store_lock:
+                if _redis_store is None:
+                    if _client is None:
+                        # Fail over to the local buckets at once rather than after redis-py's retries
+                        from redis.backoff import NoBackoff
+                        from redis.retry import Retry
+                        _client = redis.Redis.from_url(REDIS_URL, socket_connect_timeout=0.5, socket_timeout=2,
+                                                       retry=Retry(NoBackoff(), 0))
+                    _redis_store = _RedisStore(_client)
+                store = _redis_store
+            return op(store)
+        except redis.RedisError:
+            _redis_down_until = time.monotonic() + REDIS_RETRY_S
+            metrics.incr('ratelimit_fallback')
+    return op(_local)
+
+
+def _status(exc: BaseException) -> Optional[int]:
+    response = getattr(exc, 'response', None)    # requests.HTTPError
+    if response is not None and getattr(response, 'status_code', None):
+        return response.status_code
+    resp = getattr(exc, 'resp', None)            # googleapiclient HttpError
+    if resp is not None and getattr(resp, 'status', None):
+        return int(resp.status)
+    return None
+
+
+def is_throttled(exc: BaseException) -> bool:
+    """True for quota errors: HTTP 429, or Gmail's 403 with a rate-limit reason."""
+    status = _status(exc)
+    if status == 429:
+        return True
+    if status == 403:
+        content = getattr(exc, 'content', b'') or b''
+        return b'RateLimitExceeded' in content or b'rateLimitExceeded' in content
+    return False
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """Seconds from the error's Retry-After header, if it has one."""
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None) if response is not None else getattr(exc, 'resp', None)
+    try:
+        value = headers.get('Retry-After') or headers.get('retry-after')
+        return float(value) if value else None
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class _Window:
+    """Concurrent calls allowed in this process: halved on throttling, +1 per window of successes."""
+
+    def __init__(self, limit: int):
+        self.max = float(limit)
+        self.limit = float(limit)
+        self.active = 0
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            while self.active >= int(self.limit):
+                self._cond.wait()
+            self.active += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def grow(self) -> None:
+        with self._cond:
+            self.limit = min(self.max, self.limit + 1 / self.limit)
+            self._cond.notify()
+
+    def shrink(self) -> None:
+        with self._cond:
+            self.limit = max(1.0, self.limit / 2)
+
+
+class Limiter:
+    """A global bucket, optionally a per-user one, and an adaptive concurrency window."""
+
+    def __init__(self, name: str, rate: float, user_rate: Optional[float] = None, concurrency: int = 8,
+                 retries: int = 5, timeout: float = 300.0):
+        self.name = name
+        self.rate = rate
+        self.user_rate = user_rate
+        self.retries = retries
+        self.timeout = timeout
+        self.window = _Window(concurrency)
+
+    def _buckets(self, user: Optional[str]) -> List[Tuple[str, float, float]]:
+        buckets = [(f'ratelimit:{self.name}:global', self.rate, max(1.0, self.rate))]
+        if user is not None and self.user_rate:
+            buckets.append((f'ratelimit:{self.name}:user:{user}', self.user_rate, max(1.0, self.user_rate)))
+        return buckets
+
+    def acquire(self, cost: float = 1, user: Optional[str] = None) -> float:
+        """Block until `cost` tokens are taken from every bucket; returns the seconds waited."""
+        buckets = self._buckets(user)
+        cost = min(cost, min(b[2] for b in buckets))
+        factor_key = f'ratelimit:{self.name}:factor'
+        start = time.monotonic()
+        while True:
+            wait_ms = _with_store(lambda store: store.take(factor_key, buckets, cost))
+            if not wait_ms:
+                break
+            if time.monotonic() - start + wait_ms / 1000 > self.timeout:
+                raise RateLimitTimeout(f'{self.name}: no capacity within {self.timeout:g}s')
+            # Jitter keeps waiting workers from all retrying at the same instant
+            time.sleep(wait_ms / 1000 * (1 + random.random() * 0.2))
+        waited = time.monotonic() - start
+        if waited:
+            metrics.observe('ratelimit_wait', waited, limiter=self.name)
+        return waited
+
+    def throttled(self) -> float:
+        """Back off after a quota error: cut the shared rate and this process's window."""
+        self.window.shrink()
+        metrics.incr('ratelimit_throttled', limiter=self.name)
+        return _with_store(lambda store: store.cut(f'ratelimit:{self.name}:factor'))
+
+    def run(self, fn: Callable[[], Any], cost: float = 1, user: Optional[str] = None) -> Any:
+        """Call `fn` within the limits, retrying it when it is throttled."""
+        for attempt in range(self.retries + 1):
+            self.acquire(cost, user)
+            with self.window:
+                try:
+                    result = fn()
+                except Exception as e:
+                    if not is_throttled(e) or attempt == self.retries:
+                        raise
+                    self.throttled()
+                    delay = retry_after(e) or min(MAX_BACKOFF_S, 2 ** attempt) * (0.5 + random.random())
+                else:
+                    self.window.grow()
+                    return result
+            time.sleep(delay)
+
+
+_limiters: Dict[str, Limiter] = {}
+
+
+def gmail() -> Limiter:
+    """The Gmail limiter; pass the quota-unit cost of each call (`GMAIL_COSTS`) and the user."""
+    if 'gmail' not in _limiters:
+        _limiters['gmail'] = Limiter('gmail', GMAIL_UNITS, GMAIL_USER_UNITS, concurrency=16)
+    return _limiters['gmail']
+
+
+def llm() -> Limiter:
+    if 'llm' not in _limiters:
+        _limiters['llm'] = Limiter('llm', LLM_RPM / 60, concurrency=4)
+    return _limiters['llm']
@@ -0,0 +1,306 @@
+"""Search index over extracted statements, kept in users.db.
+
+Two tables are filled as documents are extracted (batch mode, the CLI when it
+knows the user, `search --reindex` from `statement_documents`):
+
+  - `statement_pages`         one row per page of usable text
+  - `statement_transactions`  one row per parsed transaction (see `bank_pdf.transactions`)
+
+Each has an FTS5 shadow index (`*_fts`, external content kept in sync by
+triggers), so "all Swiggy payments last year" is one indexed query:
+
+    python main.py search swiggy --user <user_id> --from 2024-01-01 --to 2024-12-31
+    python main.py search "salary" --pages          # matching pages with a snippet
+
+If this SQLite build has no FTS5 the same queries fall back to LIKE scans.
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import metrics, users
+from .transactions import iter_transactions, page_text, parse_date
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def fts_available(conn: sqlite3.Connection) -> bool:
+    try:
+        conn.execute('CREATE VIRTUAL TABLE IF NOT EXISTS temp._fts5_probe USING fts5(x)')
+        conn.execute('DROP TABLE temp._fts5_probe')
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def _has_fts(conn: sqlite3.Connection) -> bool:
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='statement_transactions_fts'").fetchone()
+    return row is not None
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    c = conn.cursor()
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS statement_pages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        bank_name TEXT,
+        path TEXT NOT NULL,
+        page_number INTEGER,
+        text TEXT
+    )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_statement_pages_doc ON statement_pages(user_id, path)')
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS statement_transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        bank_name TEXT,
+        path TEXT NOT NULL,
+        page_number INTEGER,
+        txn_date TEXT,
+        description TEXT,
+        amount REAL,
+        balance REAL,
+        direction TEXT
+    )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_statement_transactions_date ON statement_transactions(user_id, txn_date)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_statement_transactions_doc ON statement_transactions(user_id, path)')
+
+    if fts_available(conn):
+        for table, column in (('statement_pages', 'text'), ('statement_transactions', 'description')):
+            c.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts USING fts5({column}, content='{table}', content_rowid='id')")
+            c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON {table} BEGIN
+                INSERT INTO {table}_fts(rowid, {column}) VALUES (new.id, new.{column});
+            END''')
+            c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON {table} BEGIN
+                INSERT INTO {table}_fts({table}_fts, rowid, {column}) VALUES ('delete', old.id, old.{column});
+            END''')
+    conn.commit()
+
+
+def index_document(conn: sqlite3.Connection, user_id: str, bank_name: Optional[str], path: str,
+                   result: Dict[str, Any]) -> int:
+    """Replace the indexed pages/transactions of (user_id, path) with `result`'s.
+
+    Returns the number of transactions indexed. The caller commits.
+    """
+    conn.execute('DELETE FROM statement_pages WHERE user_id = ? AND path = ?', (user_id, path))
+    conn.execute('DELETE FROM statement_transactions WHERE user_id = ? AND path = ?', (user_id, path))
+    if result.get('error'):
+        return 0
+    bank_name = (bank_name or '').strip().lower() or None
+    pages = [(user_id, bank_name, path, p.get('page_number'), page_text(p)) for p in result.get('pages') or []]
+    conn.executemany(
+        'INSERT INTO statement_pages (user_id, bank_name, path, page_number, text) VALUES (?, ?, ?, ?, ?)',
+        [p for p in pages if p[4].strip()]
+    )
+    txns = [(user_id, bank_name, path, t['page_number'], t['date'], t['description'], t['amount'], t['balance'], t['direction'])
+            for t in iter_transactions(result)]
+    conn.executemany(
+        'INSERT INTO statement_transactions (user_id, bank_name, path, page_number, txn_date, description, amount, balance, direction) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        txns
+    )
+    metrics.incr('search_pages_indexed', len(pages))
+    metrics.incr('search_transactions_indexed', len(txns))
+    return len(txns)
+
+
+def update_index(db_path: str, user_id: str, bank_name: Optional[str], path: str, result: Dict[str, Any]) -> int:
+    """`index_document` in its own connection and transaction (for one-off callers like the CLI)."""
+    conn = sqlite3.connect(db_path)
+    try:
+        ensure_schema(conn)
+        n = index_document(conn, user_id, bank_name, path, result)
+        conn.commit()
+        return n
+    finally:
+        conn.close()
+
+
+def reindex(conn: sqlite3.Connection, user_id: Optional[str] = None) -> Tuple[int, int]:
+    """Rebuild the index from stored `statement_documents` results; returns (documents, transactions)."""
+    from . import store
+    store.ensure_schema(conn)
+    sql = "SELECT user_id, bank_name, path, result_json, doc_path FROM statement_documents WHERE status = 'ok'"
+    params: List[Any] = []
+    if user_id:
+        sql += ' AND user_id = ?'
+        params.append(user_id)
+    docs = txns = 0
+    for uid, bank, path, result_json, doc_path in conn.execute(sql, params).fetchall():
+        txns += index_document(conn, uid, bank, path, store.load_result(result_json, doc_path))
+        docs += 1
+    conn.commit()
+    return docs, txns
+
+
+def _match_expr(query: str) -> str:
+    """FTS5 query matching every word of `query` as a prefix; user syntax is not interpreted."""
+    return ' '.join('"%s"*' % tok for tok in _TOKEN.findall(query or ''))
+
+
+def _filters(alias: str, user_id, bank, date_from, date_to, date_col: Optional[str]):
+    where, params = [], []
+    if user_id:
+        where.append(f'{alias}.user_id = ?')
+        params.append(user_id)
+    if bank:
+        where.append(f'{alias}.bank_name = ?')
+        params.append(bank.strip().lower())
+    if date_col:
+        if date_from:
+            where.append(f'{alias}.{date_col} >= ?')
+            params.append(date_from)
+        if date_to:
+            where.append(f'{alias}.{date_col} <= ?')
+            params.append(date_to)
+    return where, params
+
+
+def _transactions_from(conn: sqlite3.Connection, query: str, user_id, bank, date_from, date_to) -> Tuple[str, List[Any]]:
+    """FROM/WHERE clause (and its params) selecting the transactions `t` a search matches."""
+    where, params = _filters('t', user_id, bank, date_from, date_to, 'txn_date')
+    match = _match_expr(query)
+    sql = ' FROM statement_transactions t'
+    if match and _has_fts(conn) and user_id:
+        # The user's rows are few: walk them and probe the match set
+        where.append('t.id IN (SELECT rowid FROM statement_transactions_fts WHERE statement_transactions_fts MATCH ?)')
+        params.append(match)
+    elif match and _has_fts(conn):
+        # Across all users the match set is the smaller side: drive from the index
+        sql = ' FROM statement_transactions_fts f JOIN statement_transactions t ON t.id = f.rowid'
+        where.insert(0, 'f.statement_transactions_fts MATCH ?')
+        params.insert(0, match)
+    elif match:
+        for tok in _TOKEN.findall(query):
+            where.append('t.description LIKE ?')
+            params.append(f'%{tok}%')
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    return sql, params
+
+
+def search_transactions(conn: sqlite3.Connection, query: str = '', user_id: Optional[str] = None, bank: Optional[str] = None,
+                        date_from: Optional[str] = None, date_to: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+    """Transactions whose description matches `query`, newest first. Dates are yyyy-mm-dd."""
+    with metrics.timer('search', kind='transactions'):
+        sql, params = _transactions_from(conn, query, user_id, bank, date_from, date_to)
+        sql = ('SELECT t.user_id, t.bank_name, t.path, t.page_number, t.txn_date, t.description, t.amount, t.balance, t.direction'
+               + sql + ' ORDER BY t.txn_date DESC, t.id DESC LIMIT ?')
+        rows = conn.execute(sql, params + [limit]).fetchall()
+    keys = ('user_id', 'bank', 'path', 'page_number', 'date', 'description', 'amount', 'balance', 'direction')
+    return [dict(zip(keys, r)) for r in rows]
+
+
+def search_pages(conn: sqlite3.Connection, query: str, user_id: Optional[str] = None, bank: Optional[str] = None,
+                 date_from: Optional[str] = None, date_to: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+    """Pages whose text matches `query`, best match first, with a short snippet.
+
+    A date range keeps pages that carry at least one transaction in that range.
+    """
+    with metrics.timer('search', kind='pages'):
+        where, params = _filters('p', user_id, bank, None, None, None)
+        if date_from or date_to:
+            dwhere, dparams = _filters('t', None, None, date_from, date_to, 'txn_date')
+            where.append('EXISTS (SELECT 1 FROM statement_transactions t WHERE t.user_id = p.user_id AND t.path = p.path '
+                         'AND t.page_number = p.page_number AND ' + ' AND '.join(dwhere) + ')')
+            params += dparams
+        match = _match_expr(query)
+        if match and _has_fts(conn):
+            sql = ("SELECT p.user_id, p.bank_name, p.path, p.page_number, "
+                   "snippet(statement_pages_fts, 0, '[', ']', '...', 12) "
+                   "FROM statement_pages_fts JOIN statement_pages p ON p.id = statement_pages_fts.rowid "
+                   "WHERE statement_pages_fts MATCH ?")
+            params.insert(0, match)
+            order = ' ORDER BY statement_pages_fts.rank'
+        else:
+            sql = 'SELECT p.user_id, p.bank_name, p.path, p.page_number, substr(p.text, 1, 120) FROM statement_pages p WHERE 1'
+            for tok in _TOKEN.findall(query or ''):
+                where.append('p.text LIKE ?')
+                params.append(f'%{tok}%')
+            order = ' ORDER BY p.id DESC'
+        if where:
+            sql += ' AND ' + ' AND '.join(where)
+        rows = conn.execute(sql + order + ' LIMIT ?', params + [limit]).fetchall()
+    keys = ('user_id', 'bank', 'path', 'page_number', 'snippet')
+    return [dict(zip(keys, r)) for r in rows]
+
+
+def totals(conn: sqlite3.Connection, query: str = '', user_id: Optional[str] = None, bank: Optional[str] = None,
+           date_from: Optional[str] = None, date_to: Optional[str] = None) -> Dict[str, Any]:
+    """Count and debit/credit sums over every transaction `search_transactions` would match, not just one page of it."""
+    with metrics.timer('search', kind='totals'):
+        sql, params = _transactions_from(conn, query, user_id, bank, date_from, date_to)
+        count, debit, credit = conn.execute(
+            "SELECT COUNT(*), SUM(CASE WHEN t.direction = 'debit' THEN t.amount END), "
+            "SUM(CASE WHEN t.direction = 'credit' THEN t.amount END)" + sql, params).fetchone()
+    return {'count': count, 'debit': round(debit or 0, 2), 'credit': round(credit or 0, 2)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='search', description='Search extracted statements (transactions by default, or pages)')
+    parser.add_argument('query', nargs='?', default='', help='Words to look for, e.g. a merchant name (prefix match)')
+    parser.add_argument('--user', default='', help='Only this user_id')
+    parser.add_argument('--bank', default='', help='Only this bank')
+    parser.add_argument('--from', dest='date_from', default='', help='Earliest transaction date (any common format)')
+    parser.add_argument('--to', dest='date_to', default='', help='Latest transaction date (any common format)')
+    parser.add_argument('--pages', action='store_true', help='Search page text instead of transactions')
+    parser.add_argument('--limit', type=int, default=50, help='Max results (default: 50)')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    parser.add_argument('--reindex', action='store_true', help='Rebuild the index from stored batch results first')
+    parser.add_argument('--db', default=users.DEFAULT_DB_PATH, help='Path to users.db (default: repo root users.db)')
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.db):
+        print('Error: users.db not found at', args.db)
+        return
+    date_from = parse_date(args.date_from) if args.date_from else None
+    date_to = parse_date(args.date_to) if args.date_to else None
+    if (args.date_from and not date_from) or (args.date_to and not date_to):
+        print('Error: could not parse --from/--to (use e.g. 2024-01-31 or 31/01/2024)')
+        return
+
+    conn = sqlite3.connect(args.db)
+    try:
+        ensure_schema(conn)
+        if args.reindex:
+            docs, txns = reindex(conn, args.user or None)
+            print(f'Indexed {docs} documents ({txns} transactions)')
+            if not args.query:
+                return
+        start = time.perf_counter()
+        if args.pages:
+            results = search_pages(conn, args.query, args.user or None, args.bank or None, date_from, date_to, args.limit)
+        else:
+            results = search_transactions(conn, args.query, args.user or None, args.bank or None, date_from, date_to, args.limit)
+            summary = totals(conn, args.query, args.user or None, args.bank or None, date_from, date_to)
+        took_ms = (time.perf_counter() - start) * 1000
+    finally:
+        conn.close()
+
+    if args.json:
+        out = {'results': results, 'took_ms': round(took_ms, 2)}
+        if not args.pages:
+            out['totals'] = summary
+        print(json.dumps(out, ensure_ascii=False, indent=2))
+        return
+    for r in results:
+        if args.pages:
+            print(f"{r['bank'] or '-':<12} {os.path.basename(r['path'])} p{r['page_number']}: {r['snippet']}")
+        else:
+            print(f"{r['date'] or '-':<10}  {r['direction'] or '':<6} {r['amount'] or 0:>12,.2f}  {r['bank'] or '-':<12} {r['description']}")
+    if not args.pages:
+        t = summary
+        shown = f'showing {len(results)} of ' if len(results) < t['count'] else ''
+        print(f"{shown}{t['count']} transactions  debit {t['debit']:,.2f}  credit {t['credit']:,.2f}  ({took_ms:.1f} ms)")
+    else:
+        print(f'{len(results)} pages ({took_ms:.1f} ms)')
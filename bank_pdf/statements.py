@@ -0,0 +1,209 @@
+"""Statement identity and overlap removal before analysis.
+
+Banks send the same statement more than once, and monthly and quarterly
+statements for one account cover the same rows. Sending every extracted
+document to the LLM pays for that overlap repeatedly, so `consolidate` turns
+the CLI's documents into one transaction list per account:
+
+  - each document's account (last four digits of the account number) and
+    period come from the statement header ("Account No: XXXXXXXX1234",
+    "Statement period: 01/03/2024 to 31/03/2024"), then its PDF metadata,
+    and the period falls back to the first and last transaction dates
+  - documents with the same text as one already seen are dropped
+  - transactions are merged per account by (date, amount, description,
+    balance); a row repeated within one statement (two identical payments on
+    the same day) is kept as many times as the statement that has the most
+    of it, so only cross-statement repeats disappear
+
+Documents whose text yields no transaction rows are passed through with their
+page text so nothing is lost. Every other document that contributes rows is
+passed through with the lines that are not transaction rows (header, summary,
+charges and notes), each repeated page header or footer once. Documents whose
+account cannot be read are not merged with others, only deduplicated by text.
+"""
+import hashlib
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from .transactions import _AMOUNT, _DATE, _amount, iter_transactions, page_text, parse_date, parse_line
+
+# Only the first pages carry the statement header
+_HEADER_PAGES = 2
+_ACCOUNT = re.compile(r'\b(?:a/c|acct|account)\.?\s*(?:no|number|num)?\.?\s*[:#-]?\s*([Xx*\d][Xx*\d -]{2,}\d)\b', re.I)
+_PERIOD = re.compile(r'(?:statement\s+(?:period|for)|period|from)\s*[:-]?\s*(?:from\s+)?(' + _DATE.pattern
+                     + r')\s*(?:to|till|until|-|–)\s*(' + _DATE.pattern + r')', re.I)
+_BALANCE = r'\s*balance\b[^\d\n-]{0,20}(' + _AMOUNT.pattern + ')'
+_OPENING = re.compile(r'\bopening' + _BALANCE, re.I)
+_CLOSING = re.compile(r'\bclosing' + _BALANCE, re.I)
+
+
+def detect_account(text: str) -> Optional[str]:
+    """Last four digits of the first account number in `text`, or None."""
+    for m in _ACCOUNT.finditer(text or ''):
+        digits = re.sub(r'\D', '', m.group(1))
+        if len(digits) >= 4:
+            return digits[-4:]
+    return None
+
+
+def detect_period(text: str) -> Tuple[Optional[str], Optional[str]]:
+    """(from, to) ISO dates of a statement period stated in `text`."""
+    m = _PERIOD.search(text or '')
+    if not m:
+        return None, None
+    start, end = parse_date(m.group(1)), parse_date(m.group(2))
+    if start and end and start > end:
+        start, end = end, start
+    return start, end
+
+
+def detect_balance(text: str, pattern: re.Pattern) -> Optional[float]:
+    """The amount after the first "opening/closing balance" label in `text`, or None."""
+    m = pattern.search(text or '')
+    if not m:
+        return None
+    value = _amount(m.group(1))
+    return -abs(value) if (m.group(2) or '').lower() == 'dr' else value
+
+
+def fingerprint(result: Dict[str, Any]) -> str:
+    """Hash of a document's page text, ignoring whitespace differences."""
+    h = hashlib.sha1()
+    for page in result.get('pages') or []:
+        h.update(' '.join(page_text(page).split()).encode('utf-8'))
+        h.update(b'\f')
+    return h.hexdigest()
+
+
+def describe(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Account, period and transactions of one `extract_pdf_all` result."""
+    header = '\n'.join(page_text(p) for p in (result.get('pages') or [])[:_HEADER_PAGES])
+    metadata = ' '.join(str(v) for v in (result.get('metadata') or {}).values())
+    txns = list(iter_transactions(result))
+    period_from, period_to = detect_period(header)
+    if period_from is None:
+        period_from, period_to = detect_period(metadata)
+    if period_from is None and txns:
+        dates = sorted(t['date'] for t in txns)
+        period_from, period_to = dates[0], dates[-1]
+    opening = detect_balance(header, _OPENING)
+    if opening is None and txns and txns[0]['balance'] is not None and txns[0]['direction']:
+        # Undo the first row: the balance after it is not the opening balance
+        first = txns[0]
+        opening = round(first['balance'] + (first['amount'] if first['direction'] == 'debit' else -first['amount']), 2)
+    balances = [t['balance'] for t in txns if t['balance'] is not None]
+    closing = detect_balance('\n'.join(page_text(p) for p in result.get('pages') or []), _CLOSING)
+    return {
+        'path': result.get('path'),
+        'account': detect_account(header) or detect_account(metadata),
+        'period_from': period_from,
+        'period_to': period_to,
+        'opening_balance': opening,
+        'closing_balance': closing if closing is not None else (balances[-1] if balances else None),
+        'transactions': txns,
+        'fingerprint': fingerprint(result),
+    }
+
+
+def transaction_key(txn: Dict[str, Any]) -> Tuple:
+    return (txn['date'], round(txn['amount'], 2), ' '.join(txn['description'].split()).upper(), txn['balance'])
+
+
+def _pages(doc: Dict[str, Any], rows_removed: bool = False) -> List[Dict[str, Any]]:
+    """Page texts of `doc` for the payload; with `rows_removed` only the lines that are
+    not transaction rows, and a line repeated on several pages only the first time."""
+    pages, seen = [], set()
+    for p in doc.get('pages') or []:
+        text = page_text(p)
+        if rows_removed:
+            lines = []
+            for line in text.splitlines():
+                key = ' '.join(line.split())
+                if key and key not in seen and parse_line(line) is None:
+                    seen.add(key)
+                    lines.append(line)
+            text = '\n'.join(lines)
+            if not text:
+                continue
+        pages.append({'page_number': p.get('page_number'), 'text': text})
+    return pages
+
+
+def consolidate(documents: List[Dict[str, Any]], bank: Optional[str] = None) -> Dict[str, Any]:
+    """Deduplicated analysis payload for the CLI's extracted `documents`.
+
+    Returns {'statements': per-document summary, 'accounts': merged transactions
+    per account, 'documents': the text of documents without parseable rows and
+    the non-row text of the others, 'skipped': documents left out and why}.
+    """
+    skipped: List[Dict[str, Any]] = []
+    described = []
+    by_fingerprint: Dict[str, str] = {}
+    for doc in documents:
+        if doc.get('error'):
+            skipped.append({'path': doc.get('path'), 'reason': doc['error']})
+            continue
+        info = describe(doc)
+        first = by_fingerprint.setdefault(info['fingerprint'], info['path'])
+        if first != info['path']:
+            skipped.append({'path': info['path'], 'reason': f'duplicate of {first}'})
+            continue
+        described.append((info, doc))
+
+    # Per account by start date; of statements starting the same day the one ending last
+    # (then the one with more rows) goes first, so a quarterly statement is merged before
+    # the monthly one it covers and the monthly one's repeats are recognized as such.
+    # Stable sorts, innermost key first
+    described.sort(key=lambda d: -len(d[0]['transactions']))
+    described.sort(key=lambda d: d[0]['period_to'] or '', reverse=True)
+    described.sort(key=lambda d: (d[0]['account'] or '', d[0]['period_from'] or ''))
+    accounts: Dict[str, Dict[str, Any]] = {}
+    statements, passthrough = [], []
+    for info, doc in described:
+        txns = info.pop('transactions')
+        info.pop('fingerprint')
+        if not txns:
+            passthrough.append({'path': doc.get('path'), 'metadata': doc.get('metadata') or {},
+                                'pages': _pages(doc)})
+            statements.append({**info, 'transactions': 0, 'new_transactions': 0})
+            continue
+        # Unknown accounts are only merged with themselves
+        group = info['account'] or info['path']
+        acc = accounts.setdefault(group, {'account': info['account'], 'bank': bank, 'period_from': None,
+                                          'period_to': None, 'transactions': [], '_keys': Counter()})
+        seen: Counter = Counter()
+        added = 0
+        for txn in txns:
+            key = transaction_key(txn)
+            seen[key] += 1
+            if seen[key] > acc['_keys'][key]:
+                acc['transactions'].append({k: txn[k] for k in ('date', 'description', 'amount', 'balance', 'direction')})
+                added += 1
+        acc['_keys'] |= seen
+        for bound, pick in (('period_from', min), ('period_to', max)):
+            values = [v for v in (acc[bound], info[bound]) if v]
+            acc[bound] = pick(values) if values else None
+        statements.append({**info, 'transactions': len(txns), 'new_transactions': added})
+        if not added:
+            skipped.append({'path': info['path'], 'reason': 'every transaction is covered by other statements'})
+            continue
+        rest = _pages(doc, rows_removed=True)
+        if rest:
+            passthrough.append({'path': doc.get('path'), 'metadata': doc.get('metadata') or {},
+                                'account': info['account'], 'pages': rest})
+
+    merged = []
+    for acc in accounts.values():
+        del acc['_keys']
+        # Stable: rows of one day keep their statement order
+        acc['transactions'].sort(key=lambda t: t['date'])
+        merged.append(acc)
+    return {'statements': statements, 'accounts': merged, 'documents': passthrough, 'skipped': skipped}
+
+
+def summary_line(documents: List[Dict[str, Any]], payload: Dict[str, Any]) -> str:
+    before = sum(s['transactions'] for s in payload['statements'])
+    after = sum(len(a['transactions']) for a in payload['accounts'])
+    return (f'{len(documents)} documents -> {len(payload["accounts"])} accounts, '
+            f'{before} -> {after} transactions ({len(payload["skipped"])} documents skipped)')
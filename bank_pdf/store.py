@@ -0,0 +1,105 @@
+"""Result store: per-user statement processing results kept in users.db.
+
+One row per (user_id, path), so batch runs can write results as they finish
+and later stages can read them back without reprocessing the PDF. Successful
+results are written as compressed docfiles (see `bank_pdf.docfile`) under
+`DOCS_DIR` and the row points at the file; failures, and every result when
+BANK_PDF_DOCS_DIR is set to an empty string, are kept as JSON in the row.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from . import docfile
+from .users import REPO_ROOT
+
+DOCS_DIR = os.environ.get('BANK_PDF_DOCS_DIR', os.path.join(REPO_ROOT, 'docstore'))
+_PATHS_PER_QUERY = 500
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    c = conn.cursor()
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS statement_documents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        bank_name TEXT,
+        path TEXT NOT NULL,
+        status TEXT NOT NULL,
+        num_pages INTEGER DEFAULT 0,
+        result_json TEXT,
+        processed_at TEXT DEFAULT (datetime('now')),
+        doc_path TEXT,
+        UNIQUE(user_id, path)
+    )
+    ''')
+    c.execute("PRAGMA table_info('statement_documents')")
+    if 'doc_path' not in [r[1] for r in c.fetchall()]:
+        c.execute('ALTER TABLE statement_documents ADD COLUMN doc_path TEXT')
+    conn.commit()
+
+
+def doc_path_for(user_id: str, path: str, docs_dir: str = DOCS_DIR) -> str:
+    """Where the docfile for (user_id, path) is kept."""
+    name = hashlib.sha1(path.encode('utf-8')).hexdigest()[:16] + '.bpd'
+    return os.path.join(docs_dir, re.sub(r'[^\w.-]', '_', user_id), name)
+
+
+def save_document(conn: sqlite3.Connection, user_id: str, bank_name: Optional[str], path: str, result: Dict[str, Any],
+                  docs_dir: Optional[str] = None) -> None:
+    """Insert or replace the result for (user_id, path)."""
+    docs_dir = DOCS_DIR if docs_dir is None else docs_dir
+    status = 'error' if result.get('error') else 'ok'
+    doc_path, result_json = None, json.dumps(result, ensure_ascii=False)
+    if status == 'ok' and docs_dir:
+        doc_path = doc_path_for(user_id, path, docs_dir)
+        docfile.write(doc_path, result)
+        result_json = None
+    conn.execute(
+        'INSERT INTO statement_documents (user_id, bank_name, path, status, num_pages, result_json, doc_path) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT(user_id, path) DO UPDATE SET bank_name=excluded.bank_name, status=excluded.status, '
+        "num_pages=excluded.num_pages, result_json=excluded.result_json, doc_path=excluded.doc_path, "
+        "processed_at=datetime('now')",
+        (user_id, bank_name, path, status, result.get('num_pages', 0) or 0, result_json, doc_path)
+    )
+
+
+def load_result(result_json: Optional[str], doc_path: Optional[str]) -> Dict[str, Any]:
+    """A stored result from its row: the docfile if there is one, else the JSON."""
+    if doc_path:
+        try:
+            return docfile.read(doc_path)
+        except (OSError, ValueError):
+            pass
+    return json.loads(result_json or '{}')
+
+
+def load_documents(conn: sqlite3.Connection, user_id: str, paths: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+    """Return the stored results for a user, oldest first; only those of `paths` if given."""
+    if paths is None:
+        cur = conn.execute(
+            'SELECT id, result_json, doc_path FROM statement_documents WHERE user_id = ? ORDER BY id', (user_id,)
+        )
+        rows = cur.fetchall()
+    else:
+        paths = list(dict.fromkeys(paths))
+        rows = []
+        # Chunked to stay under SQLite's bound-parameter limit
+        for i in range(0, len(paths), _PATHS_PER_QUERY):
+            chunk = paths[i:i + _PATHS_PER_QUERY]
+            rows += conn.execute(
+                'SELECT id, result_json, doc_path FROM statement_documents WHERE user_id = ? '
+                f'AND path IN ({",".join("?" * len(chunk))})', [user_id] + chunk
+            ).fetchall()
+        rows.sort()
+    return [load_result(r[1], r[2]) for r in rows if r[1] or r[2]]
+
+
+def processed_paths(conn: sqlite3.Connection) -> Set[Tuple[str, str]]:
+    """(user_id, path) of every document already stored without an error."""
+    cur = conn.execute("SELECT user_id, path FROM statement_documents WHERE status = 'ok'")
+    return {(r[0], r[1]) for r in cur.fetchall()}
@@ -0,0 +1,114 @@
+"""Parse transaction rows out of extracted statement text.
+
+Statement tables differ per bank, but a transaction line nearly always starts
+with a date and ends with one or two amounts (the transaction amount and/or
+the running balance):
+
+    01/03/2024  UPI/SWIGGY/4058.../Payment        412.00          45,210.55
+    05-Mar-24   NEFT-SALARY ACME CORP               85,000.00 Cr  1,30,210.55
+
+Amounts must have two decimals so reference numbers inside the narration are
+not mistaken for money. When consecutive balances are known, the balance
+movement decides whether a row is a debit or a credit; an explicit Cr/Dr
+suffix wins.
+"""
+import re
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+_DATE_FORMATS = ('%d/%m/%Y', '%d-%m-%Y', '%d/%m/%y', '%d-%m-%y', '%d-%b-%Y', '%d-%b-%y',
+                 '%d %b %Y', '%d %b %y', '%d.%m.%Y', '%Y-%m-%d')
+_DATE = re.compile(r'\d{4}-\d{2}-\d{2}|\d{1,2}[/.-](?:\d{1,2}|[A-Za-z]{3})[/.-]\d{2,4}|\d{1,2} [A-Za-z]{3} \d{2,4}')
+_LEADING_DATE = re.compile(r'\s*(' + _DATE.pattern + r')(?![\w/.-])')
+# 1,23,456.78 / 123456.78 / -12.00, optionally followed by Cr/Dr
+_AMOUNT = re.compile(r'(?<![\w.,/-])(-?\d{1,3}(?:,\d{2,3})+\.\d{2}|-?\d+\.\d{2})(?:\s?(Cr|Dr|CR|DR)\b)?(?![\w.])')
+
+
+def parse_date(value: str) -> Optional[str]:
+    """ISO yyyy-mm-dd for a statement date (day-first), or None."""
+    value = (value or '').strip()
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return None
+
+
+def _amount(text: str) -> float:
+    return float(text.replace(',', ''))
+
+
+def parse_line(line: str) -> Optional[Dict[str, Any]]:
+    """One transaction dict for a table line, or None if it is not one."""
+    m = _LEADING_DATE.match(line)
+    if not m:
+        return None
+    txn_date = parse_date(m.group(1))
+    if txn_date is None:
+        return None
+    rest = line[m.end():]
+    # Many banks print a value date right after the transaction date
+    value_date = _LEADING_DATE.match(rest)
+    if value_date:
+        rest = rest[value_date.end():]
+
+    # Amounts count only at the end of the line, separated by whitespace
+    tail = []
+    end = len(rest.rstrip())
+    for am in reversed(list(_AMOUNT.finditer(rest))):
+        if rest[am.end():end].strip():
+            break
+        tail.insert(0, am)
+        end = am.start()
+    description = ' '.join(rest[:end].split())
+    if not tail or not description:
+        return None
+
+    amount_match = tail[-2] if len(tail) >= 2 else tail[0]
+    balance = _amount(tail[-1].group(1)) if len(tail) >= 2 else None
+    suffix = (amount_match.group(2) or '').lower()
+    return {
+        'date': txn_date,
+        'description': description,
+        'amount': abs(_amount(amount_match.group(1))),
+        'balance': balance,
+        'direction': {'cr': 'credit', 'dr': 'debit'}.get(suffix),
+    }
+
+
+def parse_transactions(text: str, page_number: Optional[int] = None,
+                       prev_balance: Optional[float] = None) -> List[Dict[str, Any]]:
+    """All transactions on one page of text, in order.
+
+    `prev_balance` is the last balance of the previous page, so the first row's
+    direction can be inferred across a page break.
+    """
+    out = []
+    for line in (text or '').splitlines():
+        txn = parse_line(line)
+        if txn is None:
+            continue
+        if txn['direction'] is None and txn['balance'] is not None and prev_balance is not None:
+            txn['direction'] = 'credit' if txn['balance'] > prev_balance else 'debit'
+        if txn['balance'] is not None:
+            prev_balance = txn['balance']
+        txn['page_number'] = page_number
+        out.append(txn)
+    return out
+
+
+def page_text(page: Dict[str, Any]) -> str:
+    """The usable text of an extracted page: its text layer, else its OCR text."""
+    text = page.get('text') or ''
+    return text if text.strip() else (page.get('ocr_text') or '')
+
+
+def iter_transactions(result: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Transactions from an `extract_pdf_all` result, carrying the balance across pages."""
+    balance = None
+    for page in result.get('pages') or []:
+        for txn in parse_transactions(page_text(page), page.get('page_number'), balance):
+            if txn['balance'] is not None:
+                balance = txn['balance']
+            yield txn
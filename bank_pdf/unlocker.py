@@ -2,35 +2,49 @@ import tempfile
 import os
 from typing import List, Tuple, Optional
 
+from . import metrics
+
 try:
     import pikepdf
 except Exception:
     pikepdf = None
 
 
-def try_unlock_pdf(pdf_path: str, candidates: List[str]) -> Tuple[bool, Optional[str], Optional[str]]:
+def try_unlock_pdf(pdf_path: str, candidates: List[str], save: bool = True) -> Tuple[bool, Optional[str], Optional[str]]:
     """Attempt to open `pdf_path` with each password candidate. Returns (success, password, decrypted_path).
 
     If the file is not encrypted, it returns (True, None, original_path).
+    With `save=False` no decrypted copy is written and the original path is
+    returned; the caller opens it with the password.
     """
     if pikepdf is None:
         raise RuntimeError('pikepdf is required but not installed. See requirements.txt')
 
+    with metrics.timer('unlock'):
+        success, password, path, attempts = _try_unlock(pdf_path, candidates, save)
+    metrics.incr('unlock_attempts', attempts)
+    metrics.incr('unlock_documents', result='unlocked' if success else 'failed')
+    return success, password, path
+
+
+def _try_unlock(pdf_path, candidates, save=True):
     try:
         with pikepdf.open(pdf_path) as pdf:
-            return True, None, pdf_path
+            return True, None, pdf_path, 0
     except Exception:
         # Likely encrypted; we'll attempt candidates.
         pass
 
-    for pw in candidates:
+    for attempts, pw in enumerate(candidates, 1):
         try:
             with pikepdf.open(pdf_path, password=pw) as pdf:
+                if not save:
+                    return True, pw, pdf_path, attempts
                 tmp_fd, tmp_path = tempfile.mkstemp(suffix='.pdf')
                 os.close(tmp_fd)
                 pdf.save(tmp_path)
-                return True, pw, tmp_path
+                return True, pw, tmp_path, attempts
         except Exception:
             continue
 
-    return False, None, None
+    return False, None, None, len(candidates)
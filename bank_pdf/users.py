@@ -0,0 +1,326 @@
+"""User records: schema, DOB/mobile normalization and bulk import into users.db.
+
+Only the standard library is used here so both the Flask UI server and the CLI
+can import it without pulling in any PDF dependencies.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sqlite3
+import sys
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .generator import password_features
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# Shared by the CLI, the Flask UI server and the Gmail service
+DEFAULT_DB_PATH = os.environ.get('BANK_PDF_DB') or os.path.join(REPO_ROOT, 'users.db')
+
+# Canonical DOB format stored in users.dob (matches what the CLI expects)
+DOB_FORMAT = '%d-%m-%Y'
+_DOB_FORMATS = [
+    '%d-%m-%Y', '%d/%m/%Y', '%Y-%m-%d', '%Y/%m/%d', '%d %b %Y', '%d %B %Y', '%d.%m.%Y', '%d %m %Y',
+    '%Y%m%d', '%d%m%Y',
+]
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    """Create the users / user_banks tables if they do not exist yet."""
+    c = conn.cursor()
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id TEXT PRIMARY KEY,
+        full_name TEXT,
+        dob TEXT,
+        mobile TEXT
+    )
+    ''')
+    # Older DBs predate the precomputed password features column
+    c.execute("PRAGMA table_info('users')")
+    cols = [r[1] for r in c.fetchall()]
+    if 'pw_features' not in cols:
+        c.execute('ALTER TABLE users ADD COLUMN pw_features TEXT')
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS user_banks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        bank_name TEXT NOT NULL,
+        first_seen_at TEXT DEFAULT (datetime('now')),
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    )
+    ''')
+    c.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_user_bank_unique
+    ON user_banks (user_id, bank_name)
+    ''')
+    conn.commit()
+
+
+def _digits(value: Any) -> str:
+    return ''.join(ch for ch in str(value or '') if ch.isdigit())
+
+
+def normalize_dob(value: Any, formats: Optional[List[str]] = None) -> Optional[str]:
+    """Return `value` as dd-mm-yyyy, or None if it is not a recognisable date.
+
+    `formats` is tried in order; callers normalizing many rows pass a list whose
+    head is the format that matched last, so a file written in one format costs
+    a single strptime per row.
+    """
+    if not value:
+        return None
+    value = str(value).strip()
+    formats = formats if formats is not None else _DOB_FORMATS
+    for i, fmt in enumerate(formats):
+        try:
+            dt = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if i and formats is not _DOB_FORMATS:
+            # Move the winning format to the front for the next row
+            formats.insert(0, formats.pop(i))
+        return dt.strftime(DOB_FORMAT)
+    return None
+
+
+def normalize_mobile(value: Any) -> Optional[str]:
+    """Return an Indian mobile as 10 digits, dropping a +91 / 0 prefix.
+
+    Other numbers of 7-15 digits (international ones) are kept as '+' and
+    their digits when written with a leading + or 00, as digits otherwise.
+    None only when there are too few or too many digits to be a phone number.
+    """
+    raw = str(value or '').strip()
+    digits = _digits(raw)
+    international = raw.startswith('+') or raw.startswith('00')
+    if raw.startswith('00'):
+        digits = digits[2:]
+    if len(digits) == 12 and digits.startswith('91'):
+        return digits[2:]
+    if len(digits) == 11 and digits.startswith('0') and not international:
+        return digits[1:]
+    if len(digits) == 10 and not international:
+        return digits
+    if 7 <= len(digits) <= 15:
+        return ('+' if international else '') + digits
+    return None
+
+
+def features_json(full_name: str, dob: str, mobile: str) -> str:
+    """Serialized `password_features` for a normalized user, stored in users.pw_features."""
+    return json.dumps(password_features(full_name, mobile, dob), separators=(',', ':'))
+
+
+def load_features(value: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Parse a users.pw_features value; None when missing or unreadable."""
+    if not value:
+        return None
+    try:
+        return json.loads(value)
+    except ValueError:
+        return None
+
+
+class _InvalidRecord:
+    """An input line that could not be parsed; stands in for it to keep row numbers aligned."""
+
+    def __init__(self, error: str):
+        self.error = error
+
+
+def normalize_users(rows: Iterable[Dict[str, Any]], start: int = 0) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Validate and normalize a batch of user dicts in one pass.
+
+    Returns (clean_rows, errors). Each error is {'row': <index>, 'error': <message>}
+    where the index counts from `start`.
+    """
+    formats = list(_DOB_FORMATS)
+    clean, errors = [], []
+    for idx, row in enumerate(rows, start):
+        if isinstance(row, _InvalidRecord):
+            errors.append({'row': idx, 'error': row.error})
+            continue
+        if not isinstance(row, dict):
+            errors.append({'row': idx, 'error': 'not a JSON object'})
+            continue
+        full_name = str(row.get('full_name') or '').strip()
+        if not full_name or not row.get('dob') or not row.get('mobile'):
+            errors.append({'row': idx, 'error': 'missing required fields'})
+            continue
+        dob = normalize_dob(row.get('dob'), formats)
+        if dob is None:
+            errors.append({'row': idx, 'error': f"unrecognised dob: {row.get('dob')!r}"})
+            continue
+        mobile = normalize_mobile(row.get('mobile'))
+        if mobile is None:
+            errors.append({'row': idx, 'error': f"invalid mobile: {row.get('mobile')!r}"})
+            continue
+        banks = row.get('banks') or []
+        if isinstance(banks, str):
+            banks = banks.split(';')
+        elif not isinstance(banks, list):
+            banks = [banks]
+        clean.append({
+            'user_id': str(row.get('user_id') or uuid.uuid4()),
+            'full_name': full_name,
+            'dob': dob,
+            'mobile': mobile,
+            'banks': [str(b).strip().lower() for b in banks if b and str(b).strip()],
+            'pw_features': features_json(full_name, dob, mobile),
+        })
+    return clean, errors
+
+
+def iter_user_records(stream: Iterable[str], fmt: str = 'csv') -> Iterator[Dict[str, Any]]:
+    """Yield user dicts from a text stream of CSV (with header) or JSON lines."""
+    if fmt == 'csv':
+        for row in csv.DictReader(stream):
+            yield row
+        return
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            # keep row numbering aligned; normalize_users reports it as invalid
+            yield _InvalidRecord(f'invalid JSON: {e}')
+
+
+def import_users(conn: sqlite3.Connection, records: Iterable[Dict[str, Any]], batch_size: int = 5000) -> Dict[str, Any]:
+    """Insert `records` into users (and user_banks) in batched transactions.
+
+    Records are consumed lazily, so the input can be a stream of any length.
+    Returns {'inserted': n, 'skipped': n, 'errors': [...]}; rows whose user_id
+    already exists are counted as skipped.
+    """
+    if batch_size < 1:
+        raise ValueError('batch_size must be at least 1')
+    ensure_schema(conn)
+    c = conn.cursor()
+    summary: Dict[str, Any] = {'inserted': 0, 'skipped': 0, 'errors': []}
+
+    def _flush(batch, start):
+        clean, errors = normalize_users(batch, start)
+        summary['errors'].extend(errors)
+        if not clean:
+            return
+        before = conn.total_changes
+        c.executemany(
+            'INSERT OR IGNORE INTO users (user_id, full_name, dob, mobile, pw_features) VALUES (?, ?, ?, ?, ?)',
+            [(u['user_id'], u['full_name'], u['dob'], u['mobile'], u['pw_features']) for u in clean]
+        )
+        inserted = conn.total_changes - before
+        c.executemany(
+            'INSERT OR IGNORE INTO user_banks (user_id, bank_name) VALUES (?, ?)',
+            [(u['user_id'], b) for u in clean for b in u['banks']]
+        )
+        conn.commit()
+        summary['inserted'] += inserted
+        summary['skipped'] += len(clean) - inserted
+
+    batch: List[Dict[str, Any]] = []
+    start = 0
+    for rec in records:
+        batch.append(rec)
+        if len(batch) >= batch_size:
+            _flush(batch, start)
+            start += len(batch)
+            batch = []
+    if batch:
+        _flush(batch, start)
+    return summary
+
+
+def backfill_features(conn: sqlite3.Connection, batch_size: int = 5000) -> Dict[str, int]:
+    """Normalize dob/mobile and fill pw_features for users registered before it existed.
+
+    Rows whose DOB or mobile cannot be normalized keep their stored values and
+    only get features computed from them as-is.
+    """
+    ensure_schema(conn)
+    c = conn.cursor()
+    summary = {'updated': 0, 'unnormalized': 0}
+    while True:
+        # Every processed row gets pw_features set, so re-querying makes progress
+        c.execute('SELECT user_id, full_name, dob, mobile FROM users WHERE pw_features IS NULL LIMIT ?', (batch_size,))
+        rows = c.fetchall()
+        if not rows:
+            break
+        formats = list(_DOB_FORMATS)
+        updates = []
+        for user_id, full_name, dob, mobile in rows:
+            norm_dob = normalize_dob(dob, formats)
+            norm_mobile = normalize_mobile(mobile)
+            if norm_dob is None or norm_mobile is None:
+                summary['unnormalized'] += 1
+            dob = norm_dob or dob
+            mobile = norm_mobile or mobile
+            updates.append((dob, mobile, features_json(full_name, dob, mobile), user_id))
+        c.executemany('UPDATE users SET dob = ?, mobile = ?, pw_features = ? WHERE user_id = ?', updates)
+        conn.commit()
+        summary['updated'] += len(updates)
+    return summary
+
+
+def _batch_size(value: str) -> int:
+    size = int(value)
+    if size < 1:
+        raise argparse.ArgumentTypeError('must be at least 1')
+    return size
+
+
+def backfill_main(argv=None):
+    parser = argparse.ArgumentParser(prog='backfill-users', description='Precompute normalized DOB/mobile and password features for existing users')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help='Path to users.db (default: repo root users.db)')
+    parser.add_argument('--batch-size', type=_batch_size, default=5000, help='Rows per transaction (default: 5000)')
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        summary = backfill_features(conn, args.batch_size)
+    finally:
+        conn.close()
+    print(f"Backfilled {summary['updated']} users ({summary['unnormalized']} with unrecognised dob/mobile kept as-is)")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='import-users', description='Bulk import users from a CSV or JSONL file')
+    parser.add_argument('path', help="CSV (header: full_name,dob,mobile[,user_id,banks]) or JSONL file; '-' for stdin")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default=None, help='Input format (default: from file extension)')
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help='Path to users.db (default: repo root users.db)')
+    parser.add_argument('--batch-size', type=_batch_size, default=5000, help='Rows per transaction (default: 5000)')
+    parser.add_argument('--errors-out', default='', help='Optional path to write per-row errors as JSON')
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ('jsonl' if args.path.lower().endswith(('.jsonl', '.ndjson')) else 'csv')
+    if args.path == '-':
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+    else:
+        stream = open(args.path, 'r', encoding='utf-8', newline='')
+
+    conn = sqlite3.connect(args.db)
+    try:
+        summary = import_users(conn, iter_user_records(stream, fmt), args.batch_size)
+    finally:
+        conn.close()
+        if args.path != '-':
+            stream.close()
+
+    print(f"Imported {summary['inserted']} users ({summary['skipped']} already present, {len(summary['errors'])} errors)")
+    for err in summary['errors'][:10]:
+        print(f"  row {err['row']}: {err['error']}")
+    if args.errors_out:
+        with open(args.errors_out, 'w', encoding='utf-8') as f:
+            json.dump(summary['errors'], f, indent=2)
+    return summary
+
+
+if __name__ == '__main__':
+    main()
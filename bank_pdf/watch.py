@@ -0,0 +1,340 @@
+"""Watch-folder daemon: process statements as they land in temp_pdfs.
+
+    python main.py watch                      # runs until Ctrl+C
+    python main.py watch --once               # process what is there now, then exit
+
+The Gmail service writes attachments into temp_pdfs and records the owner in
+`user_attachments`; the watcher picks each new file up within seconds instead
+of waiting for a full `batch` rescan. Directory changes come from inotify
+(`pip install inotify_simple`, Linux) or, without it, from polling.
+
+A file is handled once its size and mtime have not changed for `--settle`
+seconds and it ends with a PDF trailer, so half-written downloads are not
+read. What was processed is remembered in the `watched_files` table (size,
+mtime and SHA-256): restarts, touches and re-downloads of identical content
+are skipped. Jobs run in a long-lived worker pool shared with `batch`, so
+imports and candidate caches stay warm; results are stored and indexed the
+same way.
+"""
+import argparse
+import hashlib
+import os
+import signal
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from . import batch, memory, metrics, search, store, users
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except Exception:
+    INotify = None
+
+# Only the end of the file is read to check for the trailer
+_TRAILER_BYTES = 2048
+# How often files without a user_attachments row are looked up again
+_ASSIGN_RETRY = 5.0
+# A file that stays unchanged this long is read even without a trailer
+_TRAILER_GRACE = 30.0
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS watched_files (
+        path TEXT PRIMARY KEY,
+        size INTEGER,
+        mtime_ns INTEGER,
+        sha256 TEXT,
+        status TEXT,
+        processed_at TEXT DEFAULT (datetime('now'))
+    )
+    ''')
+    conn.commit()
+
+
+def file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def looks_complete(path: str) -> bool:
+    """True if the file ends with a PDF %%EOF marker (a finished write)."""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - _TRAILER_BYTES))
+            return b'%%EOF' in f.read()
+    except OSError:
+        return False
+
+
+def _scan(directory: str) -> Dict[str, Tuple[int, int]]:
+    """PDFs in `directory` with (size, mtime_ns); empty while the directory is missing."""
+    out = {}
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    if entry.is_file() and entry.name.lower().endswith('.pdf'):
+                        st = entry.stat()
+                        out[os.path.abspath(entry.path)] = (st.st_size, st.st_mtime_ns)
+                except FileNotFoundError:
+                    continue
+    except FileNotFoundError:
+        # The directory was removed (it is recreated by the Gmail service)
+        pass
+    return out
+
+
+class Watcher:
+    def __init__(self, pdfs_dir: str, db_path: str, workers: int = 0, settle: float = 2.0, poll: float = 2.0,
+                 rescan: float = 60.0, max_candidates: int = 200, ocr: bool = False, limit_pages: Optional[int] = None,
+                 use_inotify: bool = True, memory_limit: int = 0):
+        self.pdfs_dir = os.path.abspath(pdfs_dir)
+        self.db_path = db_path
+        self.workers = workers or os.cpu_count() or 1
+        self.settle = settle
+        self.poll = poll
+        self.rescan = rescan
+        self.memory_limit = memory_limit
+        self.job_args = (max_candidates, ocr, limit_pages, memory_limit)
+        self.use_inotify = use_inotify and INotify is not None
+
+        self.known: Dict[str, Tuple[int, int, str]] = {}      # path -> (size, mtime_ns, sha256) already handled
+        self.pending: Dict[str, list] = {}                    # path -> [size, mtime_ns, last change time]
+        self.unassigned: Dict[str, float] = {}                # path -> next lookup time
+        self.inflight: Dict[Any, Tuple[str, int, int, str]] = {}  # future -> (path, size, mtime_ns, sha256)
+        self.processed = 0
+
+    # -- state ---------------------------------------------------------------
+
+    def _load_known(self) -> None:
+        for path, size, mtime_ns, sha in self.conn.execute('SELECT path, size, mtime_ns, sha256 FROM watched_files'):
+            self.known[path] = (size, mtime_ns, sha)
+
+    def _remember(self, path: str, size: int, mtime_ns: int, sha: str, status: Optional[str]) -> None:
+        """Record a handled file; status None keeps the stored status (content unchanged)."""
+        self.known[path] = (size, mtime_ns, sha)
+        if status is None:
+            self.conn.execute('UPDATE watched_files SET size = ?, mtime_ns = ? WHERE path = ?', (size, mtime_ns, path))
+            self.conn.commit()
+            return
+        self.conn.execute(
+            'INSERT INTO watched_files (path, size, mtime_ns, sha256, status) VALUES (?, ?, ?, ?, ?) '
+            "ON CONFLICT(path) DO UPDATE SET size=excluded.size, mtime_ns=excluded.mtime_ns, sha256=excluded.sha256, "
+            "status=excluded.status, processed_at=datetime('now')",
+            (path, size, mtime_ns, sha, status)
+        )
+        self.conn.commit()
+
+    # -- change detection ----------------------------------------------------
+
+    def observe(self, path: str, size: int, mtime_ns: int) -> None:
+        known = self.known.get(path)
+        if known and known[:2] == (size, mtime_ns):
+            return
+        entry = self.pending.get(path)
+        if entry is None or (entry[0], entry[1]) != (size, mtime_ns):
+            # New or still being written: restart its settle timer. Files last
+            # written longer ago than that (e.g. found at startup) are settled already.
+            age = time.time() - mtime_ns / 1e9
+            self.pending[path] = [size, mtime_ns, time.monotonic() - (self.settle if age >= self.settle else 0)]
+
+    def _observe_path(self, path: str) -> None:
+        try:
+            st = os.stat(path)
+        except OSError:
+            self.pending.pop(path, None)
+            self.unassigned.pop(path, None)
+            return
+        self.observe(path, st.st_size, st.st_mtime_ns)
+
+    def scan(self) -> None:
+        for path, (size, mtime_ns) in _scan(self.pdfs_dir).items():
+            self.observe(path, size, mtime_ns)
+
+    # -- dispatch ------------------------------------------------------------
+
+    def _settled(self):
+        now = time.monotonic()
+        busy = {p for p, *_ in self.inflight.values()}
+        for path, (size, mtime_ns, changed_at) in list(self.pending.items()):
+            if path in busy or now - changed_at < self.settle:
+                continue
+            if path in self.unassigned and now < self.unassigned[path]:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                self.pending[path] = [st.st_size, st.st_mtime_ns, now]
+                continue
+            if not looks_complete(path) and now - changed_at < max(_TRAILER_GRACE, self.settle):
+                # Size looked stable but the trailer is missing: give the writer more time
+                continue
+            yield path, size, mtime_ns
+
+    def dispatch(self, pool) -> None:
+        for path, size, mtime_ns in list(self._settled()):
+            if len(self.inflight) >= self.workers * batch.INFLIGHT_PER_WORKER:
+                # The rest stay pending until the workers catch up
+                break
+            try:
+                sha = file_hash(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            known = self.known.get(path)
+            if known and known[2] == sha:
+                # Touched or re-downloaded with the same content
+                self._remember(path, size, mtime_ns, sha, None)
+                del self.pending[path]
+                continue
+            jobs = batch.load_jobs(self.db_path, paths=[path])
+            if not jobs:
+                if path not in self.unassigned:
+                    print(f'  {os.path.basename(path)}: no user_attachments row yet, will retry')
+                self.unassigned[path] = time.monotonic() + _ASSIGN_RETRY
+                continue
+            self.unassigned.pop(path, None)
+            del self.pending[path]
+            fut = pool.submit(batch._process_job, jobs[0], *self.job_args)
+            self.inflight[fut] = (path, size, mtime_ns, sha)
+
+    def collect(self) -> None:
+        for fut in [f for f in self.inflight if f.done()]:
+            path, size, mtime_ns, sha = self.inflight.pop(fut)
+            try:
+                out = fut.result()
+            except Exception as e:
+                print(f'  {os.path.basename(path)}: worker failed: {e}')
+                continue
+            job, result = out['job'], out['result']
+            metrics.merge(out['metrics'])
+            batch.record_result(self.conn, self.db_path, job, result)
+            self._remember(path, size, mtime_ns, sha, 'error' if result.get('error') else 'ok')
+            self.processed += 1
+            if result.get('error'):
+                print(f"  [{job['user_id']}] {os.path.basename(path)}: {result['error']}")
+            else:
+                print(f"  [{job['user_id']}] {os.path.basename(path)}: "
+                      f"{result.get('num_pages', 0)} pages in {out['elapsed']:.2f}s")
+
+    # -- main loop -----------------------------------------------------------
+
+    def _add_watch(self, notifier) -> Optional[int]:
+        """Watch descriptor for the PDFs directory, or None while it does not exist."""
+        try:
+            return notifier.add_watch(self.pdfs_dir, inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO
+                                      | inotify_flags.CREATE | inotify_flags.MODIFY | inotify_flags.DELETE
+                                      | inotify_flags.DELETE_SELF | inotify_flags.MOVE_SELF)
+        except OSError:
+            return None
+
+    def _busy(self) -> bool:
+        return bool(self.pending or self.inflight)
+
+    def _drained(self) -> bool:
+        """Nothing left that can make progress without a new user_attachments row."""
+        return not self.inflight and all(p in self.unassigned for p in self.pending)
+
+    def run(self, once: bool = False) -> int:
+        """Watch until interrupted (or, with `once`, until the current files are done)."""
+        os.makedirs(self.pdfs_dir, exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path)
+        store.ensure_schema(self.conn)
+        search.ensure_schema(self.conn)
+        ensure_schema(self.conn)
+        self._load_known()
+
+        notifier = None
+        wd = None
+        if self.use_inotify and not once:
+            notifier = INotify()
+            wd = self._add_watch(notifier)
+        mode = 'inotify' if notifier else f'polling every {self.poll:g}s'
+        print(f'Watching {self.pdfs_dir} ({mode}, settle {self.settle:g}s, {self.workers} workers)')
+
+        self.scan()
+        last_scan = time.monotonic()
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=memory.apply_ceiling,
+                                     initargs=(self.memory_limit,)) as pool:
+                while True:
+                    self.dispatch(pool)
+                    self.collect()
+                    if once and self._drained():
+                        break
+                    # Wake often while something is settling or running, otherwise block
+                    timeout = min(0.5, self.settle / 2) if self._busy() or self.unassigned else self.rescan
+                    if notifier:
+                        if wd is None:
+                            # The directory was deleted: watch it again once it is back,
+                            # and pick up anything written before the watch was
+                            timeout = min(timeout, 0.5)
+                            wd = self._add_watch(notifier)
+                            if wd is not None:
+                                self.scan()
+                                last_scan = time.monotonic()
+                        for event in notifier.read(timeout=int(timeout * 1000)):
+                            if event.mask & (inotify_flags.IGNORED | inotify_flags.DELETE_SELF | inotify_flags.MOVE_SELF):
+                                if event.wd == wd:
+                                    wd = None
+                                continue
+                            if event.wd == wd and event.name.lower().endswith('.pdf'):
+                                self._observe_path(os.path.join(self.pdfs_dir, event.name))
+                        if time.monotonic() - last_scan >= self.rescan:
+                            # Safety net for events dropped on queue overflow
+                            self.scan()
+                            last_scan = time.monotonic()
+                    else:
+                        time.sleep(min(timeout, self.poll))
+                        if time.monotonic() - last_scan >= self.poll:
+                            self.scan()
+                            last_scan = time.monotonic()
+        except KeyboardInterrupt:
+            print('Stopping watcher')
+        finally:
+            if notifier:
+                notifier.close()
+            self.conn.close()
+        return self.processed
+
+
+def _stop(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='watch', description='Process new statements as they appear in the PDFs directory')
+    parser.add_argument('--pdfs-dir', default='temp_pdfs', help='Directory to watch (relative paths are under the repo root; default: temp_pdfs)')
+    parser.add_argument('--settle', type=float, default=2.0, help='Seconds a file must stay unchanged before it is read (default: 2)')
+    parser.add_argument('--poll', type=float, default=2.0, help='Polling interval when inotify is not available (default: 2)')
+    parser.add_argument('--rescan', type=float, default=60.0, help='Full directory rescan interval in inotify mode (default: 60)')
+    parser.add_argument('--no-inotify', action='store_true', help='Poll even if inotify_simple is installed')
+    parser.add_argument('--once', action='store_true', help='Process new/changed files present now, then exit')
+    parser.add_argument('--workers', type=int, default=0, help='Worker processes (default: CPU count)')
+    parser.add_argument('--max-candidates', type=int, default=200, help='Max password candidates to try')
+    parser.add_argument('--ocr', action='store_true', help='Force OCR pass when no extractable text is found')
+    parser.add_argument('--limit-pages', type=int, default=None, help='Limit pages to inspect/ocr (default: all)')
+    parser.add_argument('--db', default=users.DEFAULT_DB_PATH, help='Path to users.db (default: repo root users.db)')
+    parser.add_argument('--memory-limit', type=int, default=None, help='Per-worker memory budget in MB: large PDFs are processed in page chunks under it (default: BANK_PDF_MEMORY_LIMIT_MB, else none)')
+    args = parser.parse_args(argv)
+    if args.memory_limit is None:
+        args.memory_limit = memory.MEMORY_LIMIT_MB
+
+    pdfs_dir = args.pdfs_dir if os.path.isabs(args.pdfs_dir) else os.path.join(users.REPO_ROOT, args.pdfs_dir)
+    watcher = Watcher(pdfs_dir, args.db, args.workers, args.settle, args.poll, args.rescan,
+                      args.max_candidates, args.ocr, args.limit_pages, use_inotify=not args.no_inotify,
+                      memory_limit=args.memory_limit)
+    # Stop cleanly under service managers too (they send SIGTERM)
+    signal.signal(signal.SIGTERM, _stop)
+    processed = watcher.run(once=args.once)
+    print(f'Processed {processed} documents')
@@ -0,0 +1,381 @@
+"""Warm worker: a long-lived process that runs CLI jobs with everything imported.
+
+Cron-driven runs otherwise pay for importing pikepdf, PyPDF2, pdfminer and
+requests (and for loading .env) on every invocation. Start a worker once:
+
+    python main.py worker                        # listens on DEFAULT_ADDRESS
+    python main.py worker --idle-timeout 3600    # exit after an hour without jobs
+
+and point CLI runs at it with the BANK_PDF_WORKER environment variable (a
+socket path or host:port, or '1' for the default address):
+
+    BANK_PDF_WORKER=1 python main.py --pdfs-dir temp_pdfs
+
+If no worker is listening the CLI simply runs the job itself.
+
+The client also sends its GEMINI_API_KEY / GEMINI_ENDPOINT, which the job
+uses instead of the worker's, and its BANK_PDF_* settings. Those are read
+when modules are imported, so a job whose settings differ from the worker's
+is declined and the CLI runs it itself.
+
+The socket (and token file) live in a directory only this user can use:
+$XDG_RUNTIME_DIR, else a 0700 `bank_pdf_worker_<uid>` directory in the temp
+directory, checked to be owned by this user and closed to others. Before
+sending anything the client checks that the listener runs as the same user
+(SO_PEERCRED, else the owner of the socket file), so another local user
+cannot pose as the worker and receive the client's GEMINI_API_KEY.
+
+Where Unix sockets are not available the worker listens on 127.0.0.1:8766.
+Any local process could connect to that port, so TCP jobs must carry a
+shared token: BANK_PDF_WORKER_TOKEN if set in both environments, otherwise
+a random one the worker writes to a user-only file in that directory. The
+client only uses a token file owned by this user and unreadable to others.
+
+Protocol: the client sends one JSON line {"argv": [...], "cwd": "...",
+"env": {...}, "token": "..."}; the worker answers with JSON lines
+{"out": text} / {"err": text} as the job prints, then {"exit": code}, or
+just {"reject": reason}. Jobs run one at a time in the worker process.
+"""
+import argparse
+import hmac
+import io
+import json
+import os
+import secrets
+import socket
+import stat
+import struct
+import sys
+import tempfile
+import time
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+from typing import Dict, List, Optional
+
+_UID = os.getuid() if hasattr(os, 'getuid') else None
+# Per-user directory for the socket and the token file (see `_private_dir`)
+PRIVATE_DIR = os.environ.get('XDG_RUNTIME_DIR') or os.path.join(tempfile.gettempdir(), f'bank_pdf_worker_{_UID or 0}')
+if hasattr(socket, 'AF_UNIX'):
+    DEFAULT_ADDRESS = os.path.join(PRIVATE_DIR, 'bank_pdf_worker.sock')
+else:
+    DEFAULT_ADDRESS = '127.0.0.1:8766'
+# How long a client waits to connect before running the job itself
+CONNECT_TIMEOUT = 0.5
+TOKEN_ENV = 'BANK_PDF_WORKER_TOKEN'
+# Read by the job when it needs them, so each job gets the client's values
+JOB_ENV = ('GEMINI_API_KEY', 'GEMINI_ENDPOINT')
+# Client-side settings that say nothing about how a job runs
+_NOT_FORWARDED = ('BANK_PDF_WORKER', TOKEN_ENV)
+
+# Set by `warm_up`: the worker's BANK_PDF_* settings and the .env values
+_settings: Dict[str, str] = {}
+_dotenv: Dict[str, str] = {}
+
+
+class UntrustedWorker(RuntimeError):
+    """The socket, token or their directory could belong to another user."""
+
+
+def _owned(st: os.stat_result) -> bool:
+    """Owned by this user and closed to group and others (always true without uids)."""
+    return _UID is None or (st.st_uid == _UID and not st.st_mode & 0o077)
+
+
+def _private_dir() -> str:
+    """PRIVATE_DIR, created 0700 if missing; raises UntrustedWorker unless it is ours alone."""
+    try:
+        os.mkdir(PRIVATE_DIR, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(PRIVATE_DIR)
+    if not stat.S_ISDIR(st.st_mode) or not _owned(st):
+        raise UntrustedWorker(f'{PRIVATE_DIR} is not a directory owned by this user and closed to others')
+    return PRIVATE_DIR
+
+
+def _resolve(address: Optional[str]) -> str:
+    address = address or os.environ.get('BANK_PDF_WORKER', '')
+    if address not in ('', '1', 'true', 'yes'):
+        return address
+    if not _is_tcp(DEFAULT_ADDRESS):
+        _private_dir()
+    return DEFAULT_ADDRESS
+
+
+def _is_tcp(address: str) -> bool:
+    host, sep, port = address.rpartition(':')
+    return bool(sep and host and port.isdigit())
+
+
+def _token_path(address: str) -> str:
+    return os.path.join(_private_dir(), 'bank_pdf_worker_%s.token' % address.replace(':', '_'))
+
+
+def _client_token(address: str) -> Optional[str]:
+    """The shared token, from the environment or the worker's token file if that is ours alone."""
+    if os.environ.get(TOKEN_ENV):
+        return os.environ[TOKEN_ENV]
+    try:
+        fd = os.open(_token_path(address), os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+    except OSError:
+        return None
+    with os.fdopen(fd, 'r', encoding='ascii') as f:
+        if not _owned(os.fstat(fd)):
+            raise UntrustedWorker(f'{_token_path(address)} is not owned by this user alone')
+        return f.read().strip()
+
+
+def _write_token(address: str) -> str:
+    token = os.environ.get(TOKEN_ENV) or secrets.token_hex(32)
+    path = _token_path(address)
+    if os.path.exists(path):
+        os.remove(path)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'w', encoding='ascii') as f:
+        f.write(token)
+    return token
+
+
+def _forwarded_env() -> Dict[str, str]:
+    """The client environment a job depends on."""
+    return {k: v for k, v in os.environ.items()
+            if k in JOB_ENV or (k.startswith('BANK_PDF_') and k not in _NOT_FORWARDED)}
+
+
+def _mismatched_settings(env: Dict[str, str]) -> List[str]:
+    """BANK_PDF_* settings whose value for the client (its env, else .env) differs from the worker's."""
+    keys = {k for k in set(env) | set(_settings) if k.startswith('BANK_PDF_')}
+    return sorted(k for k in keys if env.get(k, _dotenv.get(k)) != _settings.get(k))
+
+
+def _connect(address: str, timeout: Optional[float]) -> socket.socket:
+    if _is_tcp(address):
+        host, _, port = address.rpartition(':')
+        return socket.create_connection((host, int(port)), timeout=timeout)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(address)
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+def _peer_uid(sock: socket.socket, address: str) -> Optional[int]:
+    """The uid the worker at the other end of a Unix socket runs as, or None if unknown."""
+    if hasattr(socket, 'SO_PEERCRED'):
+        pid, uid, gid = struct.unpack('3i', sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))
+        return uid
+    try:
+        # The socket file belongs to whoever bound it
+        return os.lstat(address).st_uid
+    except OSError:
+        return None
+
+
+def _listen(address: str) -> socket.socket:
+    if _is_tcp(address):
+        host, _, port = address.rpartition(':')
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, int(port)))
+    else:
+        if os.path.exists(address):
+            try:
+                with _connect(address, CONNECT_TIMEOUT) as other:
+                    ours = _UID is None or _peer_uid(other, address) == _UID
+            except OSError:
+                os.remove(address)  # stale socket from a worker that died
+            else:
+                if not ours:
+                    raise UntrustedWorker(f'another user is listening on {address}')
+                raise RuntimeError(f'a worker is already listening on {address}')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(address)
+        # Jobs can read users.db and write decrypted PDFs: owner only
+        os.chmod(address, 0o600)
+    sock.listen(8)
+    return sock
+
+
+def submit(argv: List[str], address: Optional[str] = None) -> Optional[int]:
+    """Run `argv` on the worker, relaying its output here.
+
+    Returns the job's exit code, or None if no worker is reachable (the caller
+    should then run the job itself).
+    """
+    try:
+        address = _resolve(address)
+        token = _client_token(address) if _is_tcp(address) else None
+    except UntrustedWorker as e:
+        print(f'Not using the worker: {e}', file=sys.stderr)
+        return None
+    if _is_tcp(address) and not token:
+        return None
+    try:
+        sock = _connect(address, CONNECT_TIMEOUT)
+    except OSError:
+        return None
+    with sock:
+        if not _is_tcp(address) and _UID is not None and _peer_uid(sock, address) != _UID:
+            print(f'Not using the worker: {address} is served by another user', file=sys.stderr)
+            return None
+        # Only now that the worker is known to be ours does it get the client's key
+        request = {'argv': list(argv), 'cwd': os.getcwd(), 'env': _forwarded_env()}
+        if token:
+            request['token'] = token
+        sock.settimeout(None)
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        for line in sock.makefile('r', encoding='utf-8'):
+            msg = json.loads(line)
+            if 'reject' in msg:
+                print(f"Worker declined the job ({msg['reject']}); running it here", file=sys.stderr)
+                return None
+            if 'out' in msg:
+                sys.stdout.write(msg['out'])
+                sys.stdout.flush()
+            elif 'err' in msg:
+                sys.stderr.write(msg['err'])
+                sys.stderr.flush()
+            elif 'exit' in msg:
+                return msg['exit']
+    # Worker went away mid-job
+    return 1
+
+
+class _Relay(io.TextIOBase):
+    """Text stream that forwards every write to the client as a JSON line."""
+
+    def __init__(self, wfile, key: str):
+        self._wfile = wfile
+        self._key = key
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        if s:
+            self._wfile.write(json.dumps({self._key: s}, ensure_ascii=False) + '\n')
+            self._wfile.flush()
+        return len(s)
+
+
+def warm_up() -> None:
+    """Import everything a CLI run needs, once."""
+    from . import analysis, extractor, unlocker  # noqa: F401
+    from .backends import BACKENDS
+    for backend in BACKENDS.values():
+        backend.available()
+    extractor._ocr_tools()
+    global _settings, _dotenv
+    try:
+        from dotenv import dotenv_values, find_dotenv, load_dotenv
+        load_dotenv()
+        _dotenv = {k: v for k, v in dotenv_values(find_dotenv()).items() if v is not None}
+    except Exception:
+        pass
+    _settings = {k: v for k, v in _forwarded_env().items() if k not in JOB_ENV}
+
+
+def _rejection(request: Dict, token: Optional[str]) -> Optional[str]:
+    if token is not None and not hmac.compare_digest(str(request.get('token') or ''), token):
+        return 'invalid token'
+    mismatched = _mismatched_settings(request.get('env') or {})
+    if mismatched:
+        return 'settings differ from the worker: ' + ', '.join(mismatched)
+    return None
+
+
+def _run_job(conn: socket.socket, token: Optional[str] = None) -> None:
+    from . import cli
+
+    rfile = conn.makefile('r', encoding='utf-8')
+    wfile = conn.makefile('w', encoding='utf-8')
+    request = json.loads(rfile.readline() or '{}')
+    reason = _rejection(request, token)
+    if reason:
+        wfile.write(json.dumps({'reject': reason}) + '\n')
+        wfile.close()
+        rfile.close()
+        return
+    env = request.get('env') or {}
+    saved = {k: os.environ.get(k) for k in JOB_ENV}
+    for k in JOB_ENV:
+        value = env.get(k, _dotenv.get(k))
+        if value is None:
+            os.environ.pop(k, None)
+        else:
+            os.environ[k] = value
+    cwd = os.getcwd()
+    code = 0
+    try:
+        with redirect_stdout(_Relay(wfile, 'out')), redirect_stderr(_Relay(wfile, 'err')):
+            try:
+                os.chdir(request.get('cwd') or cwd)
+                cli.main(list(request.get('argv') or []))
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+                if not isinstance(e.code, (int, type(None))):
+                    print(e.code, file=sys.stderr)
+            except Exception:
+                traceback.print_exc()
+                code = 1
+        wfile.write(json.dumps({'exit': code}) + '\n')
+        wfile.flush()
+    finally:
+        os.chdir(cwd)
+        for k, value in saved.items():
+            if value is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = value
+        rfile.close()
+        wfile.close()
+
+
+def serve(address: Optional[str] = None, idle_timeout: Optional[float] = None) -> None:
+    """Accept and run jobs until interrupted (or idle for `idle_timeout` seconds)."""
+    address = _resolve(address)
+    # Jobs run here must not hand themselves back to this worker
+    os.environ.pop('BANK_PDF_WORKER', None)
+    start = time.perf_counter()
+    warm_up()
+    print(f'Worker ready on {address} (warm-up {time.perf_counter() - start:.2f}s)')
+    sock = _listen(address)
+    token = _write_token(address) if _is_tcp(address) else None
+    sock.settimeout(idle_timeout)
+    jobs = 0
+    try:
+        while True:
+            try:
+                conn, _ = sock.accept()
+            except socket.timeout:
+                print(f'Idle for {idle_timeout:g}s, exiting')
+                break
+            with conn:
+                conn.settimeout(None)
+                started = time.perf_counter()
+                try:
+                    _run_job(conn, token)
+                except (OSError, ValueError) as e:
+                    # Client hung up or sent garbage; the worker keeps going
+                    print('Job failed:', e, file=sys.stderr)
+                jobs += 1
+                print(f'Job {jobs} done in {time.perf_counter() - started:.2f}s')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+        if not _is_tcp(address) and os.path.exists(address):
+            os.remove(address)
+        if token is not None and os.path.exists(_token_path(address)):
+            os.remove(_token_path(address))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='worker', description='Keep a warm process that runs CLI jobs handed to it via BANK_PDF_WORKER')
+    parser.add_argument('--address', default='', help=f'Unix socket path or host:port to listen on (default: {DEFAULT_ADDRESS})')
+    parser.add_argument('--idle-timeout', type=float, default=None, help='Exit after this many seconds without a job (default: never)')
+    args = parser.parse_args(argv)
+    serve(args.address or None, args.idle_timeout)
@@ -0,0 +1,160 @@
+"""Generate a synthetic corpus of encrypted bank statements for benchmarking.
+
+Two kinds of documents are produced:
+  - `text`: a real text layer (Helvetica content streams), like most e-statements
+  - `scanned`: pages rendered to images only, so extraction needs OCR
+
+Every PDF is encrypted with a password taken from the bank's own template list
+in `bank_pdf.generator`, so unlocking exercises the same candidate search as a
+real run. A `manifest.json` next to the PDFs records credentials and passwords.
+
+    python -m benchmarks.corpus --out benchmarks/corpus --docs 20 --pages 5
+"""
+import argparse
+import io
+import json
+import os
+import random
+from datetime import date, timedelta
+from typing import Any, Dict, List
+
+import pikepdf
+from pikepdf import Dictionary, Name
+
+from bank_pdf.generator import generate_password_candidates
+
+BANKS = ['hdfc', 'state bank of india', 'icici', 'bank of baroda', 'axis bank']
+FIRST_NAMES = ['Aarav', 'Priya', 'Rahul', 'Ananya', 'Vikram', 'Sneha', 'Arjun', 'Kavya']
+LAST_NAMES = ['Sharma', 'Patel', 'Iyer', 'Reddy', 'Gupta', 'Nair', 'Singh', 'Das']
+NARRATIONS = [
+    'UPI/SWIGGY/{ref}/Payment', 'UPI/ZOMATO/{ref}/Food order', 'POS {ref} AMAZON PAY INDIA',
+    'NEFT-{ref}-SALARY ACME CORP', 'IMPS/{ref}/RENT TRANSFER', 'ACH/NETFLIX/{ref}',
+    'UPI/UBER INDIA/{ref}/Ride', 'ATM WDL {ref} MUMBAI', 'UPI/BIGBASKET/{ref}/Groceries',
+]
+LINES_PER_PAGE = 45
+
+
+def _statement_lines(rng: random.Random, holder: str, bank: str, pages: int) -> List[List[str]]:
+    start = date(2024, 1, 1) + timedelta(days=rng.randrange(0, 300))
+    balance = rng.uniform(5000, 150000)
+    account = ''.join(rng.choice('0123456789') for _ in range(12))
+    out = []
+    for p in range(pages):
+        lines = []
+        if p == 0:
+            lines += [
+                f'{bank.upper()} - ACCOUNT STATEMENT',
+                f'Account holder: {holder}',
+                f'Account No: XXXXXXXX{account[-4:]}',
+                f'Statement period: {start:%d/%m/%Y} to {start + timedelta(days=30 * pages):%d/%m/%Y}',
+                'Date        Narration                                   Debit      Credit     Balance',
+            ]
+        while len(lines) < LINES_PER_PAGE:
+            start += timedelta(days=rng.choice([0, 0, 1, 2]))
+            narration = rng.choice(NARRATIONS).format(ref=rng.randrange(10 ** 11, 10 ** 12))
+            amount = round(rng.uniform(50, 8000), 2)
+            credit = narration.startswith('NEFT') and 'SALARY' in narration
+            balance += amount if credit else -amount
+            debit_col = '' if credit else f'{amount:,.2f}'
+            credit_col = f'{amount:,.2f}' if credit else ''
+            lines.append(f'{start:%d/%m/%Y}  {narration:<42} {debit_col:>10} {credit_col:>10} {balance:>12,.2f}')
+        out.append(lines)
+    return out
+
+
+def _escape(text: str) -> bytes:
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)').encode('latin-1', 'replace')
+
+
+def _text_pdf(pages: List[List[str]]) -> pikepdf.Pdf:
+    pdf = pikepdf.new()
+    font = pdf.make_indirect(Dictionary(Type=Name.Font, Subtype=Name.Type1, BaseFont=Name.Helvetica,
+                                        Encoding=Name.WinAnsiEncoding))
+    for lines in pages:
+        ops = [b'BT /F1 8 Tf 10 TL 36 806 Td']
+        ops += [b'(' + _escape(line) + b") '" for line in lines]
+        ops.append(b'ET')
+        page = Dictionary(
+            Type=Name.Page,
+            MediaBox=[0, 0, 595, 842],
+            Resources=Dictionary(Font=Dictionary(F1=font)),
+            Contents=pdf.make_stream(b'\n'.join(ops)),
+        )
+        pdf.pages.append(pikepdf.Page(page))
+    return pdf
+
+
+def _scanned_pdf(pages: List[List[str]], dpi: int = 150) -> pikepdf.Pdf:
+    from PIL import Image, ImageDraw
+
+    width, height = int(8.27 * dpi), int(11.69 * dpi)
+    images = []
+    for lines in pages:
+        img = Image.new('L', (width, height), 255)
+        draw = ImageDraw.Draw(img)
+        y = dpi // 2
+        for line in lines:
+            draw.text((dpi // 2, y), line, fill=0)
+            y += int(dpi * 0.2)
+        images.append(img)
+    buf = io.BytesIO()
+    images[0].save(buf, 'PDF', save_all=True, append_images=images[1:], resolution=dpi)
+    buf.seek(0)
+    return pikepdf.open(buf)
+
+
+def generate_corpus(out_dir: str, docs: int = 20, pages: int = 5, scanned_ratio: float = 0.25, seed: int = 7) -> Dict[str, Any]:
+    """Write `docs` encrypted statements to `out_dir` and return the manifest."""
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest: Dict[str, Any] = {'seed': seed, 'documents': []}
+    for i in range(docs):
+        full_name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+        phone = '9' + ''.join(rng.choice('0123456789') for _ in range(9))
+        dob = date(1960, 1, 1) + timedelta(days=rng.randrange(0, 365 * 40))
+        dob_str = f'{dob:%d-%m-%Y}'
+        bank = rng.choice(BANKS)
+        candidates = generate_password_candidates(full_name, phone, dob_str, bank)
+        # Spread the real password through the list so unlock cost varies per document
+        password = candidates[rng.randrange(0, len(candidates))]
+        kind = 'scanned' if rng.random() < scanned_ratio else 'text'
+
+        lines = _statement_lines(rng, full_name, bank, pages)
+        pdf = _text_pdf(lines) if kind == 'text' else _scanned_pdf(lines)
+        path = os.path.join(out_dir, f'{i:04d}_{kind}_{bank.replace(" ", "_")}.pdf')
+        pdf.save(path, encryption=pikepdf.Encryption(user=password, owner=password + '#', R=4))
+        pdf.close()
+
+        manifest['documents'].append({
+            'path': os.path.abspath(path), 'kind': kind, 'bank': bank, 'pages': pages,
+            'full_name': full_name, 'phone': phone, 'dob': dob_str, 'password': password,
+            'subject': f'Your {bank.upper()} account statement for {dob:%B}',
+            'sender': f'alerts@{bank.replace(" ", "")}.co.in',
+        })
+
+    with open(os.path.join(out_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_manifest(out_dir: str) -> Dict[str, Any]:
+    with open(os.path.join(out_dir, 'manifest.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic encrypted bank-statement corpus')
+    parser.add_argument('--out', default=os.path.join(os.path.dirname(__file__), 'corpus'), help='Output directory')
+    parser.add_argument('--docs', type=int, default=20, help='Number of statements to generate')
+    parser.add_argument('--pages', type=int, default=5, help='Pages per statement')
+    parser.add_argument('--scanned-ratio', type=float, default=0.25, help='Fraction of image-only statements')
+    parser.add_argument('--seed', type=int, default=7, help='Random seed (corpus is deterministic per seed)')
+    args = parser.parse_args(argv)
+
+    manifest = generate_corpus(args.out, args.docs, args.pages, args.scanned_ratio, args.seed)
+    kinds = [d['kind'] for d in manifest['documents']]
+    print(f"Wrote {len(kinds)} statements to {args.out} ({kinds.count('text')} text, {kinds.count('scanned')} scanned)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Check how long the CLI modules take to import, against a budget.
+
+    python -m benchmarks.importtime                       # bank_pdf.cli, default budget
+    python -m benchmarks.importtime --module bank_pdf.batch --budget-ms 80
+    python -m benchmarks.importtime --top 15              # also list the slowest imports
+
+Uses `python -X importtime` in a fresh interpreter per run and keeps the best
+of `--repeat` runs (import time is noisy). Exits non-zero if a module's
+cumulative import time exceeds its budget, so it can gate CI like
+`benchmarks.run --compare`.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Dict, List, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HERE)
+
+# Cumulative import time allowed per module, in milliseconds. The CLI itself
+# must stay light; the heavy PDF/OCR/HTTP libraries load on first use.
+BUDGETS_MS = {
+    'bank_pdf.cli': 60.0,
+}
+DEFAULT_BUDGET_MS = 60.0
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, float, float, int]]:
+    """(module, self_ms, cumulative_ms, depth) per line of `-X importtime` output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        # Nesting is shown as two spaces per level after the single separator space
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        rows.append((name.strip(), int(self_us) / 1000.0, int(cumulative_us) / 1000.0, depth))
+    return rows
+
+
+def measure(module: str) -> Dict[str, Any]:
+    """Import `module` in a fresh interpreter and return its import-time breakdown."""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=REPO_ROOT, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f'importing {module} failed:\n{proc.stderr[-2000:]}')
+    rows = parse_importtime(proc.stderr)
+    total = next((cum for name, _, cum, _ in rows if name == module), 0.0)
+    return {'module': module, 'total_ms': round(total, 2), 'imports': rows}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure module import time against a budget')
+    parser.add_argument('--module', action='append', help='Module to import (repeatable; default: bank_pdf.cli)')
+    parser.add_argument('--budget-ms', type=float, default=None, help=f'Budget for every module (default: per-module, else {DEFAULT_BUDGET_MS:g})')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per module; the fastest is kept')
+    parser.add_argument('--top', type=int, default=0, help='Also print the N slowest imports (by self time)')
+    parser.add_argument('--out', default='', help='Write results JSON here')
+    args = parser.parse_args(argv)
+
+    results = []
+    over = []
+    for module in args.module or list(BUDGETS_MS):
+        best = min((measure(module) for _ in range(max(1, args.repeat))), key=lambda r: r['total_ms'])
+        budget = args.budget_ms if args.budget_ms is not None else BUDGETS_MS.get(module, DEFAULT_BUDGET_MS)
+        ok = best['total_ms'] <= budget
+        print(f"{module:<30} {best['total_ms']:>8.1f} ms  (budget {budget:g} ms){'' if ok else '  OVER BUDGET'}")
+        if args.top:
+            for name, self_ms, cum_ms, _ in sorted(best['imports'], key=lambda r: r[1], reverse=True)[:args.top]:
+                print(f'    {name:<40} self {self_ms:>7.2f} ms  cumulative {cum_ms:>7.2f} ms')
+        if not ok:
+            over.append(module)
+        results.append({'module': module, 'total_ms': best['total_ms'], 'budget_ms': budget})
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump({'python': sys.version.split()[0], 'results': results}, f, indent=2)
+    if over:
+        sys.exit(1)
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,458 @@
+"""Load-test the Gmail service and the UI server against local stubs.
+
+    python -m benchmarks.loadtest --users 50 --concurrency 10 --query-concurrency 4
+    python -m benchmarks.loadtest --users 200 --latency-ms 80 --error-rate 0.02 --out load.json
+
+Starts, in a fresh work directory (its own users.db, docstore and temp_pdfs):
+  - Redis: `--redis-url`, or an in-process fakeredis server when none is given
+  - `benchmarks.stubs`: Google OAuth, the Gmail API and the LLM, serving one
+    synthetic mailbox per user with statements from the benchmark corpus
+  - the Gmail service (`uvicorn Bank_count_detection:app`) and the UI server
+    (`ui/server.py`), each in its own process
+
+The UI server is first seeded with `--seed-users` users through /users/bulk.
+Then `--users` users are onboarded, `--concurrency` at a time, the way the UI
+does it: POST /users, GET /auth, consent at the fake Google, GET
+/oauth/callback, then GET /jobs/<id> until the ingestion job ends. Meanwhile
+`--query-concurrency` clients page through GET /users and fetch single users.
+
+Reported: requests/s, p50/p95/p99 latency and error rate per request type,
+onboarding time end to end, statements processed, and the Gmail service's
+per-stage timings from its /metrics (Gmail calls, unlock, extraction, LLM...).
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import requests
+
+from benchmarks.run import DEFAULT_CORPUS, REPO_ROOT, _percentile
+
+JOB_TIMEOUT = 600
+POLL_INTERVAL = 0.25
+NOISE_MESSAGE = {'subject': 'Your weekly digest', 'sender': 'digest@example.com', 'snippet': 'Top stories this week'}
+
+
+# ---------------------------------------------------------------------------
+# Setup: mailboxes, processes
+# ---------------------------------------------------------------------------
+
+def build_mailboxes(manifest: Dict[str, Any], users: int, statements: int) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """One mailbox per user: `statements` copies of a corpus statement and one unrelated email.
+
+    Returns (mailboxes file contents, people) where each person has the
+    corpus identity the statement's password is derived from.
+    """
+    docs = manifest['documents']
+    mailboxes, people = {}, []
+    for i in range(users):
+        doc = docs[i % len(docs)]
+        name = f'mb{i:05d}'
+        size = os.path.getsize(doc['path'])
+        msgs = [{'id': f'{i:05d}s{k}', 'subject': doc['subject'], 'sender': doc['sender'],
+                 'snippet': 'Please find attached your e-statement', 'path': doc['path'], 'size': size,
+                 'filename': f'statement_{k}.pdf'} for k in range(statements)]
+        msgs.append({'id': f'{i:05d}n', **NOISE_MESSAGE})
+        mailboxes[name] = msgs
+        people.append({'mailbox': name, 'full_name': doc['full_name'], 'dob': doc['dob'], 'mobile': doc['phone'],
+                       'statements': statements})
+    return {'mailboxes': mailboxes}, people
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _start_fake_redis() -> Tuple[Any, str]:
+    try:
+        from fakeredis import TcpFakeServer
+    except Exception:
+        raise SystemExit('No --redis-url given and fakeredis is not installed (pip install fakeredis lupa)')
+    server = TcpFakeServer(('127.0.0.1', _free_port()), server_type='redis')
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'redis://127.0.0.1:{server.server_address[1]}/0'
+
+
+def _wait_ready(url: str, proc: subprocess.Popen, log_path: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+                raise SystemExit(f'{url} exited with {proc.returncode}:\n{f.read()[-2000:]}')
+        try:
+            requests.get(url, timeout=2)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise SystemExit(f'{url} did not come up within {timeout:.0f}s (see {log_path})')
+
+
+class Services:
+    """The stubs, the Gmail service and the UI server, as child processes in `workdir`."""
+
+    def __init__(self, workdir: str, mailboxes_path: str, redis_url: str, args: argparse.Namespace):
+        self.workdir = workdir
+        self.procs: List[subprocess.Popen] = []
+        stub_port, api_port, ui_port = _free_port(), _free_port(), _free_port()
+        self.stub_url = f'http://127.0.0.1:{stub_port}'
+        self.api_url = f'http://127.0.0.1:{api_port}'
+        self.ui_url = f'http://127.0.0.1:{ui_port}'
+
+        secrets = os.path.join(workdir, 'credentials.json')
+        with open(secrets, 'w', encoding='utf-8') as f:
+            json.dump({'web': {
+                'client_id': 'loadtest.apps.example.com', 'client_secret': 'loadtest',
+                'auth_uri': self.stub_url + '/o/oauth2/auth', 'token_uri': self.stub_url + '/token',
+                'redirect_uris': [self.api_url + '/oauth/callback'],
+            }}, f)
+
+        env = dict(os.environ)
+        env.update({
+            'PYTHONPATH': os.pathsep.join(filter(None, [REPO_ROOT, env.get('PYTHONPATH')])),
+            'BANK_PDF_DB': os.path.join(workdir, 'users.db'),
+            'BANK_PDF_DOCS_DIR': os.path.join(workdir, 'docstore'),
+            'BANK_PDF_RUNS_DIR': os.path.join(workdir, 'runs'),
+            'BANK_PDF_REDIS_URL': redis_url,
+            'GOOGLE_CLIENT_SECRETS': secrets,
+            'INGEST_REDIRECT_URI': self.api_url + '/oauth/callback',
+            'INGEST_GMAIL_API_URL': self.stub_url + '/',
+            'INGEST_UI_URL': self.ui_url + '/connect-gmail',
+        })
+        if args.no_llm:
+            env.pop('GEMINI_API_KEY', None)
+        else:
+            env.update({'GEMINI_API_KEY': 'loadtest', 'GEMINI_ENDPOINT': self.stub_url + '/llm'})
+
+        py = sys.executable
+        self._start('stubs', [py, '-m', 'benchmarks.stubs', '--mailboxes', mailboxes_path, '--port', str(stub_port),
+                              '--latency-ms', str(args.latency_ms), '--error-rate', str(args.error_rate)],
+                    env, self.stub_url + '/stats')
+        self._start('api', [py, '-m', 'uvicorn', 'Bank_count_detection:app', '--host', '127.0.0.1',
+                            '--port', str(api_port), '--log-level', 'warning'],
+                    env, self.api_url + '/metrics')
+        self._start('ui', [py, '-m', 'flask', '--app', os.path.join(REPO_ROOT, 'ui', 'server.py'), 'run',
+                           '--host', '127.0.0.1', '--port', str(ui_port), '--no-reload', '--no-debugger'],
+                    env, self.ui_url + '/users?limit=1')
+
+    def _start(self, name: str, cmd: List[str], env: Dict[str, str], ready_url: str) -> None:
+        log_path = os.path.join(self.workdir, name + '.log')
+        # cwd is the work directory: the Gmail service writes temp_pdfs/ relative to it
+        proc = subprocess.Popen(cmd, cwd=self.workdir, env=env, stdout=open(log_path, 'w'), stderr=subprocess.STDOUT)
+        self.procs.append(proc)
+        _wait_ready(ready_url, proc, log_path)
+
+    def stop(self) -> None:
+        for proc in self.procs:
+            proc.terminate()
+        for proc in self.procs:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+# ---------------------------------------------------------------------------
+# Load
+# ---------------------------------------------------------------------------
+
+class Recorder:
+    """Latency and outcome of every request, per request type."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def call(self, op: str, method, url: str, **kwargs) -> Optional[requests.Response]:
+        """Make one request; None (counted as an error) on a connection error or a 4xx/5xx."""
+        start = time.perf_counter()
+        try:
+            resp = method(url, timeout=60, **kwargs)
+        except requests.RequestException:
+            resp = None
+        elapsed = time.perf_counter() - start
+        ok = resp is not None and resp.status_code < 400
+        with self._lock:
+            self.samples.setdefault(op, []).append(elapsed)
+            if not ok:
+                self.errors[op] = self.errors.get(op, 0) + 1
+        return resp if ok else None
+
+
+def onboard(rec: Recorder, services: Services, person: Dict[str, Any], user_ids: List[str]) -> Dict[str, Any]:
+    """Sign one user up and follow their ingestion job to the end."""
+    s = requests.Session()
+    start = time.perf_counter()
+    out = {'mailbox': person['mailbox'], 'status': 'error', 'statements': person['statements']}
+
+    resp = rec.call('create_user', s.post, services.ui_url + '/users',
+                    json={k: person[k] for k in ('full_name', 'dob', 'mobile')})
+    if resp is None:
+        return out
+    user_id = resp.json()['user_id']
+    user_ids.append(user_id)
+
+    resp = rec.call('auth', s.get, services.api_url + '/auth', params={'user_id': user_id}, allow_redirects=False)
+    if resp is None or 'Location' not in resp.headers:
+        return out
+    # The user picks their account on the consent screen; not timed, it is the stub
+    consent = s.get(resp.headers['Location'] + '&' + urlencode({'mailbox': person['mailbox']}), allow_redirects=False)
+    if 'Location' not in consent.headers:
+        return out
+    resp = rec.call('oauth_callback', s.get, consent.headers['Location'], allow_redirects=False)
+    job = parse_qs(urlsplit(resp.headers.get('Location', '')).query).get('job') if resp is not None else None
+    if not job:
+        return out
+
+    deadline = time.monotonic() + JOB_TIMEOUT
+    state: Dict[str, str] = {}
+    while time.monotonic() < deadline:
+        resp = rec.call('job_status', s.get, f'{services.api_url}/jobs/{job[0]}')
+        state = resp.json() if resp is not None else {}
+        if state.get('status') not in (None, 'running'):
+            break
+        time.sleep(POLL_INTERVAL)
+    out.update({'status': state.get('status') or 'timeout', 'seconds': time.perf_counter() - start,
+                'downloaded': int(state.get('downloaded') or 0), 'processed': int(state.get('processed') or 0)})
+    return out
+
+
+def query_users(rec: Recorder, services: Services, user_ids: List[str], stop: threading.Event, seed: int) -> None:
+    """Page through GET /users and look up single users until `stop` is set."""
+    s = requests.Session()
+    rng = random.Random(seed)
+    cursor = None
+    while not stop.is_set():
+        if user_ids and rng.random() < 0.25:
+            rec.call('get_user', s.get, f'{services.ui_url}/users/{rng.choice(user_ids)}')
+            continue
+        params = {'limit': 100, **({'after': cursor} if cursor else {})}
+        resp = rec.call('list_users', s.get, services.ui_url + '/users', params=params)
+        cursor = resp.json().get('next_cursor') if resp is not None else None
+
+
+def seed_users(services: Services, count: int) -> None:
+    """Bulk-import `count` users, so /users pages over a realistic table."""
+    if count <= 0:
+        return
+    rng = random.Random(count)
+    lines = ''.join(json.dumps({
+        'full_name': f'Seed User{i}', 'dob': f'{rng.randint(1, 28):02d}-{rng.randint(1, 12):02d}-{rng.randint(1960, 2000)}',
+        'mobile': '9' + ''.join(rng.choice('0123456789') for _ in range(9)),
+    }) + '\n' for i in range(count))
+    resp = requests.post(services.ui_url + '/users/bulk', data=lines.encode('utf-8'),
+                         headers={'Content-Type': 'application/x-ndjson'}, timeout=300)
+    resp.raise_for_status()
+
+
+# ---------------------------------------------------------------------------
+# Server-side timings
+# ---------------------------------------------------------------------------
+
+def parse_prometheus(text: str) -> Dict[str, Dict[str, Any]]:
+    """Histograms of a /metrics page: 'name{labels}' -> count, sum and bucket counts."""
+    timers: Dict[str, Dict[str, Any]] = {}
+    for line in text.splitlines():
+        if line.startswith('#') or ' ' not in line:
+            continue
+        series, value = line.rsplit(' ', 1)
+        name, _, labels = series.partition('{')
+        labels = labels.rstrip('}')
+        for suffix in ('_seconds_bucket', '_seconds_sum', '_seconds_count'):
+            if name.endswith(suffix):
+                break
+        else:
+            continue
+        base = name[:-len(suffix)]
+        le = None
+        if suffix == '_seconds_bucket':
+            parts = labels.split(',')
+            le = parts[-1].split('=', 1)[1].strip('"')
+            labels = ','.join(parts[:-1])
+        key = base + (f'{{{labels}}}' if labels else '')
+        t = timers.setdefault(key, {'count': 0, 'sum': 0.0, 'buckets': []})
+        if le is not None:
+            t['buckets'].append((float('inf') if le == '+Inf' else float(le), float(value)))
+        elif suffix == '_seconds_sum':
+            t['sum'] = float(value)
+        else:
+            t['count'] = int(float(value))
+    return timers
+
+
+def _bucket_percentile(buckets: List[Tuple[float, float]], count: int, pct: float) -> float:
+    """Upper bound of the bucket holding the pct-th percentile (cumulative buckets)."""
+    target = count * pct / 100.0
+    for bound, cumulative in buckets:
+        if cumulative >= target:
+            return bound
+    return float('inf')
+
+
+def server_stages(api_url: str) -> List[Dict[str, Any]]:
+    try:
+        text = requests.get(api_url + '/metrics', timeout=10).text
+    except requests.RequestException:
+        return []
+    stages = []
+    for key, t in parse_prometheus(text).items():
+        if not t['count']:
+            continue
+        stages.append({'stage': key.replace('bank_pdf_', '', 1), 'count': t['count'], 'total_s': round(t['sum'], 3),
+                       'mean_ms': round(t['sum'] / t['count'] * 1000, 2),
+                       'p95_le_ms': round(_bucket_percentile(t['buckets'], t['count'], 95) * 1000, 1)})
+    return sorted(stages, key=lambda s: -s['total_s'])
+
+
+# ---------------------------------------------------------------------------
+# Report
+# ---------------------------------------------------------------------------
+
+def summarize(rec: Recorder, wall: float) -> List[Dict[str, Any]]:
+    rows = []
+    for op, samples in sorted(rec.samples.items()):
+        errors = rec.errors.get(op, 0)
+        rows.append({
+            'request': op, 'count': len(samples), 'rps': round(len(samples) / wall, 2) if wall else 0.0,
+            'p50_ms': round(_percentile(samples, 50) * 1000, 2), 'p95_ms': round(_percentile(samples, 95) * 1000, 2),
+            'p99_ms': round(_percentile(samples, 99) * 1000, 2), 'max_ms': round(max(samples) * 1000, 2),
+            'error_rate': round(errors / len(samples), 4),
+        })
+    return rows
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    print(f"\n{'request':<16} {'count':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'errors':>7}")
+    for r in report['requests']:
+        print(f"{r['request']:<16} {r['count']:>7} {r['rps']:>8} {r['p50_ms']:>9} {r['p95_ms']:>9} "
+              f"{r['p99_ms']:>9} {r['max_ms']:>9} {r['error_rate'] * 100:>6.1f}%")
+
+    o = report['onboarding']
+    print(f"\nOnboarding: {o['done']}/{o['users']} jobs done ({o['failed']} failed, {o['errors']} errors/timeouts) "
+          f"in {report['wall_s']}s, {o['users_per_min']} users/min")
+    if o['done']:
+        print(f"  end to end p50 {o['p50_s']}s, p95 {o['p95_s']}s, max {o['max_s']}s; "
+              f"statements processed {o['processed']}/{o['expected_statements']}")
+    if report.get('stubs'):
+        print('  stub calls: ' + ', '.join(f'{k} {v}' for k, v in sorted(report['stubs'].items())))
+
+    print(f"\n{'server stage':<60} {'count':>7} {'total s':>9} {'mean ms':>9} {'p95 ms <=':>10}")
+    for s in report['server_stages']:
+        print(f"{s['stage'][:60]:<60} {s['count']:>7} {s['total_s']:>9} {s['mean_ms']:>9} {s['p95_le_ms']:>10}")
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    from benchmarks.corpus import generate_corpus, load_manifest
+    if not os.path.isfile(os.path.join(args.corpus, 'manifest.json')):
+        print('Generating corpus in', args.corpus)
+        generate_corpus(args.corpus)
+    manifest = load_manifest(args.corpus)
+
+    workdir = tempfile.mkdtemp(prefix='bank_pdf_loadtest_')
+    mailboxes, people = build_mailboxes(manifest, args.users, args.statements)
+    mailboxes_path = os.path.join(workdir, 'mailboxes.json')
+    with open(mailboxes_path, 'w', encoding='utf-8') as f:
+        json.dump(mailboxes, f)
+
+    fake_redis, redis_url = (None, args.redis_url) if args.redis_url else _start_fake_redis()
+    services = None
+    try:
+        services = Services(workdir, mailboxes_path, redis_url, args)
+        print(f'Work directory {workdir}; Gmail service {services.api_url}, UI server {services.ui_url}')
+        seed_users(services, args.seed_users)
+
+        rec = Recorder()
+        user_ids: List[str] = []
+        stop = threading.Event()
+        start = time.perf_counter()
+        queriers = [threading.Thread(target=query_users, args=(rec, services, user_ids, stop, i), daemon=True)
+                    for i in range(args.query_concurrency)]
+        for t in queriers:
+            t.start()
+        with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+            results = list(pool.map(lambda p: onboard(rec, services, p, user_ids), people))
+        if args.duration:
+            stop.wait(max(0.0, args.duration - (time.perf_counter() - start)))
+        stop.set()
+        for t in queriers:
+            t.join()
+        wall = time.perf_counter() - start
+
+        done = [r for r in results if r['status'] == 'done']
+        seconds = [r['seconds'] for r in done]
+        report = {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'config': {k: v for k, v in vars(args).items() if k not in ('out', 'keep')},
+            'wall_s': round(wall, 2),
+            'requests': summarize(rec, wall),
+            'onboarding': {
+                'users': len(results), 'done': len(done),
+                'failed': sum(r['status'] == 'failed' for r in results),
+                'errors': sum(r['status'] in ('error', 'timeout') for r in results),
+                'users_per_min': round(len(done) / wall * 60, 1) if wall else 0.0,
+                'p50_s': round(_percentile(seconds, 50), 2), 'p95_s': round(_percentile(seconds, 95), 2),
+                'max_s': round(max(seconds), 2) if seconds else 0.0,
+                'processed': sum(r['processed'] for r in done),
+                'expected_statements': sum(r['statements'] for r in results),
+            },
+            'server_stages': server_stages(services.api_url),
+        }
+        try:
+            report['stubs'] = requests.get(services.stub_url + '/stats', timeout=5).json()
+        except requests.RequestException:
+            pass
+        return report
+    finally:
+        if services is not None:
+            services.stop()
+        if fake_redis is not None:
+            fake_redis.shutdown()
+        if args.keep:
+            print('Kept work directory', workdir)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load-test the Gmail service and the UI server against local stubs')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS, help='Corpus directory (created if missing)')
+    parser.add_argument('--users', type=int, default=20, help='Users to onboard')
+    parser.add_argument('--concurrency', type=int, default=5, help='Onboardings in flight at once')
+    parser.add_argument('--statements', type=int, default=2, help='Statement emails per mailbox')
+    parser.add_argument('--query-concurrency', type=int, default=2, help='Clients querying /users meanwhile')
+    parser.add_argument('--seed-users', type=int, default=1000, help='Users bulk-imported before the run')
+    parser.add_argument('--duration', type=float, default=0.0, help='Keep querying /users for at least this many seconds')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Stub latency for every Gmail and LLM call')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of Gmail and LLM calls answered with 429')
+    parser.add_argument('--no-llm', action='store_true', help='Skip the LLM analysis step of each job')
+    parser.add_argument('--redis-url', default='', help='Use this Redis instead of an in-process fakeredis (its data is not cleared)')
+    parser.add_argument('--out', default='', help='Write the report JSON here')
+    parser.add_argument('--keep', action='store_true', help='Keep the work directory (databases, service logs)')
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    _print_report(report)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print('Report written to', args.out)
+    o = report['onboarding']
+    return 0 if o['done'] == o['users'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
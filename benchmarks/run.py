@@ -0,0 +1,331 @@
+"""Time the pipeline stages on the synthetic corpus and compare with a baseline.
+
+    python -m benchmarks.corpus                      # once, writes benchmarks/corpus
+    python -m benchmarks.run                         # run all cases
+    python -m benchmarks.run --save-baseline         # record current numbers
+    python -m benchmarks.run --compare               # fail on regressions vs the baseline
+
+Each case runs in a fresh (spawned) process so its peak RSS is its own.
+Reported per case: items/s, p50/p95 latency per item and peak RSS.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(HERE)
+DEFAULT_CORPUS = os.path.join(HERE, 'corpus')
+DEFAULT_BASELINE = os.path.join(HERE, 'baseline.json')
+
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+class Skip(Exception):
+    """Raised by a case whose dependencies are not available here."""
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * pct / 100.0
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def _candidates(doc: Dict[str, Any]) -> List[str]:
+    from bank_pdf.generator import generate_password_candidates
+    return generate_password_candidates(doc['full_name'], doc['phone'], doc['dob'], doc['bank'])
+
+
+# Decrypted temp copies made by the current case; `_run_case` deletes them
+_decrypted: List[str] = []
+
+
+def _decrypted_copies(docs: List[Dict[str, Any]]) -> List[str]:
+    # Unlock outside the timed region for the stages that run after unlocking
+    from bank_pdf.unlocker import try_unlock_pdf
+    out = []
+    for doc in docs:
+        ok, _, path = try_unlock_pdf(doc['path'], [doc['password']])
+        if ok:
+            out.append(path)
+            if path != doc['path']:
+                _decrypted.append(path)
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Cases: each gets the manifest and returns a list of per-item durations (s)
+# ---------------------------------------------------------------------------
+
+def case_generate_candidates(manifest, repeat):
+    from bank_pdf.generator import generate_password_candidates
+    samples = []
+    for _ in range(repeat):
+        for doc in manifest['documents']:
+            t = time.perf_counter()
+            generate_password_candidates(doc['full_name'], doc['phone'], doc['dob'], doc['bank'])
+            samples.append(time.perf_counter() - t)
+    return samples
+
+
+def case_try_unlock(manifest, repeat):
+    from bank_pdf.unlocker import try_unlock_pdf
+    samples = []
+    for doc in manifest['documents']:
+        candidates = _candidates(doc)
+        for _ in range(repeat):
+            t = time.perf_counter()
+            ok, _, path = try_unlock_pdf(doc['path'], candidates)
+            samples.append(time.perf_counter() - t)
+            if ok and path != doc['path']:
+                os.remove(path)
+    return samples
+
+
+def case_contains_text(manifest, repeat):
+    from bank_pdf.detector import contains_text
+    paths = _decrypted_copies(manifest['documents'])
+    samples = []
+    for _ in range(repeat):
+        for path in paths:
+            t = time.perf_counter()
+            contains_text(path)
+            samples.append(time.perf_counter() - t)
+    return samples
+
+
+def case_extract_text(manifest, repeat):
+    from bank_pdf.extractor import extract_pdf_all
+    paths = _decrypted_copies([d for d in manifest['documents'] if d['kind'] == 'text'])
+    samples = []
+    for _ in range(repeat):
+        for path in paths:
+            t = time.perf_counter()
+            extract_pdf_all(path, ocr=False)
+            samples.append(time.perf_counter() - t)
+    return samples
+
+
+def case_extract_ocr(manifest, repeat):
+    if not (shutil.which('tesseract') and shutil.which('pdftoppm')):
+        raise Skip('tesseract/poppler not installed')
+    from bank_pdf.extractor import extract_pdf_all
+    paths = _decrypted_copies([d for d in manifest['documents'] if d['kind'] == 'scanned'])
+    samples = []
+    for _ in range(repeat):
+        for path in paths:
+            t = time.perf_counter()
+            extract_pdf_all(path, ocr=True)
+            samples.append(time.perf_counter() - t)
+    return samples
+
+
+def case_ocr_images(manifest, repeat):
+    # Engine only: pages are rendered once up front, then recognized in engine-sized batches
+    from bank_pdf.ocr import get_engine, ocr_images
+    engine = get_engine()
+    if engine is None or not shutil.which('pdftoppm'):
+        raise Skip('no OCR engine or poppler not installed')
+    from pdf2image import convert_from_path
+    paths = _decrypted_copies([d for d in manifest['documents'] if d['kind'] == 'scanned'])
+    images = [img for path in paths for img in convert_from_path(path, dpi=200)]
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        ocr_images(images, engine)
+        per_page = (time.perf_counter() - t) / max(1, len(images))
+        samples.extend([per_page] * len(images))
+    return samples
+
+
+def case_docfile_page(manifest, repeat):
+    # Random access to one stored page: open the docfile and decompress only that page
+    import tempfile
+    from bank_pdf import docfile
+    from bank_pdf.extractor import extract_pdf_all
+    paths = _decrypted_copies([d for d in manifest['documents'] if d['kind'] == 'text'])
+    out_dir = tempfile.mkdtemp(prefix='bench_docfile_')
+    files = []
+    for i, path in enumerate(paths):
+        files.append(os.path.join(out_dir, f'{i}.bpd'))
+        docfile.write(files[-1], extract_pdf_all(path))
+    samples = []
+    for _ in range(repeat * 20):
+        for path in files:
+            t = time.perf_counter()
+            with docfile.DocFile(path) as doc:
+                doc.page(doc.num_pages - 1)
+            samples.append(time.perf_counter() - t)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    return samples
+
+
+def case_classify_narration(manifest, repeat):
+    # Rule-index path: a fresh classifier per round, so nothing is served from the memo
+    from bank_pdf.extractor import extract_pdf_all
+    from bank_pdf.merchants import Classifier
+    from bank_pdf.transactions import iter_transactions
+    paths = _decrypted_copies([d for d in manifest['documents'] if d['kind'] == 'text'])
+    narrations = [t['description'] for path in paths for t in iter_transactions(extract_pdf_all(path))]
+    samples = []
+    for _ in range(repeat):
+        classifier = Classifier(rules=None)
+        for text in narrations:
+            t = time.perf_counter()
+            classifier.classify(text)
+            samples.append(time.perf_counter() - t)
+    return samples
+
+
+def case_bank_from_subject(manifest, repeat):
+    try:
+        from Bank_count_detection import get_bank_from_subject
+    except Exception as e:
+        raise Skip(f'cannot import Bank_count_detection: {e}')
+    messages = [{
+        'payload': {'headers': [{'name': 'Subject', 'value': d['subject']}, {'name': 'From', 'value': d['sender']}]},
+        'snippet': 'Please find attached your e-statement',
+    } for d in manifest['documents']]
+    samples = []
+    for _ in range(repeat * 100):
+        for msg in messages:
+            t = time.perf_counter()
+            get_bank_from_subject(msg)
+            samples.append(time.perf_counter() - t)
+    return samples
+
+
+CASES: Dict[str, Callable[[Dict[str, Any], int], List[float]]] = {
+    'generate_password_candidates': case_generate_candidates,
+    'try_unlock_pdf': case_try_unlock,
+    'contains_text': case_contains_text,
+    'extract_pdf_all': case_extract_text,
+    'extract_pdf_all_ocr': case_extract_ocr,
+    'ocr_images': case_ocr_images,
+    'docfile_page': case_docfile_page,
+    'classify_narration': case_classify_narration,
+    'get_bank_from_subject': case_bank_from_subject,
+}
+
+
+def _run_case(name: str, manifest: Dict[str, Any], repeat: int) -> Dict[str, Any]:
+    try:
+        start = time.perf_counter()
+        samples = CASES[name](manifest, repeat)
+        wall = time.perf_counter() - start
+    except Skip as e:
+        return {'case': name, 'skipped': str(e)}
+    finally:
+        while _decrypted:
+            try:
+                os.remove(_decrypted.pop())
+            except OSError:
+                pass
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_mb = rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+    return {
+        'case': name,
+        'items': len(samples),
+        'throughput_per_s': round(len(samples) / sum(samples), 2) if samples and sum(samples) else 0.0,
+        'p50_ms': round(statistics.median(samples) * 1000, 3) if samples else 0.0,
+        'p95_ms': round(_percentile(samples, 95) * 1000, 3),
+        'wall_s': round(wall, 3),
+        'peak_rss_mb': round(rss_mb, 1),
+    }
+
+
+def run(manifest: Dict[str, Any], cases: List[str], repeat: int = 3) -> List[Dict[str, Any]]:
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for name in cases:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            results.append(pool.submit(_run_case, name, manifest, repeat).result())
+    return results
+
+
+def compare(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Return a message per case whose p50 or peak RSS regressed beyond `tolerance`."""
+    base = {r['case']: r for r in baseline.get('results', [])}
+    regressions = []
+    for r in results:
+        b = base.get(r['case'])
+        if not b or r.get('skipped') or b.get('skipped'):
+            continue
+        for key in ('p50_ms', 'peak_rss_mb'):
+            if b[key] and r[key] > b[key] * (1 + tolerance):
+                regressions.append(f"{r['case']}: {key} {b[key]} -> {r[key]} (+{(r[key] / b[key] - 1) * 100:.0f}%)")
+    return regressions
+
+
+def _print_table(results: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]]) -> None:
+    base = {r['case']: r for r in (baseline or {}).get('results', [])}
+    print(f"{'case':<30} {'items':>6} {'items/s':>10} {'p50 ms':>10} {'p95 ms':>10} {'rss MB':>8}  vs baseline")
+    for r in results:
+        if r.get('skipped'):
+            print(f"{r['case']:<30} skipped: {r['skipped']}")
+            continue
+        delta = ''
+        b = base.get(r['case'])
+        if b and not b.get('skipped') and b['p50_ms']:
+            delta = f"{(r['p50_ms'] / b['p50_ms'] - 1) * 100:+.1f}% p50"
+        print(f"{r['case']:<30} {r['items']:>6} {r['throughput_per_s']:>10} {r['p50_ms']:>10} "
+              f"{r['p95_ms']:>10} {r['peak_rss_mb']:>8}  {delta}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark bank_pdf stages on the synthetic corpus')
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS, help='Corpus directory (created if missing)')
+    parser.add_argument('--case', action='append', choices=sorted(CASES), help='Run only this case (repeatable)')
+    parser.add_argument('--repeat', type=int, default=3, help='Repetitions per document')
+    parser.add_argument('--out', default='', help='Write results JSON here')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON path')
+    parser.add_argument('--save-baseline', action='store_true', help='Overwrite the baseline with this run')
+    parser.add_argument('--compare', action='store_true', help='Exit non-zero if a case regressed vs the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown before --compare fails (default: 0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    from benchmarks.corpus import generate_corpus, load_manifest
+    if not os.path.isfile(os.path.join(args.corpus, 'manifest.json')):
+        print('Generating corpus in', args.corpus)
+        generate_corpus(args.corpus)
+    manifest = load_manifest(args.corpus)
+
+    results = run(manifest, args.case or list(CASES), args.repeat)
+    report = {'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0], 'results': results}
+
+    baseline = None
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    _print_table(results, baseline)
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print('Saved baseline to', args.baseline)
+    elif args.compare and baseline:
+        regressions = compare(results, baseline, args.tolerance)
+        for msg in regressions:
+            print('REGRESSION', msg)
+        if regressions:
+            sys.exit(1)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""Local stand-ins for Google OAuth, the Gmail API and the LLM, for load tests.
+
+    python -m benchmarks.stubs --mailboxes mailboxes.json --port 8090
+
+One HTTP server answers:
+  - `GET /o/oauth2/auth`: the consent screen. It redirects straight back to
+    `redirect_uri` with a code for the `mailbox` query parameter (the account
+    the user signs in with)
+  - `POST /token`: exchanges the code, checking the PKCE verifier, for the
+    access token `tok-<mailbox>`
+  - `GET /gmail/v1/users/me/messages[/<id>[/attachments/<id>]]`: the mailbox
+    of the bearer token, in the Gmail API's JSON shapes
+  - `POST /llm`: the generic LLM contract of `bank_pdf.analysis`; merchant
+    prompts get every narration back as category `other`, analysis prompts a
+    fixed summary
+  - `GET /stats`: requests served and errors injected, per route
+
+`--latency-ms` delays every Gmail and LLM response and `--error-rate` answers
+that share of them with a 429, so retries and the shared rate limits are
+exercised too. The mailboxes file is written by `benchmarks.loadtest`:
+{"mailboxes": {name: [{"id", "subject", "sender", "snippet", "filename", "path"}, ...]}}
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+PAGE_SIZE = 100  # Gmail's default maxResults
+_MESSAGE = re.compile(r'^/gmail/v1/users/me/messages(?:/([^/]+)(?:/attachments/([^/]+))?)?$')
+
+
+class Stubs:
+    """State shared by the handler threads: mailboxes, issued codes, counters."""
+
+    def __init__(self, mailboxes: Dict[str, List[Dict[str, Any]]], latency: float = 0.0, error_rate: float = 0.0,
+                 page_size: int = PAGE_SIZE, seed: int = 7):
+        self.mailboxes = mailboxes
+        self.messages = {(name, m['id']): m for name, msgs in mailboxes.items() for m in msgs}
+        self.latency = latency
+        self.error_rate = error_rate
+        self.page_size = page_size
+        self.codes: Dict[str, Dict[str, str]] = {}
+        self.stats: Dict[str, int] = {}
+        self._attachments: Dict[str, str] = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def throttle(self) -> bool:
+        """Sleep the configured latency; True if this response should be a 429."""
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            return self.error_rate > 0 and self._rng.random() < self.error_rate
+
+    def attachment(self, path: str) -> str:
+        data = self._attachments.get(path)
+        if data is None:
+            with open(path, 'rb') as f:
+                data = base64.urlsafe_b64encode(f.read()).decode('ascii')
+            with self._lock:
+                self._attachments[path] = data
+        return data
+
+
+def _message_resource(msg: Dict[str, Any]) -> Dict[str, Any]:
+    """A message in the Gmail API's `full` format: headers, a text part and the PDF."""
+    return {
+        'id': msg['id'], 'threadId': msg['id'], 'snippet': msg.get('snippet', ''),
+        'payload': {
+            'mimeType': 'multipart/mixed',
+            'headers': [{'name': 'Subject', 'value': msg['subject']}, {'name': 'From', 'value': msg['sender']}],
+            'parts': [{'partId': '0', 'mimeType': 'text/plain', 'filename': '', 'body': {'size': 0}}] + ([{
+                'partId': '1', 'mimeType': 'application/pdf', 'filename': msg['filename'],
+                'body': {'attachmentId': 'att-' + msg['id'], 'size': msg.get('size', 0)},
+            }] if msg.get('path') else []),
+        },
+    }
+
+
+def _llm_answer(prompt: str) -> Dict[str, Any]:
+    if 'NARRATIONS:\n' in prompt:
+        lines = prompt.split('NARRATIONS:\n', 1)[1].split('\n\n', 1)[0].splitlines()
+        return {line: {'merchant': line.title(), 'category': 'other'} for line in lines if line}
+    return {'summary': 'Synthetic analysis from the load-test stub.', 'category_spend': {},
+            'recurring_payments': [], 'anomalies': [], 'suggestions': []}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    stubs: Stubs = None  # set by `serve`
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: Any = None, headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _throttled(self, route: str) -> bool:
+        self.stubs.count(route)
+        if not self.stubs.throttle():
+            return False
+        self.stubs.count(route + ':429')
+        self._send(429, {'error': {'code': 429, 'message': 'Rate Limit Exceeded', 'status': 'RESOURCE_EXHAUSTED',
+                                   'errors': [{'reason': 'rateLimitExceeded', 'domain': 'usageLimits'}]}},
+                   {'Retry-After': '1'})
+        return True
+
+    def _mailbox(self) -> Optional[str]:
+        token = self.headers.get('Authorization', '')[len('Bearer '):]
+        name = token[len('tok-'):] if token.startswith('tok-') else None
+        return name if name in self.stubs.mailboxes else None
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path == '/o/oauth2/auth':
+            return self._authorize(query)
+        if url.path == '/stats':
+            return self._send(200, self.stubs.stats)
+        m = _MESSAGE.match(url.path)
+        if not m:
+            return self._send(404, {'error': 'not found'})
+        route = 'messages.attachments.get' if m.group(2) else 'messages.get' if m.group(1) else 'messages.list'
+        if self._throttled(route):
+            return
+        mailbox = self._mailbox()
+        if mailbox is None:
+            return self._send(401, {'error': {'code': 401, 'message': 'Invalid Credentials'}})
+
+        if route == 'messages.list':
+            msgs = self.stubs.mailboxes[mailbox]
+            size = int(query.get('maxResults') or self.stubs.page_size)
+            start = int(query.get('pageToken') or 0)
+            body = {'messages': [{'id': m['id'], 'threadId': m['id']} for m in msgs[start:start + size]],
+                    'resultSizeEstimate': len(msgs)}
+            if start + size < len(msgs):
+                body['nextPageToken'] = str(start + size)
+            return self._send(200, body)
+
+        msg = self.stubs.messages.get((mailbox, m.group(1)))
+        if msg is None:
+            return self._send(404, {'error': {'code': 404, 'message': 'Requested entity was not found.'}})
+        if route == 'messages.get':
+            return self._send(200, _message_resource(msg))
+        if not msg.get('path') or m.group(2) != 'att-' + msg['id']:
+            return self._send(404, {'error': {'code': 404, 'message': 'Invalid attachment id.'}})
+        data = self.stubs.attachment(msg['path'])
+        return self._send(200, {'attachmentId': m.group(2), 'size': msg.get('size', 0), 'data': data})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path == '/token':
+            return self._token({k: v[0] for k, v in parse_qs(self._body().decode('utf-8')).items()})
+        if url.path == '/llm':
+            payload = json.loads(self._body() or b'{}')
+            if self._throttled('llm'):
+                return
+            answer = _llm_answer(payload.get('prompt', ''))
+            return self._send(200, {'choices': [{'text': json.dumps(answer)}]})
+        self._send(404, {'error': 'not found'})
+
+    def _authorize(self, query: Dict[str, str]) -> None:
+        self.stubs.count('authorize')
+        mailbox = query.get('mailbox')
+        if mailbox not in self.stubs.mailboxes or not query.get('redirect_uri'):
+            return self._send(400, {'error': 'unknown mailbox or missing redirect_uri'})
+        code = uuid.uuid4().hex
+        self.stubs.codes[code] = {'mailbox': mailbox, 'challenge': query.get('code_challenge', ''),
+                                  'redirect_uri': query['redirect_uri'], 'scope': query.get('scope', '')}
+        params = urlencode({'code': code, 'state': query.get('state', ''), 'scope': query.get('scope', '')})
+        self._send(302, headers={'Location': f"{query['redirect_uri']}?{params}"})
+
+    def _token(self, form: Dict[str, str]) -> None:
+        self.stubs.count('token')
+        grant = self.stubs.codes.pop(form.get('code', ''), None)
+        if grant is None or form.get('redirect_uri') != grant['redirect_uri']:
+            return self._send(400, {'error': 'invalid_grant'})
+        if grant['challenge']:
+            digest = hashlib.sha256(form.get('code_verifier', '').encode('ascii')).digest()
+            if base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii') != grant['challenge']:
+                return self._send(400, {'error': 'invalid_grant', 'error_description': 'code_verifier mismatch'})
+        self._send(200, {'access_token': 'tok-' + grant['mailbox'], 'refresh_token': 'refresh-' + grant['mailbox'],
+                         'token_type': 'Bearer', 'expires_in': 3600, 'scope': grant['scope']})
+
+
+def serve(stubs: Stubs, host: str = '127.0.0.1', port: int = 8090) -> ThreadingHTTPServer:
+    """Create the server (call `serve_forever` on it); port 0 picks a free one."""
+    handler = type('StubHandler', (Handler,), {'stubs': stubs})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Fake Google OAuth, Gmail API and LLM for load tests')
+    parser.add_argument('--mailboxes', required=True, help='Mailboxes JSON written by benchmarks.loadtest')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Delay every Gmail and LLM response')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of Gmail and LLM responses that are 429s')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE, help='Messages per messages.list page')
+    args = parser.parse_args(argv)
+
+    with open(args.mailboxes, 'r', encoding='utf-8') as f:
+        mailboxes = json.load(f)['mailboxes']
+    server = serve(Stubs(mailboxes, args.latency_ms / 1000.0, args.error_rate, args.page_size), args.host, args.port)
+    print(f'Stubs for {len(mailboxes)} mailboxes on http://{args.host}:{server.server_port}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Let `pytest` run from anywhere without installing the package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
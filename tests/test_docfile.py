@@ -0,0 +1,48 @@
+import pytest
+
+from bank_pdf import docfile
+
+RESULT = {
+    'path': '/tmp/statement.pdf',
+    'metadata': {'/Title': 'Statement'},
+    'num_pages': 3,
+    'ocr_performed': True,
+    'pages': [
+        {'page_number': 1, 'kind': 'text', 'text': 'Account No: XXXX1234\n01/03/2024  UPI/SWIGGY  412.00'},
+        {'page_number': 2, 'kind': 'scanned', 'text': '', 'ocr_text': 'Closing Balance 1,30,000.55 ₹'},
+        {'page_number': 3, 'text': ''},
+    ],
+}
+
+
+def _expected(result):
+    out = dict(result)
+    out['extracted_text'] = ''.join(p['text'] for p in result['pages'])
+    out['ocr_text'] = ''.join(p.get('ocr_text') or '' for p in result['pages'])
+    return out
+
+
+@pytest.mark.parametrize('codec', [docfile.CODEC_ZLIB, None])
+def test_round_trip(tmp_path, codec):
+    path = str(tmp_path / 'doc.bpd')
+    size = docfile.write(path, RESULT, codec)
+    assert size == (tmp_path / 'doc.bpd').stat().st_size
+    assert docfile.read(path) == _expected(RESULT)
+
+
+def test_single_page_and_metadata(tmp_path):
+    path = str(tmp_path / 'doc.bpd')
+    docfile.write(path, RESULT, docfile.CODEC_ZLIB)
+    with docfile.DocFile(path) as doc:
+        assert doc.num_pages == 3
+        assert doc.meta['path'] == RESULT['path']
+        assert doc.page(1) == RESULT['pages'][1]
+        with pytest.raises(IndexError):
+            doc.page(3)
+
+
+def test_not_a_docfile(tmp_path):
+    path = tmp_path / 'doc.bpd'
+    path.write_bytes(b'{"path": "x"}')
+    with pytest.raises(ValueError):
+        docfile.read(str(path))
@@ -0,0 +1,94 @@
+import sqlite3
+
+import pytest
+
+from bank_pdf import incremental
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """Record every prompt; answer with a numbered summary."""
+    prompts = []
+
+    def fake(prompt, endpoint, api_key):
+        prompts.append(prompt)
+        return {'json': {'summary': f'analysis {len(prompts)}'}}
+
+    monkeypatch.setattr(incremental, 'analyze_with_gemini', fake)
+    return prompts
+
+
+def _txn(date, description, amount, balance):
+    return {'date': date, 'description': description, 'amount': amount, 'balance': balance, 'direction': 'debit'}
+
+
+def _payload(txns, documents=()):
+    return {'statements': [], 'accounts': [{'account': '1234', 'transactions': list(txns)}],
+            'documents': list(documents)}
+
+
+MARCH = [_txn('2024-03-01', 'UPI/SWIGGY', 412.0, 45210.55), _txn('2024-03-02', 'UPI/ZOMATO', 210.0, 45000.55)]
+APRIL = [_txn('2024-04-03', 'ATM CASH WDL', 2000.0, 43000.55)]
+
+
+def test_second_run_sends_only_new_rows(tmp_path, llm):
+    db = str(tmp_path / 'users.db')
+    result, info = incremental.analyze_incremental(db, 'u1', _payload(MARCH), 'e', 'k')
+    assert result == {'summary': 'analysis 1'}
+    assert info['new_transactions'] == 2 and info['delta_periods'] == ['1234:2024-03']
+
+    # Nothing new: the stored analysis is returned without calling the LLM
+    result, info = incremental.analyze_incremental(db, 'u1', _payload(MARCH), 'e', 'k')
+    assert info['reused'] and result == {'summary': 'analysis 1'}
+    assert len(llm) == 1
+
+    # One new month: only its row goes out, with a summary of the stored one
+    result, info = incremental.analyze_incremental(db, 'u1', _payload(MARCH + APRIL), 'e', 'k')
+    assert info['delta_periods'] == ['1234:2024-04'] and info['new_transactions'] == 1
+    assert info['prior_periods'] == 1
+    assert 'ATM CASH WDL' in llm[-1] and 'UPI/SWIGGY' not in llm[-1]
+    assert result == {'summary': 'analysis 2'}
+
+
+def test_partial_month_adds_to_stored_rows(tmp_path, llm):
+    db = str(tmp_path / 'users.db')
+    incremental.analyze_incremental(db, 'u1', _payload(MARCH[:1]), 'e', 'k')
+    _, info = incremental.analyze_incremental(db, 'u1', _payload(MARCH), 'e', 'k')
+    assert info['new_transactions'] == 1
+    _, info = incremental.analyze_incremental(db, 'u1', _payload(MARCH[1:]), 'e', 'k')
+    assert info['reused']
+
+
+def test_documents_are_sent_once(tmp_path, llm):
+    db = str(tmp_path / 'users.db')
+    notes = {'path': 'a.pdf', 'pages': [{'page_number': 1, 'text': 'Reward points earned: 120'}]}
+    incremental.analyze_incremental(db, 'u1', _payload(MARCH, [notes]), 'e', 'k')
+    _, info = incremental.analyze_incremental(db, 'u1', _payload(MARCH, [notes]), 'e', 'k')
+    assert info['reused'] and len(llm) == 1
+
+    other = {'path': 'b.pdf', 'pages': [{'page_number': 1, 'text': 'Interest rate revised'}]}
+    _, info = incremental.analyze_incremental(db, 'u1', _payload(MARCH, [notes, other]), 'e', 'k')
+    assert info['new_documents'] == 1 and not info['reused']
+    assert 'Interest rate revised' in llm[-1] and 'Reward points' not in llm[-1]
+
+
+def test_full_analysis_starts_over(tmp_path, llm):
+    db = str(tmp_path / 'users.db')
+    incremental.analyze_incremental(db, 'u1', _payload(MARCH), 'e', 'k')
+    _, info = incremental.analyze_incremental(db, 'u1', _payload(MARCH), 'e', 'k', full=True)
+    assert info['new_transactions'] == 2 and info['prior_periods'] == 0
+    assert len(llm) == 2
+
+
+def test_failed_llm_call_stores_nothing(tmp_path, monkeypatch):
+    db = str(tmp_path / 'users.db')
+
+    def fail(prompt, endpoint, api_key):
+        raise RuntimeError('quota')
+
+    monkeypatch.setattr(incremental, 'analyze_with_gemini', fail)
+    with pytest.raises(RuntimeError):
+        incremental.analyze_incremental(db, 'u1', _payload(MARCH), 'e', 'k')
+    conn = sqlite3.connect(db)
+    assert conn.execute('SELECT COUNT(*) FROM analysis_periods').fetchone() == (0,)
+    conn.close()
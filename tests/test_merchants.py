@@ -0,0 +1,51 @@
+from bank_pdf.merchants import Classifier, compile_rules, normalize
+
+RULES = [
+    ('SALARY', 'Salary', 'income'),
+    ('ZOMATO', 'Zomato', 'food'),
+    ('AMAZON ?PRIME', 'Amazon Prime', 'subscriptions'),
+    ('AMAZON', 'Amazon', 'shopping'),
+]
+
+
+def _rule(rules, key):
+    m = compile_rules(rules).match(key)
+    return rules[int(m.lastgroup[1:])][1] if m else None
+
+
+def test_first_rule_wins_over_earliest_match():
+    # ZOMATO matches further left, but SALARY comes first in the rule list
+    assert _rule(RULES, 'ZOMATO SALARY') == 'Salary'
+    assert _rule(RULES, 'AMAZON PRIME VIDEO') == 'Amazon Prime'
+    assert _rule(RULES, 'AMAZON RETAIL') == 'Amazon'
+
+
+def test_custom_rules_take_precedence_over_builtin():
+    rules = [('KIRANA', 'Local grocer', 'groceries')] + RULES
+    assert _rule(rules, 'AMAZON KIRANA') == 'Local grocer'
+
+
+def test_no_rules_never_match():
+    assert _rule([], 'ANYTHING') is None
+    assert Classifier(rules=[]).classify('UPI/FOO/123456') == ('Foo', 'other')
+
+
+def test_normalize_strips_rails_and_references():
+    assert normalize('UPI/SWIGGY/418399561389/Payment') == 'SWIGGY'
+    assert normalize('POS 4521XXXX1234 DMART AVENUE') == 'DMART AVENUE'
+    assert normalize('NEFT-SALARY ACME CORP N123456789') == 'SALARY ACME CORP'
+
+
+def test_builtin_credit_card_payment():
+    # normalize drops PAYMENT, leaving just CC
+    assert Classifier(rules=None).classify('CC PAYMENT 4521XXXX1234') == ('Credit card payment', 'credit card')
+
+
+def test_unanswered_keys_stay_unknown():
+    c = Classifier(rules=RULES)
+    c.classify('UPI/FOO/123456')
+    c.classify('UPI/BAR/123456')
+    learned = c.resolve_unknown(lambda prompt: {'FOO': {'merchant': 'Foo Ltd', 'category': 'food'}})
+    assert learned == 1
+    assert c.classify('UPI/FOO/123456') == ('Foo Ltd', 'food')
+    assert list(c.unknown) == ['BAR']
@@ -0,0 +1,79 @@
+from bank_pdf.statements import consolidate, describe
+from bank_pdf.transactions import parse_line
+
+HEADER = 'HDFC BANK\nAccount No: XXXXXXXX1234\nStatement period: {start} to {end}\n'
+
+
+def _statement(path, start, end, rows, header_extra=''):
+    text = HEADER.format(start=start, end=end) + header_extra + '\n'.join(rows)
+    return {'path': path, 'metadata': {}, 'pages': [{'page_number': 1, 'text': text}]}
+
+
+JAN = ['05/01/2024  UPI/SWIGGY/4058/Payment   412.00   45,210.55',
+       '20/01/2024  NEFT-SALARY ACME   85,000.00 Cr  1,30,210.55']
+FEB = ['03/02/2024  UPI/ZOMATO/4058/Payment   210.00   1,30,000.55']
+MAR = ['11/03/2024  ATM CASH WDL   2,000.00   1,28,000.55']
+
+
+def test_parse_line():
+    txn = parse_line('05-Mar-24   NEFT-SALARY ACME CORP               85,000.00 Cr  1,30,210.55')
+    assert txn == {'date': '2024-03-05', 'description': 'NEFT-SALARY ACME CORP', 'amount': 85000.0,
+                   'balance': 130210.55, 'direction': 'credit'}
+    # A reference number in the narration is not an amount; a line without one is not a row
+    assert parse_line('01/03/2024  UPI/4058123/Payment  412.00')['amount'] == 412.0
+    assert parse_line('Statement period: 01/03/2024 to 31/03/2024') is None
+
+
+def test_quarterly_absorbs_monthly():
+    docs = [
+        _statement('jan.pdf', '01/01/2024', '31/01/2024', JAN),
+        _statement('feb.pdf', '01/02/2024', '29/02/2024', FEB),
+        _statement('q1.pdf', '01/01/2024', '31/03/2024', JAN + FEB + MAR),
+    ]
+    payload = consolidate(docs)
+    [account] = payload['accounts']
+    assert account['account'] == '1234'
+    assert (account['period_from'], account['period_to']) == ('2024-01-01', '2024-03-31')
+    assert len(account['transactions']) == 4
+    new = {s['path']: s['new_transactions'] for s in payload['statements']}
+    assert new == {'q1.pdf': 4, 'jan.pdf': 0, 'feb.pdf': 0}
+    assert {s['path'] for s in payload['skipped']} == {'jan.pdf', 'feb.pdf'}
+
+
+def test_repeated_rows_within_one_statement_are_kept():
+    twice = ['05/01/2024  UPI/SWIGGY/4058/Payment   412.00',
+             '05/01/2024  UPI/SWIGGY/4058/Payment   412.00']
+    docs = [
+        _statement('a.pdf', '01/01/2024', '31/01/2024', twice),
+        # Overlapping statement with the payment once: nothing new
+        _statement('b.pdf', '01/01/2024', '15/01/2024', twice[:1]),
+    ]
+    payload = consolidate(docs)
+    assert len(payload['accounts'][0]['transactions']) == 2
+    # Three times in a later statement: one more
+    docs.append(_statement('c.pdf', '01/01/2024', '20/01/2024', twice + twice[:1]))
+    assert len(consolidate(docs)['accounts'][0]['transactions']) == 3
+
+
+def test_identical_documents_are_dropped():
+    doc = _statement('a.pdf', '01/01/2024', '31/01/2024', JAN)
+    payload = consolidate([doc, dict(doc, path='copy.pdf')])
+    assert payload['skipped'] == [{'path': 'copy.pdf', 'reason': 'duplicate of a.pdf'}]
+
+
+def test_non_row_text_is_kept():
+    doc = _statement('a.pdf', '01/01/2024', '31/01/2024', JAN, 'Opening Balance : 45,622.55\n')
+    doc['pages'].append({'page_number': 2, 'text': 'HDFC BANK\nReward points earned: 120'})
+    [passthrough] = consolidate([doc])['documents']
+    text = '\n'.join(p['text'] for p in passthrough['pages'])
+    assert 'Reward points earned: 120' in text
+    assert text.count('HDFC BANK') == 1
+    assert 'SWIGGY' not in text
+
+
+def test_opening_balance():
+    stated = describe(_statement('a.pdf', '01/01/2024', '31/01/2024', JAN, 'Opening Balance : 45,622.55\n'))
+    assert stated['opening_balance'] == 45622.55
+    assert stated['closing_balance'] == 130210.55
+    # Not stated, and the first row's direction is unknown
+    assert describe(_statement('b.pdf', '01/01/2024', '31/01/2024', JAN))['opening_balance'] is None
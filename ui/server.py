@@ -1,44 +1,29 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+import io
 import sqlite3
+import sys
 import uuid
 import os
 
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-DB_PATH = os.path.join(PROJECT_ROOT, "users.db")
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+# Shared user helpers live in the bank_pdf package at the project root
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+from bank_pdf import users as users_store
+from bank_pdf import search as search_index
+from bank_pdf.transactions import parse_date
 
-    # Users table with only user_id as PK
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        user_id TEXT PRIMARY KEY,
-        full_name TEXT,
-        dob TEXT,
-        mobile TEXT
-    )
-    ''')
-
-    # User banks table (many banks per user)
-    c.execute('''
-    CREATE TABLE IF NOT EXISTS user_banks (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT NOT NULL,
-        bank_name TEXT NOT NULL,
-        first_seen_at TEXT DEFAULT (datetime('now')),
-        FOREIGN KEY (user_id) REFERENCES users(user_id)
-    )
-    ''')
-
-    # Prevent duplicates (user_id + bank_name)
-    c.execute('''
-    CREATE UNIQUE INDEX IF NOT EXISTS idx_user_bank_unique
-    ON user_banks (user_id, bank_name)
-    ''')
+# users.db at the project root, or BANK_PDF_DB
+DB_PATH = users_store.DEFAULT_DB_PATH
 
-    conn.commit()
+def init_db():
+    conn = sqlite3.connect(DB_PATH)
+    # users (user_id PK) + user_banks (many banks per user, unique per user/bank)
+    users_store.ensure_schema(conn)
+    # statement_pages / statement_transactions + their FTS indexes for /search
+    search_index.ensure_schema(conn)
     conn.close()
 
 
@@ -58,15 +43,24 @@ def create_user():
     if not full_name or not mobile or not dob:
         return jsonify({'error': 'missing required fields'}), 400
 
+    # Normalize once here so the CLI never has to re-parse DOB/phone per run
+    full_name = full_name.strip()
+    dob = users_store.normalize_dob(dob)
+    if dob is None:
+        return jsonify({'error': 'invalid dob'}), 400
+    mobile = users_store.normalize_mobile(mobile)
+    if mobile is None:
+        return jsonify({'error': 'invalid mobile'}), 400
+
     user_id = str(uuid.uuid4())
 
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
 
-    # Insert user only
+    # Insert user with precomputed password-candidate features
     c.execute(
-        'INSERT INTO users (user_id, full_name, dob, mobile) VALUES (?, ?, ?, ?)',
-        (user_id, full_name, dob, mobile)
+        'INSERT INTO users (user_id, full_name, dob, mobile, pw_features) VALUES (?, ?, ?, ?, ?)',
+        (user_id, full_name, dob, mobile, users_store.features_json(full_name, dob, mobile))
     )
 
     conn.commit()
@@ -75,32 +69,105 @@ def create_user():
     return jsonify({'status': 'ok', 'user_id': user_id}), 201
 
 
+@app.route('/users/bulk', methods=['POST'])
+def bulk_create_users():
+    """Import many users from a CSV (text/csv) or JSON-lines body.
+
+    The body is streamed and inserted in batched transactions; invalid rows are
+    reported individually instead of failing the whole request.
+    """
+    content_type = (request.mimetype or '').lower()
+    fmt = 'csv' if content_type in ('text/csv', 'application/csv') else 'jsonl'
+    try:
+        batch_size = int(request.args.get('batch_size', 5000))
+    except ValueError:
+        return jsonify({'error': 'batch_size must be an integer'}), 400
+    if batch_size < 1:
+        return jsonify({'error': 'batch_size must be at least 1'}), 400
+
+    stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        summary = users_store.import_users(conn, users_store.iter_user_records(stream, fmt), batch_size)
+    finally:
+        conn.close()
+
+    return jsonify({'status': 'ok', **summary}), 200
+
+
+# Fields a client may ask for via ?fields=... on the user listing
+USER_FIELDS = ('user_id', 'full_name', 'dob', 'mobile', 'banks')
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
 @app.route('/users', methods=['GET'])
 def list_users():
+    """List users one page at a time.
+
+    Query params:
+      - `limit`: page size (default 100, max 1000)
+      - `after`: cursor returned as `next_cursor` by the previous page
+      - `fields`: comma separated subset of USER_FIELDS
+
+    Banks are folded in with GROUP_CONCAT so a page costs one query. The
+    response carries an ETag; clients sending it back in If-None-Match get a
+    304 when the page has not changed.
+    """
+    try:
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        after = int(request.args.get('after', 0))
+    except ValueError:
+        return jsonify({'error': 'limit and after must be integers'}), 400
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    fields = USER_FIELDS
+    if request.args.get('fields'):
+        fields = tuple(f.strip() for f in request.args['fields'].split(',') if f.strip())
+        unknown = [f for f in fields if f not in USER_FIELDS]
+        if unknown:
+            return jsonify({'error': 'unknown fields: ' + ', '.join(unknown)}), 400
+
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
 
-    c.execute('SELECT user_id, full_name, dob, mobile FROM users')
+    # Page over rowid first so the join only touches the rows being returned.
+    # Bank names are separated with the ASCII unit separator to stay unambiguous.
+    if 'banks' in fields:
+        c.execute(
+            "SELECT u.rowid, u.user_id, u.full_name, u.dob, u.mobile, "
+            "GROUP_CONCAT(b.bank_name, char(31)) "
+            "FROM (SELECT rowid, user_id, full_name, dob, mobile FROM users "
+            "      WHERE rowid > ? ORDER BY rowid LIMIT ?) u "
+            "LEFT JOIN user_banks b ON b.user_id = u.user_id "
+            "GROUP BY u.rowid ORDER BY u.rowid",
+            (after, limit)
+        )
+    else:
+        c.execute(
+            'SELECT rowid, user_id, full_name, dob, mobile, NULL FROM users '
+            'WHERE rowid > ? ORDER BY rowid LIMIT ?',
+            (after, limit)
+        )
     rows = c.fetchall()
+    conn.close()
 
     users = []
     for row in rows:
-        user_id = row[0]
+        record = {
+            'user_id': row[1],
+            'full_name': row[2],
+            'dob': row[3],
+            'mobile': row[4],
+            'banks': row[5].split('\x1f') if row[5] else []
+        }
+        users.append({f: record[f] for f in fields})
 
-        # Fetch banks for the user
-        c.execute('SELECT bank_name FROM user_banks WHERE user_id=?', (user_id,))
-        banks = [b[0] for b in c.fetchall()]
+    next_cursor = str(rows[-1][0]) if len(rows) == limit else None
 
-        users.append({
-            'user_id': user_id,
-            'full_name': row[1],
-            'dob': row[2],
-            'mobile': row[3],
-            'banks': banks
-        })
-
-    conn.close()
-    return jsonify(users)
+    resp = jsonify({'users': users, 'next_cursor': next_cursor})
+    resp.add_etag()
+    return resp.make_conditional(request)
 
 
 @app.route('/users/<user_id>', methods=['GET'])
@@ -131,6 +198,52 @@ def get_user(user_id):
     })
 
 
+MAX_SEARCH_RESULTS = 500
+
+
+@app.route('/search', methods=['GET'])
+def search_statements():
+    """Search extracted statements.
+
+    Query params:
+      - `q`: words to match (prefix match), e.g. a merchant name
+      - `user_id`, `bank`: optional filters
+      - `from`, `to`: transaction date range (yyyy-mm-dd or dd/mm/yyyy)
+      - `type`: `transactions` (default) or `pages`
+      - `limit`: max results (default 50, max 500)
+    """
+    kind = request.args.get('type', 'transactions')
+    if kind not in ('transactions', 'pages'):
+        return jsonify({'error': 'type must be transactions or pages'}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), MAX_SEARCH_RESULTS))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    dates = {}
+    for key in ('from', 'to'):
+        raw = request.args.get(key)
+        dates[key] = parse_date(raw) if raw else None
+        if raw and dates[key] is None:
+            return jsonify({'error': f'invalid {key} date'}), 400
+
+    query = request.args.get('q', '')
+    user_id = request.args.get('user_id') or None
+    bank = request.args.get('bank') or None
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        if kind == 'pages':
+            results = search_index.search_pages(conn, query, user_id, bank, dates['from'], dates['to'], limit)
+            body = {'results': results}
+        else:
+            results = search_index.search_transactions(conn, query, user_id, bank, dates['from'], dates['to'], limit)
+            # Totals cover every match, not just the rows returned
+            totals = search_index.totals(conn, query, user_id, bank, dates['from'], dates['to'])
+            body = {'results': results, 'totals': totals}
+    finally:
+        conn.close()
+    return jsonify(body)
+
+
 if __name__ == '__main__':
     init_db()
     app.run(port=5000, debug=True)
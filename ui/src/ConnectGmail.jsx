@@ -1,7 +1,113 @@
-import React from "react";
+import React, { useEffect, useState } from "react";
+
+const API = "http://localhost:8000";
+
+// Events pushed by the ingestion server for one job (see /jobs/<id>/events)
+const EVENTS = ["started", "found", "downloaded", "unlocked", "extracted", "document_failed", "progress", "analyzed", "done", "failed"];
+
+function Progress({ jobId }) {
+  const [status, setStatus] = useState("connecting");
+  const [counts, setCounts] = useState({ messages: 0, downloaded: 0 });
+  const [docs, setDocs] = useState([]);
+  const [analysis, setAnalysis] = useState(null);
+  const [error, setError] = useState("");
+
+  useEffect(() => {
+    const source = new EventSource(`${API}/jobs/${jobId}/events`);
+
+    // Documents are keyed by attachment uuid; each event updates one row in place
+    const updateDoc = (uuid, fields) =>
+      setDocs((prev) => {
+        const i = prev.findIndex((d) => d.uuid === uuid);
+        if (i === -1) return [...prev, { uuid, ...fields }];
+        const next = prev.slice();
+        next[i] = { ...next[i], ...fields };
+        return next;
+      });
+
+    const handlers = {
+      started: () => setStatus("running"),
+      found: () => setCounts((c) => ({ ...c, found: (c.found || 0) + 1 })),
+      downloaded: (d) => updateDoc(d.uuid, { filename: d.filename, bank: d.bank, stage: "downloaded" }),
+      unlocked: (d) => updateDoc(d.uuid, { stage: "unlocked" }),
+      extracted: (d) => updateDoc(d.uuid, { ...d, stage: "extracted" }),
+      document_failed: (d) => updateDoc(d.uuid, { filename: d.filename, stage: "failed", error: d.error }),
+      progress: (d) => setCounts((c) => ({ ...c, ...d })),
+      analyzed: (d) => setAnalysis(d),
+      done: (d) => {
+        setCounts((c) => ({ ...c, ...d }));
+        setStatus("done");
+        source.close();
+      },
+      failed: (d) => {
+        setError(d.error);
+        setStatus("failed");
+        source.close();
+      },
+    };
+    EVENTS.forEach((name) =>
+      source.addEventListener(name, (e) => handlers[name](JSON.parse(e.data)))
+    );
+    // EventSource reconnects by itself and resumes from the last event id
+    source.onerror = () => setStatus((s) => (s === "done" || s === "failed" ? s : "reconnecting"));
+
+    return () => source.close();
+  }, [jobId]);
+
+  return (
+    <div>
+      <p>
+        Status: <b>{status}</b> — {counts.messages} emails scanned, {counts.found || 0} statements found,{" "}
+        {counts.downloaded} PDFs downloaded
+      </p>
+      {error && <p className="msg">Error: {error}</p>}
+
+      {docs.length > 0 && (
+        <table>
+          <thead>
+            <tr>
+              <th>File</th>
+              <th>Bank</th>
+              <th>Stage</th>
+              <th>Account</th>
+              <th>Period</th>
+              <th>Pages</th>
+              <th>Transactions</th>
+            </tr>
+          </thead>
+          <tbody>
+            {docs.map((d) => (
+              <tr key={d.uuid}>
+                <td>{d.filename}</td>
+                <td>{d.bank}</td>
+                <td>{d.stage === "failed" ? `failed: ${d.error}` : d.stage}</td>
+                <td>{d.account ? `XXXX${d.account}` : ""}</td>
+                <td>{d.period_from ? `${d.period_from} – ${d.period_to}` : ""}</td>
+                <td>{d.pages ?? ""}</td>
+                <td>{d.transactions ? d.transactions.length : ""}</td>
+              </tr>
+            ))}
+          </tbody>
+        </table>
+      )}
+
+      {analysis && (
+        <div style={{ marginTop: "20px" }}>
+          <h2>Analysis</h2>
+          {analysis.skipped && <p>Skipped: {analysis.skipped}</p>}
+          {analysis.error && <p className="msg">Analysis failed: {analysis.error}</p>}
+          {analysis.summary && <p>{analysis.summary}</p>}
+          {analysis.result && <pre>{JSON.stringify(analysis.result, null, 2)}</pre>}
+        </div>
+      )}
+    </div>
+  );
+}
 
 export default function ConnectGmail() {
   const userId = localStorage.getItem("user_id");
+  // The OAuth callback redirects back here with ?job=<id>
+  const jobId = new URLSearchParams(window.location.search).get("job");
 
   const handleGoogleLogin = () => {
     if (!userId) {
@@ -9,7 +115,7 @@ export default function ConnectGmail() {
       return;
     }
 
-    window.location.href = `http://localhost:8000/auth?user_id=${userId}`;
+    window.location.href = `${API}/auth?user_id=${userId}`;
   };
 
   return (
@@ -17,30 +123,34 @@ export default function ConnectGmail() {
       <h1>Connect Your Gmail</h1>
       <p>Your user ID: {userId}</p>
 
-      <button
-        onClick={handleGoogleLogin}
-        style={{
-          display: "flex",
-          alignItems: "center",
-          gap: "10px",
-          padding: "10px 18px",
-          backgroundColor: "white",
-          border: "1px solid #dadce0",
-          borderRadius: "6px",
-          cursor: "pointer",
-          fontSize: "15px",
-          fontWeight: "500",
-          fontFamily: "Arial",
-          boxShadow: "0 1px 2px rgba(0,0,0,0.1)"
-        }}
-      >
-        <img
-          src="https://developers.google.com/identity/images/g-logo.png"
-          alt="Google Logo"
-          style={{ width: "20px", height: "20px" }}
-        />
-        <span>Sign in with Google</span>
-      </button>
+      {jobId ? (
+        <Progress jobId={jobId} />
+      ) : (
+        <button
+          onClick={handleGoogleLogin}
+          style={{
+            display: "flex",
+            alignItems: "center",
+            gap: "10px",
+            padding: "10px 18px",
+            backgroundColor: "white",
+            border: "1px solid #dadce0",
+            borderRadius: "6px",
+            cursor: "pointer",
+            fontSize: "15px",
+            fontWeight: "500",
+            fontFamily: "Arial",
+            boxShadow: "0 1px 2px rgba(0,0,0,0.1)"
+          }}
+        >
+          <img
+            src="https://developers.google.com/identity/images/g-logo.png"
+            alt="Google Logo"
+            style={{ width: "20px", height: "20px" }}
+          />
+          <span>Sign in with Google</span>
+        </button>
+      )}
     </div>
   );
 }